@@ -0,0 +1,121 @@
+# admission.py
+# 准入控制：限制同时打到 Ollama 的轮次数，超出的排队，队列满或等待超时则直接拒绝（快速失败）
+#   - 单个本地 Ollama 的并行度有限（OLLAMA_NUM_PARALLEL），无限并发只会让所有人一起变慢
+#   - 基于 asyncio，排队不占线程；按 FIFO 放行
+#   - 统计：在途数、队列深度、放行/拒绝/超时次数、排队等待分位数（经 tracing 导出到 /metrics）
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+import asyncio
+import time
+
+import tracing
+
+DEFAULT_MAX_INFLIGHT = 4            # 与 Ollama 的 OLLAMA_NUM_PARALLEL 对齐
+DEFAULT_MAX_QUEUE = 32              # 排队上限，超出直接拒绝
+DEFAULT_QUEUE_TIMEOUT = 30.0        # 秒：排队超过此时长放弃
+
+
+class Overloaded(Exception):
+    """准入被拒绝：队列已满或排队超时"""
+
+    def __init__(self, reason: str, queued: int):
+        super().__init__(f"overloaded ({reason}), queue depth {queued}")
+        self.reason = reason
+        self.queued = queued
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = DEFAULT_MAX_INFLIGHT, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: Optional[float] = DEFAULT_QUEUE_TIMEOUT, name: str = "admission"):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self.admitted = 0
+        self.queued_total = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.max_queue_seen = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    async def acquire(self) -> float:
+        """取得一个执行名额，返回排队等待秒数；无法放行时抛 Overloaded"""
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            tracing.observe(f"{self.name}_wait", 0.0)
+            return 0.0
+
+        depth = self.queue_depth
+        if depth >= self.max_queue:
+            self.shed += 1
+            raise Overloaded("queue_full", depth)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.queued_total += 1
+        self.max_queue_seen = max(self.max_queue_seen, depth + 1)
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                self._release_one()         # 超时的同时恰好被放行：把名额转给下一位
+            fut.cancel()
+            self.timeouts += 1
+            self.shed += 1
+            raise Overloaded("queue_timeout", self.queue_depth)
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                self._release_one()
+            fut.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        waited = time.perf_counter() - t0
+        self.admitted += 1
+        tracing.observe(f"{self.name}_wait", waited)
+        return waited
+
+    def _release_one(self) -> None:
+        # 名额直接转交给队首仍在等待的请求（inflight 不变）；没有等待者才归还
+        for fut in self._waiters:
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.inflight -= 1
+
+    def release(self) -> None:
+        self._release_one()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        waited = await self.acquire()
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "queue_depth": self.queue_depth,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "max_queue_seen": self.max_queue_seen,
+        }
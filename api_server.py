@@ -0,0 +1,439 @@
+# api_server.py
+# 无界面的议价 HTTP/JSON 服务（商城前端等机器客户端接入用，与 Gradio 调试台分开）：
+#   POST   /sessions               {"sku":"SKU000123"} 按商品目录开会话（价格参数 / 价值点 / 人设取自目录），
+#                                  或手填 {"list_price":500,"bar_price":400,"stop_floor":420,"max_concessions":5,
+#                                  "value_reasons":["正品保障与售后"]}；均可省略，与 sku 同传时覆盖目录值 → 201 {"session_id","state"}
+#   GET    /sessions/{id}          → {"session_id","state","turns"}
+#   POST   /sessions/{id}/turn     {"text":"450行不行","stream":false} → {"reply","state","user_summary","trace_ms"}
+#                                  stream=true 时返回 NDJSON（分块传输），每行一个事件：
+#                                  {"event":"state",...} → {"event":"delta","text":...}* → {"event":"done","reply":...}
+#   POST   /sessions/{id}/confirm  → {"session_id","state"}
+#   DELETE /sessions/{id}          → 204
+#   GET    /catalog/{sku}          → 目录条目（ctx 配置模板 + 合同骨架）
+#   GET    /healthz、GET /metrics（Prometheus 文本格式）
+# 标准库 ThreadingHTTPServer（HTTP/1.1 keep-alive），每个请求一个线程，走同步流水线（run_fsm_turn → nlg_from_core_view）。
+#   - 冷启动：fsm / bridge / llama（连带 transitions、pydantic、httpx）在首次用到时才导入，进程启动即可监听；
+#     OLLAMA_WARM_UP=1 时后台线程提前导入并预热模型
+#   - 会话存 session_store（记录格式与调试台一致）；同一会话的请求按会话串行（进程内）
+#   - 同时在跑的轮次不超过 API_MAX_INFLIGHT，排队超过 API_QUEUE_TIMEOUT 秒返回 503
+#   - 出错统一返回 {"error": "..."}
+# 启动：python api_server.py（端口 API_PORT，默认 8000）
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import unquote
+import json
+import os
+import re
+import threading
+import time
+
+from session_store import open_store
+import catalog
+import tracing
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_MAX_INFLIGHT = int(os.getenv("API_MAX_INFLIGHT", os.getenv("OLLAMA_MAX_INFLIGHT", "4")))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))       # 秒
+MAX_BODY_BYTES = 64 * 1024
+MAX_TEXT_CHARS = 2000
+CHAT_CAP = 200                      # 会话记录里保留的最近对话轮数
+
+SESSION_STORE_URL = os.getenv("SESSION_STORE", "memory")
+SESSION_IDLE_TTL = 30 * 60          # 秒
+SESSIONS = open_store(SESSION_STORE_URL, idle_ttl=SESSION_IDLE_TTL)
+
+WARM_UP = os.getenv("OLLAMA_WARM_UP", "1") == "1"
+DEFAULT_VALUE_REASONS = ["正品保障与售后", "做工与用料优于同级"]
+# 创建会话时可覆盖的 NegotiationCtx 配置项
+CTX_FIELDS = ("list_price", "bar_price", "stop_floor", "max_concessions",
+              "fraction_towards_user", "round_base", "min_tick")
+# 其中必须是整数的项及下限（max_concessions=0 表示不让价）
+_INT_MINIMUMS = {"list_price": 1, "bar_price": 1, "stop_floor": 1, "max_concessions": 0,
+                 "round_base": 1, "min_tick": 1}
+
+_ROUTE_RE = re.compile(r"^/sessions/([0-9a-f]{32})(?:/(turn|confirm))?$")
+_CATALOG_RE = re.compile(r"^/catalog/([^/]+)$")
+_SLOTS = threading.BoundedSemaphore(API_MAX_INFLIGHT)
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ApiStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.turns = 0
+        self.streams = 0
+        self.errors = 0
+        self.rejected = 0           # 排队超时（503）
+        self.inflight = 0
+
+    def add(self, **deltas: int) -> None:
+        with self._lock:
+            for name, d in deltas.items():
+                setattr(self, name, getattr(self, name) + d)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "turns": self.turns, "streams": self.streams,
+                    "errors": self.errors, "rejected": self.rejected, "inflight": self.inflight,
+                    "max_inflight": API_MAX_INFLIGHT, "sessions": len(SESSIONS)}
+
+
+STATS = ApiStats()
+tracing.register_gauges("api", STATS.as_dict)
+
+
+# ====== 流水线（延迟导入）======
+_PIPELINE: Optional[SimpleNamespace] = None
+_PIPELINE_LOCK = threading.Lock()
+
+
+def pipeline() -> SimpleNamespace:
+    global _PIPELINE
+    if _PIPELINE is None:
+        with _PIPELINE_LOCK:
+            if _PIPELINE is None:
+                t0 = time.perf_counter()
+                import bridge
+                import llama
+                import speculative
+                from fsm import CompiledNegotiationModel, NegotiationCtx
+                _PIPELINE = SimpleNamespace(bridge=bridge, llama=llama, speculative=speculative,
+                                            Model=CompiledNegotiationModel, Ctx=NegotiationCtx)
+                tracing.observe("api_import", time.perf_counter() - t0)
+    return _PIPELINE
+
+
+def warm_up() -> None:
+    p = pipeline()
+    for name, fn in (("extract", p.bridge.warm_up), ("nlg", p.llama.warm_up)):
+        try:
+            fn()
+        except Exception as e:
+            print(f"[warm-up] {name} 失败：{e}")
+
+
+# ====== 会话 ======
+class _SessionLocks:
+    """每个会话一把锁，只在有请求持有 / 等待时存在：同一会话串行，不同会话互不阻塞（一轮慢生成不拖累别的会话）"""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks: Dict[str, List[Any]] = {}       # session_id -> [lock, 持有与等待的请求数]
+
+    @contextmanager
+    def hold(self, session_id: str) -> Iterator[None]:
+        with self._mutex:
+            entry = self._locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._mutex:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[session_id]
+
+
+_SESSION_LOCKS = _SessionLocks()
+
+
+def _session_lock(session_id: str):
+    return _SESSION_LOCKS.hold(session_id)
+
+
+def _load(session_id: str):
+    record = SESSIONS.get(session_id)
+    if record is None:
+        raise ApiError(404, "session not found or expired")
+    return record, pipeline().Model.load_state(record["fsm"])
+
+
+def _save(session_id: str, record: Dict[str, Any], fsm) -> None:
+    record["fsm"] = fsm.dump_state()
+    record["chat"] = record.get("chat", [])[-CHAT_CAP:]
+    SESSIONS.put(session_id, record)
+
+
+def _value_reasons(value: Any) -> Optional[List[str]]:
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(r, str) for r in value):
+        raise ApiError(400, "value_reasons must be a list of strings")
+    return [r.strip() for r in value if r.strip()] or None
+
+
+def _check_ctx(ctx) -> None:
+    """校验合并后的完整配置（目录值 + 覆盖值）：不合法在建会话时就返回 400，而不是首轮 /turn 才 500"""
+    for k, low in _INT_MINIMUMS.items():
+        v = getattr(ctx, k)
+        if isinstance(v, bool) or not isinstance(v, int):
+            raise ApiError(400, f"{k} must be an integer")
+        if v < low:
+            raise ApiError(400, f"{k} must be >= {low}")
+    if not ctx.bar_price <= ctx.stop_floor <= ctx.list_price:
+        raise ApiError(400, "stop_floor must be between bar_price and list_price")
+    if not 0 <= ctx.fraction_towards_user < 1:
+        raise ApiError(400, "fraction_towards_user must be in [0, 1)")
+
+
+def create_session(body: Dict[str, Any]) -> Dict[str, Any]:
+    p = pipeline()
+    config = {k: body[k] for k in CTX_FIELDS if body.get(k) is not None}
+    for k, v in config.items():
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            raise ApiError(400, f"{k} must be a number")
+    sku = body.get("sku")
+    entry = None
+    if sku is not None:
+        if not isinstance(sku, str) or not sku:
+            raise ApiError(400, "sku must be a non-empty string")
+        entry = catalog.lookup(sku)
+        if entry is None:
+            raise ApiError(404, f"sku not found: {sku}")
+    try:
+        fsm = p.Model(p.Ctx.for_sku(sku, **config) if entry is not None else p.Ctx(**config))
+    except (TypeError, ValueError) as e:
+        raise ApiError(400, str(e))
+    _check_ctx(fsm.ctx)
+    session_id = SESSIONS.new_id()
+    reasons = _value_reasons(body.get("value_reasons"))
+    if reasons is None:
+        reasons = list(entry.value_reasons) if entry is not None else DEFAULT_VALUE_REASONS
+    record = {"chat": [], "value_reasons": reasons}
+    _save(session_id, record, fsm)
+    return {"session_id": session_id, "state": fsm.snapshot()}
+
+
+def get_session(session_id: str) -> Dict[str, Any]:
+    record, fsm = _load(session_id)
+    return {"session_id": session_id, "state": fsm.snapshot(), "turns": len(record.get("chat", []))}
+
+
+def confirm_session(session_id: str) -> Dict[str, Any]:
+    with _session_lock(session_id):
+        record, fsm = _load(session_id)
+        snap = fsm.confirm_deal()
+        _save(session_id, record, fsm)
+    return {"session_id": session_id, "state": snap}
+
+
+def delete_session(session_id: str) -> None:
+    with _session_lock(session_id):
+        if SESSIONS.get(session_id) is None:
+            raise ApiError(404, "session not found or expired")
+        SESSIONS.delete(session_id)
+
+
+# ====== HTTP ======
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "csbot-api"
+
+    def log_message(self, *args):
+        pass
+
+    # —— 响应 —— #
+    def _send_json(self, status: int, obj: Optional[Dict[str, Any]] = None) -> None:
+        body = b"" if obj is None else json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        if obj is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _event(self, obj: Dict[str, Any]) -> None:
+        data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True            # 不读超大请求体，直接断开
+            raise ApiError(413, "request body too large")
+        raw = self.rfile.read(length) if length else b""
+        if not raw.strip():
+            return {}
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            raise ApiError(400, "invalid JSON body")
+        if not isinstance(body, dict):
+            raise ApiError(400, "JSON body must be an object")
+        return body
+
+    # —— 路由 —— #
+    def _dispatch(self, method: str) -> None:
+        STATS.add(requests=1)
+        try:
+            path = self.path.split("?", 1)[0].rstrip("/") or "/"
+            body = self._body()                 # 总是读完请求体，keep-alive 连接上的下一个请求才能对齐
+            if path == "/healthz" and method == "GET":
+                return self._send_json(200, {"ok": True, "pipeline_loaded": _PIPELINE is not None})
+            if path == "/metrics" and method == "GET":
+                data = tracing.metrics_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            if path == "/sessions" and method == "POST":
+                return self._send_json(201, create_session(body))
+            m = _CATALOG_RE.match(path)
+            if m is not None and method == "GET":
+                entry = catalog.lookup(unquote(m.group(1)))
+                if entry is None:
+                    raise ApiError(404, "sku not found")
+                return self._send_json(200, entry.as_dict())
+            m = _ROUTE_RE.match(path)
+            if m is None:
+                raise ApiError(404, "not found")
+            session_id, action = m.groups()
+            if action is None and method == "GET":
+                return self._send_json(200, get_session(session_id))
+            if action is None and method == "DELETE":
+                delete_session(session_id)
+                return self._send_json(204)
+            if action == "confirm" and method == "POST":
+                return self._send_json(200, confirm_session(session_id))
+            if action == "turn" and method == "POST":
+                return self._turn(session_id, body)
+            raise ApiError(405, "method not allowed")
+        except ApiError as e:
+            STATS.add(errors=1, rejected=int(e.status == 503))
+            self._send_json(e.status, {"error": e.message})
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception as e:
+            STATS.add(errors=1)
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    # —— 一轮对话 —— #
+    def _turn(self, session_id: str, body: Dict[str, Any]) -> None:
+        text = body.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ApiError(400, "text is required")
+        if len(text) > MAX_TEXT_CHARS:
+            raise ApiError(400, f"text longer than {MAX_TEXT_CHARS} characters")
+        stream = bool(body.get("stream"))
+        p = pipeline()
+        with _session_lock(session_id):
+            record, fsm = _load(session_id)
+            reasons = _value_reasons(body.get("value_reasons")) or record.get("value_reasons") or DEFAULT_VALUE_REASONS
+            if not _SLOTS.acquire(timeout=API_QUEUE_TIMEOUT):
+                raise ApiError(503, "too many concurrent turns, retry later")
+            STATS.add(inflight=1, turns=1, streams=int(stream))
+            try:
+                self._run_turn(p, session_id, record, fsm, text, reasons, stream)
+            finally:
+                STATS.add(inflight=-1)
+                _SLOTS.release()
+
+    def _run_turn(self, p, session_id, record, fsm, text, reasons, stream) -> None:
+        trace = tracing.start_turn(session_id)
+        try:
+            self._run_traced(p, session_id, record, fsm, text, reasons, stream, trace)
+        finally:
+            tracing.end_turn(trace)             # 工作线程会被下一个请求复用：复位当前轮
+
+    def _run_traced(self, p, session_id, record, fsm, text, reasons, stream, trace) -> None:
+        deltas: Optional[Iterator[str]] = None
+        if p.speculative.SPECULATIVE_NLG:
+            out, deltas = p.speculative.run_turn(fsm, text, reasons, trace=trace)
+        else:
+            out = p.bridge.run_fsm_turn(fsm, text)
+        _save(session_id, record, fsm)          # FSM 先落盘：话术阶段出错也不丢本轮状态
+
+        if not stream:
+            if deltas is not None:
+                reply = "".join(deltas)
+            else:
+                reply = p.llama.nlg_from_core_view(text, out["core_view"], value_reasons=reasons)
+            self._finish_turn(session_id, record, fsm, text, reply, trace)
+            return self._send_json(200, {"session_id": session_id, "reply": reply, "state": out["fsm_snapshot"],
+                                         "user_summary": out["user_summary"], "trace_ms": trace.total_ms})
+
+        if deltas is None:
+            deltas = p.llama.nlg_stream_from_core_view(text, out["core_view"], value_reasons=reasons, trace=trace)
+        self._start_stream()
+        reply = ""
+        try:
+            self._event({"event": "state", "session_id": session_id, "state": out["fsm_snapshot"],
+                         "user_summary": out["user_summary"]})
+            for delta in deltas:
+                reply += delta
+                self._event({"event": "delta", "text": delta})
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception as e:
+            # 响应头已发出：错误作为最后一个事件下发
+            STATS.add(errors=1)
+            self._event({"event": "error", "error": f"{type(e).__name__}: {e}"})
+            self._end_stream()
+            return
+        finally:
+            close = getattr(deltas, "close", None)
+            if close is not None:
+                close()                         # 客户端断开时尽快停止生成
+            self._finish_turn(session_id, record, fsm, text, reply, trace)
+        self._event({"event": "done", "reply": reply, "trace_ms": trace.total_ms})
+        self._end_stream()
+
+    @staticmethod
+    def _finish_turn(session_id, record, fsm, text, reply, trace) -> None:
+        record.setdefault("chat", []).append([text, reply])
+        _save(session_id, record, fsm)
+        trace.finish()
+
+
+def serve(host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    httpd = serve()
+    print(f"[api] listening on http://{API_HOST}:{API_PORT}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
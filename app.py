@@ -6,8 +6,13 @@ Gradio 调试台：议价机器人 (Bargaining Bot Debugger) · 极简清爽版
 特点：
 - 顶部宽屏对话区（输入框 + 发送按钮与对话框在一起）。
 - 聊天气泡保留但**无背景色**，白底黑字；尽量减少色块。
-- **已修复历史丢失**：使用 st_history 显式回传与保存，保证多轮对话可见。
+- **已修复历史丢失**：对话历史与 FSM 状态一起保存在会话存储（session_store）中，保证多轮对话可见。
+- 会话状态不依赖进程内 gr.State：页面只持有 session_id，多个 worker 可共享同一会话，重启可恢复（SQLite 后端）。
 - 下方参数区与调试区：同时查看最新与历史的 Contract/CoreView。
+- 参数区可按 SKU 从商品目录（catalog）载入价格参数与价值点，会话合同里的商品名/人设随之取自目录。
+- 参数区实时预览让价阶梯（policy.compile_policy 预编译，按配置缓存），开始会话前即可核对配置。
+- 可选推测式话术（SPECULATIVE_NLG=1）：按本地猜测的价格预跑话术，与抽取 LLM 并发。
+- 回调为 async：Ollama 调用不占 worker 线程；准入控制限制同时打到 Ollama 的轮次，过载时排队或快速拒绝。
 
 启动：
   python app.py
@@ -15,14 +20,59 @@ Gradio 调试台：议价机器人 (Bargaining Bot Debugger) · 极简清爽版
 
 from __future__ import annotations
 import json
+import os
+import threading
 import time
-from typing import Any, List, Tuple, Dict
+from collections import deque
+from typing import Any, Deque, List, Tuple, Dict
 
 import gradio as gr
 
-from fsm import NegotiationCtx, NegotiationModel
-from bridge import run_fsm_turn
-from llama import nlg_from_core_view
+from fsm import NegotiationCtx, CompiledNegotiationModel
+from policy import compile_policy
+from bridge import arun_fsm_turn
+from llama import anlg_from_core_view, anlg_stream_from_core_view
+import bridge
+import catalog
+import llama
+import retrieval
+import speculative
+from session_store import open_store
+from admission import AdmissionController, Overloaded
+import tracing
+
+# 话术是否流式输出：True 时 Ollama 逐 token 返回，聊天框边生成边显示（价格护栏逐段生效）
+STREAM_NLG = True
+
+# 调试面板：Contract/CoreView 历史只保留最近 DEBUG_HISTORY_CAP 轮；
+# 每轮只下发最新一页（DEBUG_PAGE_SIZE 条），更早的轮次通过翻页按需加载
+DEBUG_HISTORY_CAP = 200
+DEBUG_PAGE_SIZE = 10
+
+# 会话存储："memory"（进程内 LRU）或 "sqlite:///sessions.sqlite3"（多 worker 共享、重启可恢复）
+SESSION_STORE_URL = os.getenv("SESSION_STORE", "memory")
+SESSION_IDLE_TTL = 30 * 60          # 秒：空闲超过此时长的会话被淘汰
+SESSIONS = open_store(SESSION_STORE_URL, idle_ttl=SESSION_IDLE_TTL)
+
+# 并发：Gradio 队列同时执行的事件数（async 回调只占事件循环，可设得较大）
+QUEUE_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "64"))
+QUEUE_MAX_SIZE = int(os.getenv("GRADIO_QUEUE_MAX", "256"))       # 超出后新请求直接被 Gradio 拒绝
+CHAT_CONCURRENCY_LIMIT = int(os.getenv("CHAT_CONCURRENCY", "64"))  # 发送事件的并发上限
+PAGE_CONCURRENCY_LIMIT = 16                                        # 重置/翻页等纯 CPU 事件
+
+# 准入控制：同时打到 Ollama 的轮次上限（对齐 OLLAMA_NUM_PARALLEL），其余排队，队列满/超时即拒绝
+ADMISSION = AdmissionController(
+    max_inflight=int(os.getenv("OLLAMA_MAX_INFLIGHT", "4")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30")),
+)
+tracing.register_gauges("admission", ADMISSION.stats)
+
+# 启动时预加载抽取/话术模型并预热系统提示前缀（首轮不再承担模型加载耗时）
+WARM_UP = os.getenv("OLLAMA_WARM_UP", "1") == "1"
+
+# Prometheus 指标端口（GET /metrics），0 关闭
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
 
 # ---------------- 工具函数 ----------------
 
@@ -33,70 +83,223 @@ def pretty_json(obj: Any) -> str:
         return f"<JSON 序列化失败: {e}>{obj}"
 
 
-def _init_model(list_price: int, bar_price: int, stop_floor: int, max_concessions: int):
-    ctx = NegotiationCtx(
-        list_price=list_price,
-        bar_price=bar_price,
-        stop_floor=stop_floor,
-        max_concessions=max_concessions,
-    )
-    fsm = NegotiationModel(ctx)
+def _new_debug_list() -> Deque[Dict[str, Any]]:
+    return deque(maxlen=DEBUG_HISTORY_CAP)
+
+
+def page_of(items, page: int, size: int = DEBUG_PAGE_SIZE) -> List[Any]:
+    """第 page 页（0 = 最新一页），页内按时间正序"""
+    items = list(items or [])
+    end = max(len(items) - int(page) * size, 0)
+    return items[max(end - size, 0):end]
+
+
+def page_label(items, page: int, size: int = DEBUG_PAGE_SIZE) -> str:
+    total = len(items or [])
+    pages = max((total + size - 1) // size, 1)
+    return f"第 {int(page) + 1}/{pages} 页（0 为最新）· 共保留 {total} 轮（上限 {DEBUG_HISTORY_CAP}）"
+
+
+def _make_ctx(list_price: int, bar_price: int, stop_floor: int, max_concessions: int, sku: str = "") -> NegotiationCtx:
+    """有 SKU 时按目录配置建 ctx（让价比例、取整、最小步长等都取自目录），参数区的四个价格作为覆盖项"""
+    prices = dict(list_price=int(list_price), bar_price=int(bar_price),
+                  stop_floor=int(stop_floor), max_concessions=int(max_concessions))
+    sku = (sku or "").strip()
+    if sku:
+        try:
+            return NegotiationCtx.for_sku(sku, **prices)
+        except KeyError:
+            pass                # 目录里没有：按演示商品的默认参数
+    return NegotiationCtx(**prices)
+
+
+def _init_model(list_price: int, bar_price: int, stop_floor: int, max_concessions: int, sku: str = ""):
+    ctx = _make_ctx(list_price, bar_price, stop_floor, max_concessions, sku)
+    fsm = CompiledNegotiationModel(ctx)
     history: List[Tuple[str, str]] = []
     return ctx, fsm, history
 
 
+def save_session(session_id: str, fsm: CompiledNegotiationModel, history: List[Tuple[str, str]]) -> None:
+    SESSIONS.put(session_id, {"fsm": fsm.dump_state(), "chat": [list(turn) for turn in history]})
+
+
+def load_session(session_id: str):
+    """返回 (fsm, history)；会话不存在或已过期返回 (None, [])"""
+    record = SESSIONS.get(session_id) if session_id else None
+    if record is None:
+        return None, []
+    return CompiledNegotiationModel.load_state(record["fsm"]), [tuple(turn) for turn in record["chat"]]
+
+
+def warm_up_models() -> None:
+    steps = [("extract", bridge.warm_up), ("nlg", llama.warm_up)]
+    if llama.NLG_FEWSHOT_K > 0:
+        steps.append(("fewshot", retrieval.get_index))      # 启动时建好示例索引
+    for name, fn in steps:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            print(f"[warm-up] {name} 失败：{e}")
+            continue
+        elapsed = time.perf_counter() - t0
+        tracing.observe(f"warm_up_{name}", elapsed)
+        print(f"[warm-up] {name} 完成，用时 {elapsed * 1000:.0f} ms")
+
+
+def ladder_rows(policy) -> List[List[Any]]:
+    """让价阶梯预览：[AI 报价, 最少让价次数, 用户出价区间 → 下一报价]"""
+    rows = []
+    for price in policy.ladder:
+        spans = []
+        for lo, hi, offer in policy.table(price):
+            span = f"≤{hi}" if lo is None else (str(lo) if lo == hi else f"{lo}~{hi}")
+            spans.append(f"{span}→{offer}")
+        rows.append([price, policy.depth[price], "；".join(spans) or "不再让价"])
+    return rows
+
+
 # ---------------- 回调 ----------------
 
-def on_reset(list_price, bar_price, stop_floor, max_concessions):
-    ctx, fsm, history = _init_model(list_price, bar_price, stop_floor, max_concessions)
+def on_policy_preview(list_price, bar_price, stop_floor, max_concessions, sku=""):
+    try:
+        ctx = _make_ctx(list_price, bar_price, stop_floor, max_concessions, sku)
+    except (TypeError, ValueError):
+        return gr.update(), "参数不完整"
+    policy = compile_policy(ctx)
+    info = (f"可到达报价 {len(policy.ladder)} 档：{policy.ladder[0]} → {policy.ladder[-1]}"
+            f"（底线 {policy.floor}，编译 {policy.compile_ms} ms）")
+    if not policy.complete:
+        info += "；表格过大，部分报价未展开（运行时按公式计算）"
+    return ladder_rows(policy), info
+
+
+def on_load_sku(sku):
+    """按 SKU 从目录载入参数（载入后仍可手动改，重置会话时生效）"""
+    sku = (sku or "").strip()
+    entry = catalog.lookup(sku) if sku else None
+    if entry is None:
+        info = f"目录中没有 SKU：{sku}" if sku else "未指定 SKU：使用演示商品"
+        return gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), info
+    c = entry.config
+    return (c["list_price"], c["bar_price"], c["stop_floor"], c["max_concessions"],
+            "|".join(entry.value_reasons), f"已载入：{entry.title}（{sku}），点“重置会话”开始")
+
+
+def on_reset(list_price, bar_price, stop_floor, max_concessions, sku="", session_id=None):
+    ctx, fsm, history = _init_model(list_price, bar_price, stop_floor, max_concessions, sku)
+    if session_id:
+        SESSIONS.delete(session_id)
+    session_id = SESSIONS.new_id()
+    save_session(session_id, fsm, history)
     # 返回顺序与 outputs 对应
     return (
-        ctx,                 # st_ctx
-        fsm,                 # st_fsm
-        history,             # st_history (清空)
+        session_id,          # st_session
         history,             # chatbot 清空
-        [],                  # st_contract_list
-        [],                  # st_coreview_list
+        _new_debug_list(),   # st_contract_list
+        _new_debug_list(),   # st_coreview_list
         "", "", "", "",      # box_user_summary, box_snapshot, box_contract_latest, box_core_latest
         gr.update(value=[], visible=False),   # grid_changes
         gr.update(value=[], visible=False),   # contracts_json_all
         gr.update(value=[], visible=False),   # coreviews_json_all
+        0, page_label([], 0),                 # history_page, history_page_info
     )
 
 
-def on_user_message(
+def on_history_page(page, contract_list, coreview_list):
+    """翻页：按需加载更早的 Contract/CoreView"""
+    total = len(contract_list or [])
+    last_page = max((total + DEBUG_PAGE_SIZE - 1) // DEBUG_PAGE_SIZE - 1, 0)
+    page = min(max(int(page or 0), 0), last_page)
+    return (
+        page,
+        page_label(contract_list, page),
+        gr.update(value=page_of(contract_list, page), visible=True),
+        gr.update(value=page_of(coreview_list, page), visible=True),
+    )
+
+
+def trace_rows(trace: Dict[str, Any]) -> List[List[Any]]:
+    """本轮各阶段：[阶段, 耗时 ms, 属性 JSON]"""
+    rows = []
+    for sp in trace.get("spans", []):
+        attrs = {k: v for k, v in sp.items() if k not in ("stage", "ms")}
+        rows.append([sp["stage"], sp["ms"], json.dumps(attrs, ensure_ascii=False)])
+    rows.append(["turn", trace.get("total_ms"), ""])
+    return rows
+
+
+def _unchanged(chat_history, contract_list, coreview_list):
+    """不改动历史，直接回填现有组件"""
+    return (
+        chat_history,  # chatbot
+        gr.update(), gr.update(), gr.update(), gr.update(),
+        gr.update(), gr.update(), gr.update(),
+        contract_list, coreview_list,
+        gr.update(), gr.update(),
+        gr.update(), gr.update(), gr.update(),
+    )
+
+
+async def on_user_message(
     user_text: str,
-    ctx: NegotiationCtx,
-    fsm: NegotiationModel,
-    chat_history: List[Tuple[str, str]],
+    session_id: str,
     value_reasons: str,
-    contract_list: List[Dict[str, Any]],
-    coreview_list: List[Dict[str, Any]],
+    contract_list: Deque[Dict[str, Any]],
+    coreview_list: Deque[Dict[str, Any]],
 ):
-    if not user_text or not user_text.strip():
-        # 不改动历史，直接回填现有组件
-        return (
-            chat_history,  # chatbot
-            chat_history,  # st_history
-            gr.update(), gr.update(), gr.update(), gr.update(),
-            gr.update(), gr.update(),
-            contract_list, coreview_list,
-        )
-
-    out = run_fsm_turn(fsm, user_text)
+    fsm, chat_history = load_session(session_id)
+    if fsm is None:
+        gr.Warning("会话不存在或已过期，请点击“重置会话”")
+    if fsm is None or not user_text or not user_text.strip():
+        yield _unchanged(chat_history, contract_list, coreview_list)
+        return
+
+    trace = tracing.start_turn(session_id)
+    try:
+        try:
+            with tracing.span("admission", trace=trace) as sp:
+                waited = await ADMISSION.acquire()
+                sp.set(queued_ms=round(waited * 1000, 2))
+        except Overloaded as e:
+            tracing.end_turn(trace)
+            gr.Warning(f"当前咨询人数较多，请稍后再试（排队 {e.queued}）")
+            yield _unchanged(chat_history, contract_list, coreview_list)
+            return
+
+        try:
+            async for outputs in _run_turn(trace, fsm, chat_history, user_text, session_id,
+                                           value_reasons, contract_list, coreview_list):
+                yield outputs
+        finally:
+            ADMISSION.release()
+    finally:
+        tracing.end_turn(trace)         # 出错 / 客户端断开时也写出追踪并复位当前轮（线程池复用）
+
+
+async def _run_turn(trace, fsm, chat_history, user_text, session_id, value_reasons, contract_list, coreview_list):
     reasons = [r.strip() for r in value_reasons.split("|") if r.strip()] or ["正品保障与售后", "做工与用料优于同级"]
-    reply = nlg_from_core_view(user_text, out["core_view"], value_reasons=reasons)
-
-    # 维护历史（关键：既更新 Chatbot，也更新 st_history）
-    chat_history = (chat_history or []) + [(user_text, reply)]
+    deltas = None
+    if speculative.SPECULATIVE_NLG:
+        # 推测式：话术与抽取并发，抽取结果与预测一致时直接采用（见 speculative.py）
+        out, deltas = await speculative.arun_turn(fsm, user_text, reasons, trace=trace)
+    else:
+        out = await arun_fsm_turn(fsm, user_text)
+    save_session(session_id, fsm, chat_history)
 
     user_summary = out.get("user_summary", "")
     snapshot = out.get("fsm_snapshot", "")
     contract_latest = out.get("fsm_contract", {})
     core_latest = out.get("core_view", {})
 
-    contract_list = (contract_list or []) + [contract_latest]
-    coreview_list = (coreview_list or []) + [core_latest]
+    # 环形缓冲：只追加本轮，超出上限的最早轮次自动丢弃
+    if contract_list is None:
+        contract_list = _new_debug_list()
+    if coreview_list is None:
+        coreview_list = _new_debug_list()
+    contract_list.append(contract_latest)
+    coreview_list.append(core_latest)
 
     # 变化轨迹（按需自定义）
     changes = []
@@ -104,16 +307,42 @@ def on_user_message(
         if k in core_latest:
             changes.append([time.strftime("%H:%M:%S"), k, str(core_latest[k])])
 
-    return (
-        chat_history,                 # chatbot
-        chat_history,                 # st_history（同步保存）
-        user_summary, snapshot,
-        pretty_json(contract_latest), pretty_json(core_latest),
-        gr.update(value=changes, visible=True),
-        gr.update(value=contract_list, visible=True),
-        gr.update(value=coreview_list, visible=True),
-        contract_list, coreview_list,
-    )
+    def render(history, final):
+        return (
+            history,                      # chatbot
+            user_summary, snapshot,
+            pretty_json(contract_latest), pretty_json(core_latest),
+            gr.update(value=changes, visible=True),
+            gr.update(value=page_of(contract_list, 0), visible=True) if final else gr.update(),
+            gr.update(value=page_of(coreview_list, 0), visible=True) if final else gr.update(),
+            contract_list, coreview_list,
+            0 if final else gr.update(),
+            page_label(contract_list, 0) if final else gr.update(),
+            trace_rows(trace.as_dict()) if final else gr.update(),
+            tracing.stage_summary() if final else gr.update(),
+            tracing.gauges() if final else gr.update(),
+        )
+
+    base_history = chat_history or []
+    if STREAM_NLG:
+        # 流式：先展示 FSM 结果与空回复，再逐段追加已过护栏的文本
+        reply = ""
+        yield render(base_history + [(user_text, reply)], final=False)
+        if deltas is None:
+            deltas = anlg_stream_from_core_view(user_text, core_latest, value_reasons=reasons, trace=trace)
+        async for delta in deltas:
+            reply += delta
+            yield render(base_history + [(user_text, reply)], final=False)
+    elif deltas is not None:
+        reply = "".join([delta async for delta in deltas])
+    else:
+        reply = await anlg_from_core_view(user_text, core_latest, value_reasons=reasons)
+
+    # 维护历史（关键：既更新 Chatbot，也写回会话存储）
+    chat_history = base_history + [(user_text, reply)]
+    save_session(session_id, fsm, chat_history)
+    trace.finish()
+    yield render(chat_history, final=True)
 
 
 # ---------------- UI ----------------
@@ -140,12 +369,20 @@ def build_ui() -> gr.Blocks:
             # 左列：参数
             with gr.Column(scale=3):
                 with gr.Group():
+                    with gr.Row():
+                        sku_box = gr.Textbox(placeholder="如 SKU000123（留空为演示商品）", label="商品 SKU", scale=3)
+                        btn_load_sku = gr.Button("载入", size="sm", scale=1)
+                    sku_info = gr.Markdown()
                     list_price = gr.Number(value=500, label="标价 list_price", precision=0)
                     bar_price = gr.Number(value=400, label="最低价 bar_price", precision=0)
                     stop_floor = gr.Number(value=420, label="止损价 stop_floor", precision=0)
                     max_concessions = gr.Number(value=5, label="让价次数 max_concessions", precision=0)
                     value_reasons = gr.Textbox(value="正品保障与售后|做工与用料优于同级", label="价值点（|分隔）")
                     btn_reset = gr.Button("🔁 重置会话 / 应用参数", variant="secondary")
+                with gr.Accordion("让价阶梯预览", open=False):
+                    policy_info = gr.Markdown()
+                    policy_ladder = gr.Dataframe(headers=["AI 报价", "最少让价次数", "用户出价 → 下一报价"], value=[],
+                                                 datatype=["number", "number", "str"], interactive=False, wrap=True)
 
             # 右列：调试信息
             with gr.Column(scale=4):
@@ -157,67 +394,109 @@ def build_ui() -> gr.Blocks:
                         box_core_latest = gr.Code(language="json", interactive=False, label="最新 CoreView")
                         grid_changes = gr.Dataframe(headers=["时间", "字段", "值"], value=[], datatype=["str", "str", "str"], interactive=False, visible=False, label="字段变化轨迹")
                     with gr.TabItem("历史 JSON"):
+                        with gr.Row():
+                            btn_page_older = gr.Button("⬅ 更早", size="sm")
+                            history_page = gr.Number(value=0, precision=0, label="页码（0=最新）")
+                            btn_page_newer = gr.Button("更新 ➡", size="sm")
+                        history_page_info = gr.Markdown(page_label([], 0))
                         contracts_json_all = gr.JSON(value=[], visible=False, label="Contract 历史 List")
                         coreviews_json_all = gr.JSON(value=[], visible=False, label="CoreView 历史 List")
+                    with gr.TabItem("性能追踪"):
+                        trace_spans = gr.Dataframe(headers=["阶段", "耗时 ms", "属性"], value=[], datatype=["str", "number", "str"], interactive=False, label="本轮各阶段")
+                        trace_summary = gr.Dataframe(headers=["阶段", "次数", "p50 ms", "p95 ms", "p99 ms"], value=[], interactive=False, label="累计分位数")
+                        trace_gauges = gr.JSON(value={}, label="快路径 / 缓存 / 准入 / 熔断 / 路由")
 
         # 状态
-        st_ctx = gr.State()
-        st_fsm = gr.State()
-        st_history = gr.State([])
-        st_contract_list = gr.State([])
-        st_coreview_list = gr.State([])
+        st_session = gr.State()          # 只保存 session_id，FSM/对话历史在 SESSIONS 中
+        st_contract_list = gr.State(_new_debug_list)
+        st_coreview_list = gr.State(_new_debug_list)
 
         # 重置与页面加载
+        sku_outputs = [list_price, bar_price, stop_floor, max_concessions, value_reasons, sku_info]
+        # 载入后按该 SKU 的完整目录配置刷新让价阶梯（四个价格没变时不会触发 change）
+        policy_inputs = [list_price, bar_price, stop_floor, max_concessions, sku_box]
+        for trigger in (btn_load_sku.click, sku_box.submit):
+            trigger(on_load_sku, [sku_box], sku_outputs, concurrency_limit=PAGE_CONCURRENCY_LIMIT).then(
+                on_policy_preview, policy_inputs, [policy_ladder, policy_info],
+                concurrency_limit=PAGE_CONCURRENCY_LIMIT)
+
         btn_reset.click(
             on_reset,
-            [list_price, bar_price, stop_floor, max_concessions],
+            [list_price, bar_price, stop_floor, max_concessions, sku_box, st_session],
             [
-                st_ctx, st_fsm, st_history, chatbot,
+                st_session, chatbot,
                 st_contract_list, st_coreview_list,
                 box_user_summary, box_snapshot, box_contract_latest, box_core_latest,
                 grid_changes, contracts_json_all, coreviews_json_all,
+                history_page, history_page_info,
             ],
+            concurrency_limit=PAGE_CONCURRENCY_LIMIT,
         )
 
         demo.load(
             on_reset,
-            [list_price, bar_price, stop_floor, max_concessions],
+            [list_price, bar_price, stop_floor, max_concessions, sku_box],
             [
-                st_ctx, st_fsm, st_history, chatbot,
+                st_session, chatbot,
                 st_contract_list, st_coreview_list,
                 box_user_summary, box_snapshot, box_contract_latest, box_core_latest,
                 grid_changes, contracts_json_all, coreviews_json_all,
+                history_page, history_page_info,
             ],
+            concurrency_limit=PAGE_CONCURRENCY_LIMIT,
         )
 
+        # 参数变化即刷新让价阶梯（按配置缓存，重复配置不重新编译）
+        for comp in policy_inputs[:4]:
+            comp.change(on_policy_preview, policy_inputs, [policy_ladder, policy_info],
+                        concurrency_limit=PAGE_CONCURRENCY_LIMIT)
+        demo.load(on_policy_preview, policy_inputs, [policy_ladder, policy_info],
+                  concurrency_limit=PAGE_CONCURRENCY_LIMIT)
+
         # 发送（回车 & 按钮）
-        def _submit(u, c, f, h, v, cl, cv):
-            return on_user_message(u, c, f, h, v, cl, cv)
+        async def _submit(u, sid, v, cl, cv):
+            async for outputs in on_user_message(u, sid, v, cl, cv):
+                yield outputs
 
         submit_outputs = [
             chatbot,           # 可见对话
-            st_history,        # 保存后的历史
             box_user_summary, box_snapshot, box_contract_latest, box_core_latest,
             grid_changes,
             contracts_json_all, coreviews_json_all,
             st_contract_list, st_coreview_list,
+            history_page, history_page_info,
+            trace_spans, trace_summary, trace_gauges,
         ]
 
         user_box.submit(
             _submit,
-            [user_box, st_ctx, st_fsm, st_history, value_reasons, st_contract_list, st_coreview_list],
+            [user_box, st_session, value_reasons, st_contract_list, st_coreview_list],
             submit_outputs,
+            concurrency_limit=CHAT_CONCURRENCY_LIMIT,
         ).then(lambda: "", None, [user_box])
 
         btn_send.click(
             _submit,
-            [user_box, st_ctx, st_fsm, st_history, value_reasons, st_contract_list, st_coreview_list],
+            [user_box, st_session, value_reasons, st_contract_list, st_coreview_list],
             submit_outputs,
+            concurrency_limit=CHAT_CONCURRENCY_LIMIT,
         ).then(lambda: "", None, [user_box])
 
+        # 历史翻页（按需加载）
+        page_outputs = [history_page, history_page_info, contracts_json_all, coreviews_json_all]
+        history_page.submit(on_history_page, [history_page, st_contract_list, st_coreview_list], page_outputs)
+        btn_page_older.click(lambda p, cl, cv: on_history_page((p or 0) + 1, cl, cv),
+                             [history_page, st_contract_list, st_coreview_list], page_outputs)
+        btn_page_newer.click(lambda p, cl, cv: on_history_page((p or 0) - 1, cl, cv),
+                             [history_page, st_contract_list, st_coreview_list], page_outputs)
+
     return demo
 
 
 if __name__ == "__main__":
-    build_ui().queue().launch(server_port=7860)
+    if METRICS_PORT:
+        tracing.start_metrics_server(METRICS_PORT)
+    if WARM_UP:
+        threading.Thread(target=warm_up_models, name="warm-up", daemon=True).start()
+    build_ui().queue(default_concurrency_limit=QUEUE_CONCURRENCY, max_size=QUEUE_MAX_SIZE).launch(server_port=7860)
 
@@ -0,0 +1,82 @@
+# bench_fsm.py
+# FSM 微基准：对比 transitions.Machine 版 NegotiationModel 与表驱动版 CompiledNegotiationModel
+#   - 会话创建耗时
+#   - 单轮 input_user_price 耗时
+#   - 每会话内存占用（tracemalloc，N 个会话常驻）
+# 用法：python -m benchmarks.bench_fsm --sessions 100000                       （只测表驱动版）
+#       python -m benchmarks.bench_fsm --backend transitions --backend compiled  （对比）
+# transitions 版每会话约 65 KB，会话数上限为 --transitions-sessions（每会话指标照常可比）
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from fsm import NegotiationCtx, NegotiationModel, CompiledNegotiationModel
+
+BACKENDS = {
+    "transitions": NegotiationModel,
+    "compiled": CompiledNegotiationModel,
+}
+SCRIPT = [430, 440, 450, 460]          # 每个会话依次输入的用户出价
+
+
+def _new_session(cls):
+    return cls(NegotiationCtx(list_price=500, bar_price=400, stop_floor=420, max_concessions=5))
+
+
+def bench_backend(cls, n: int):
+    gc.collect()
+    t0 = time.perf_counter()
+    sessions = [_new_session(cls) for _ in range(n)]
+    create_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for fsm in sessions:
+        for price in SCRIPT:
+            fsm.input_user_price(price)
+    turn_s = time.perf_counter() - t0
+    del sessions
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessions = [_new_session(cls) for _ in range(n)]
+    for fsm in sessions:
+        fsm.input_user_price(SCRIPT[0])
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del sessions
+
+    return {
+        "create_us": create_s / n * 1e6,
+        "turn_us": turn_s / (n * len(SCRIPT)) * 1e6,
+        "bytes_per_session": used / n,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=100_000)
+    ap.add_argument("--transitions-sessions", type=int, default=5_000)
+    ap.add_argument("--backend", choices=sorted(BACKENDS), action="append")
+    args = ap.parse_args()
+
+    results = {}
+    for name in args.backend or ["compiled"]:
+        n = min(args.sessions, args.transitions_sessions) if name == "transitions" else args.sessions
+        results[name] = (n, bench_backend(BACKENDS[name], n))
+
+    print(f"{'backend':<12} {'sessions':>9} {'create(us)':>11} {'turn(us)':>10} {'bytes/session':>14}")
+    for name, (n, r) in results.items():
+        print(f"{name:<12} {n:>9} {r['create_us']:>11.2f} {r['turn_us']:>10.2f} {r['bytes_per_session']:>14.0f}")
+    results = {name: r for name, (_, r) in results.items()}
+    if len(results) == 2:
+        a, b = results["transitions"], results["compiled"]
+        print(f"speedup: create x{a['create_us'] / b['create_us']:.1f}, "
+              f"turn x{a['turn_us'] / b['turn_us']:.1f}, "
+              f"memory x{a['bytes_per_session'] / b['bytes_per_session']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
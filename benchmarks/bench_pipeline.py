@@ -0,0 +1,262 @@
+# bench_pipeline.py
+# 离线端到端基准：把对话脚本回放到 run_fsm_turn + nlg（流式或非流式），
+# 默认对接内置的 Ollama 桩服务（benchmarks/stub_ollama.py），无需 GPU / 网络。
+# 输出各阶段与整轮的延迟分位数、吞吐，并可与保存的基线比对（回归检查）。
+#
+# 用法：
+#   python -m benchmarks.bench_pipeline --conversations 200 --concurrency 8
+#   python -m benchmarks.bench_pipeline --save-baseline bench_baseline.json
+#   python -m benchmarks.bench_pipeline --baseline bench_baseline.json --tolerance 0.2
+#   python -m benchmarks.bench_pipeline --ollama http://localhost:11434   # 对真实服务
+#   python -m benchmarks.bench_pipeline --extract-latency-ms 8 --extract-tokens-per-sec 800   # 抽取走单独的小模型
+#   python -m benchmarks.bench_pipeline --dead-endpoint       # 每个阶段多一个不可达端点，检验故障转移
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import random
+import sys
+import time
+
+import bridge
+import llama
+import routing
+import speculative
+import tracing
+from fsm import NegotiationCtx, CompiledNegotiationModel
+from ollama_client import OLLAMA_BASE, READ_TIMEOUT, OllamaClient, register_client
+from benchmarks.stub_ollama import StubConfig, start_stub
+
+QUANTILES = (0.5, 0.95, 0.99)
+# 回归检查的指标：各阶段 p50/p95 不得变慢超过容差，吞吐不得下降超过容差
+GATED = ("p50_ms", "p95_ms")
+
+SYNTHETIC_TEMPLATES = [
+    "{p}可以吗", "{p}行不行", "能便宜点吗", "最低多少", "{p}元卖不卖", "那{p}呢",
+    "我只出{p}", "再少点吧，{p}", "{cn}可以吧", "行，就这个价",
+]
+_CN = {430: "四百三", 440: "四百四", 450: "四百五", 460: "四百六", 470: "四百七"}
+
+
+def load_dialogues(path: str = "dialogues.json") -> List[List[str]]:
+    """dialogues.json 的 examples 按顺序视为一段多轮对话"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [[ex["user"].strip() for ex in data.get("examples", []) if ex.get("user", "").strip()]]
+
+
+def load_script(path: str) -> List[List[str]]:
+    """JSONL：每行 {"turns": [...]} 为一段对话，或 {"user": "..."} 为单轮对话；其他行忽略"""
+    convs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if isinstance(row.get("turns"), list):
+                convs.append([str(t) for t in row["turns"]])
+            elif isinstance(row.get("user"), str):
+                convs.append([row["user"]])
+    return convs
+
+
+def synthetic_conversations(n: int, turns: int = 5, seed: int = 0) -> List[List[str]]:
+    rng = random.Random(seed)
+    convs = []
+    for _ in range(n):
+        price = rng.choice([400, 410, 420, 430])
+        conv = []
+        for _ in range(turns):
+            price = min(price + rng.choice([0, 10, 10, 20]), 470)
+            tpl = rng.choice(SYNTHETIC_TEMPLATES)
+            conv.append(tpl.format(p=price, cn=_CN.get(price, str(price))))
+        convs.append(conv)
+    return convs
+
+
+def run_conversation(turns: List[str], stream: bool, speculate: bool = False) -> List[Dict[str, Any]]:
+    fsm = CompiledNegotiationModel(NegotiationCtx(list_price=500, bar_price=400, stop_floor=420, max_concessions=5))
+    reasons = ["正品保障与售后"]
+    traces = []
+    for text in turns:
+        trace = tracing.start_turn()
+        first_ms = None
+        if speculate:
+            _, deltas = speculative.run_turn(fsm, text, reasons, trace=trace)
+        else:
+            out = bridge.run_fsm_turn(fsm, text)
+            deltas = llama.nlg_stream_from_core_view(text, out["core_view"], value_reasons=reasons, trace=trace) \
+                if stream else None
+        if deltas is not None:
+            for _ in deltas:
+                if first_ms is None:        # 用户看到首段话术的时刻（从本轮开始计）
+                    first_ms = (time.perf_counter() - trace.start) * 1000
+        else:
+            llama.nlg_from_core_view(text, out["core_view"], value_reasons=reasons)
+        traces.append({**tracing.end_turn(trace), "first_output_ms": first_ms})
+    return traces
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    data = sorted(values)
+    if not data:
+        return {}
+    out = {"count": len(data), "mean_ms": round(sum(data) / len(data), 3)}
+    for q in QUANTILES:
+        out[f"p{int(q * 100)}_ms"] = round(data[min(int(q * len(data)), len(data) - 1)], 3)
+    return out
+
+
+def report(traces: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    stages: Dict[str, List[float]] = {}
+    ttft: List[float] = []
+    for t in traces:
+        stages.setdefault("turn", []).append(t["total_ms"])
+        if t.get("first_output_ms") is not None:
+            stages.setdefault("turn_ttft", []).append(t["first_output_ms"])
+        for sp in t["spans"]:
+            stages.setdefault(sp["stage"], []).append(sp["ms"])
+            if "ttft_ms" in sp:
+                ttft.append(sp["ttft_ms"])
+    if ttft:
+        stages["nlg_ttft"] = ttft
+    return {
+        "turns": len(traces),
+        "wall_s": round(wall_s, 3),
+        "throughput_turns_per_s": round(len(traces) / wall_s, 2) if wall_s else 0.0,
+        "stages": {name: _percentiles(v) for name, v in sorted(stages.items())},
+        "fastpath": bridge.FASTPATH_STATS.as_dict(),
+        "extract_cache": bridge.EXTRACT_CACHE.stats(),
+        "extract_parse": bridge.PARSE_STATS.as_dict(),
+        "breaker_extract": bridge.EXTRACT_GUARD.stats(),
+        "breaker_nlg": llama.NLG_GUARD.stats(),
+        "extract_batch": bridge.EXTRACT_BATCHER.stats() if bridge.EXTRACT_BATCHER else None,
+        "speculative": speculative.STATS.as_dict(),
+        "nlg_cache": llama.NLG_CACHE.stats() if llama.NLG_CACHE_ENABLED else None,
+        "routing": {r.stage: [ep.stats() for ep in r.endpoints] for r in (bridge.EXTRACT_ROUTE, llama.NLG_ROUTE)},
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回回归项说明；空列表表示通过"""
+    problems = []
+    for stage, base in baseline.get("stages", {}).items():
+        cur = current["stages"].get(stage)
+        if cur is None:
+            continue
+        for key in GATED:
+            if key in base and base[key] > 0 and cur.get(key, 0) > base[key] * (1 + tolerance):
+                problems.append(f"{stage}.{key}: {cur[key]} > {base[key]} (+{tolerance:.0%})")
+    base_tp = baseline.get("throughput_turns_per_s", 0)
+    if base_tp and current["throughput_turns_per_s"] < base_tp * (1 - tolerance):
+        problems.append(f"throughput: {current['throughput_turns_per_s']} < {base_tp} (-{tolerance:.0%})")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="离线端到端流水线基准")
+    ap.add_argument("--ollama", help="对接真实 Ollama（默认启动内置桩服务）")
+    ap.add_argument("--latency-ms", type=float, default=30.0, help="桩服务首 token 延迟")
+    ap.add_argument("--tokens-per-sec", type=float, default=200.0, help="桩服务生成速率")
+    ap.add_argument("--parallel", type=int, default=0, help="桩服务同时生成的请求数上限，0 不限")
+    ap.add_argument("--conversations", type=int, default=50, help="合成对话条数")
+    ap.add_argument("--turns", type=int, default=5, help="每条合成对话轮数")
+    ap.add_argument("--script", action="append", default=[], help="额外回放的 JSONL 对话脚本")
+    ap.add_argument("--no-dialogues", action="store_true", help="不回放 dialogues.json")
+    ap.add_argument("--chatty", type=float, default=0.0, help="桩服务：未约束格式时抽取输出夹带说明文字的概率")
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="桩服务：请求额外卡顿的概率")
+    ap.add_argument("--stall-ms", type=float, default=5000.0, help="桩服务：卡顿时长")
+    ap.add_argument("--no-resilience", action="store_true", help="关闭自适应超时与熔断（超时回到客户端默认）")
+    ap.add_argument("--hedge", action="store_true", help="开启对冲请求（非流式调用）")
+    ap.add_argument("--extract-format", choices=["schema", "json", "none"], help="覆盖 bridge.EXTRACT_FORMAT")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--no-stream", action="store_true", help="话术走非流式接口")
+    ap.add_argument("--speculative", action="store_true", help="推测式话术：与抽取并发（流式）")
+    ap.add_argument("--no-fastpath", action="store_true", help="关闭规则快路径，全部走 LLM 抽取")
+    ap.add_argument("--no-cache", action="store_true", help="关闭抽取缓存")
+    ap.add_argument("--nlg-cache", action="store_true", help="开启话术缓存")
+    ap.add_argument("--microbatch", type=int, default=0, metavar="N", help="开启抽取微批，批大小上限 N")
+    ap.add_argument("--batch-wait-ms", type=float, default=10.0)
+    ap.add_argument("--extract-latency-ms", type=float,
+                    help="抽取单独用一个桩服务（模拟小模型）：首 token 延迟")
+    ap.add_argument("--extract-tokens-per-sec", type=float, help="抽取桩服务的生成速率（缺省同 --tokens-per-sec）")
+    ap.add_argument("--dead-endpoint", action="store_true", help="每个阶段的端点组前加一个不可达端点（故障转移）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--save-baseline")
+    ap.add_argument("--baseline")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    tracing.TRACE_FILE = ""                     # 基准不落盘
+    if args.no_fastpath:
+        bridge.FASTPATH_THRESHOLD = 2.0
+    if args.no_resilience:
+        for guard in (bridge.EXTRACT_GUARD, llama.NLG_GUARD):
+            guard.min_timeout_s = guard.max_timeout_s = READ_TIMEOUT
+            guard.breaker.failures = float("inf")
+    if args.hedge:
+        bridge.EXTRACT_GUARD.hedge = llama.NLG_GUARD.hedge = True
+    if args.extract_format:
+        bridge.EXTRACT_FORMAT = args.extract_format
+    if args.no_cache:
+        bridge.EXTRACT_CACHE.maxsize = 0
+    if args.nlg_cache:
+        llama.NLG_CACHE_ENABLED = True
+    if args.microbatch:
+        bridge.enable_microbatch(args.microbatch, args.batch_wait_ms)
+
+    server = None
+    if args.ollama:
+        register_client(OLLAMA_BASE, OllamaClient(args.ollama))
+    else:
+        server, url = start_stub(cfg=StubConfig(args.latency_ms, args.tokens_per_sec, parallel=args.parallel,
+                                                      chatty=args.chatty, stall_rate=args.stall_rate,
+                                                      stall_ms=args.stall_ms))
+        register_client(OLLAMA_BASE, OllamaClient(url))
+    extract_server = None
+    if args.extract_latency_ms is not None or args.extract_tokens_per_sec is not None:
+        extract_server, extract_url = start_stub(cfg=StubConfig(
+            args.latency_ms if args.extract_latency_ms is None else args.extract_latency_ms,
+            args.extract_tokens_per_sec or args.tokens_per_sec, parallel=args.parallel, chatty=args.chatty,
+            stall_rate=args.stall_rate, stall_ms=args.stall_ms))
+        bridge.EXTRACT_ROUTE.endpoints = [routing.endpoint(extract_url)]
+    if args.dead_endpoint:
+        dead = routing.endpoint("http://127.0.0.1:9")           # 无服务监听：建连即失败
+        for r in (bridge.EXTRACT_ROUTE, llama.NLG_ROUTE):
+            r.endpoints = [dead] + r.endpoints
+
+    convs: List[List[str]] = []
+    if not args.no_dialogues:
+        convs += load_dialogues()
+    for path in args.script:
+        convs += load_script(path)
+    convs += synthetic_conversations(args.conversations, args.turns, args.seed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda c: run_conversation(c, not args.no_stream, args.speculative), convs))
+    wall_s = time.perf_counter() - t0
+    for s in (server, extract_server):
+        if s is not None:
+            s.shutdown()
+
+    rep = report([t for conv in results for t in conv], wall_s)
+    rep["config"] = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "baseline")}
+    print(json.dumps(rep, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(rep, json.load(f), args.tolerance)
+        if problems:
+            print("REGRESSION:\n  " + "\n  ".join(problems), file=sys.stderr)
+            return 1
+        print("baseline check passed", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# bench_price_guard.py
+# 价格护栏微基准：旧实现（enforce_floor 一遍 + 每个不同数字各跑一次 \b{n}\b 替换）
+# 对比 price_guard 的单次扫描实现；分别测整段与流式（每 2 个字符一个分片）在长回复上的耗时，
+# 并统计旧实现漏掉的中文/混写价格数量；开跑前先校验 REGRESSION_CASES。
+# 用法：python -m benchmarks.bench_price_guard --chars 4000 --repeat 200
+
+import argparse
+import random
+import re
+import time
+
+from llama import StreamPriceGuard, apply_price_guard
+from price_guard import guard_core_view, guard_prices
+
+CORE_VIEW = {"offer_to_show": 470, "lowest_price": 420}
+FRAGMENTS = [
+    "我们给出的成交价为470元，", "之前说的450元已经不行了，", "四百五十块钱确实给不了，", "4百5也不行，",
+    "正品保障与售后，", "24小时内发货，", "支持七天无理由，", "保修12个月，", "¥ 399 是活动价，",
+    "两千二的那款是旗舰版，", "做工与用料优于同级，", "确认后我马上为您锁单。", "原价 500，现价 460 元，",
+]
+# 回归用例：(回复, 期望改写结果)，按 CORE_VIEW 改写；价格后紧跟数量、带 ¥ 的数字都必须被改写
+REGRESSION_CASES = [
+    ("最低350一件", "最低470一件"),
+    ("¥350一件", "¥470一件"),
+    ("给你300两件", "给你470两件"),
+    ("三百五一个卖你", "470一个卖你"),
+    ("¥3件", "¥470件"),
+    ("24小时内发货，保修12个月，", "24小时内发货，保修12个月，"),
+    ("十一个人，一千零一个", "十一个人，一千零一个"),
+]
+
+
+def legacy_guard(text: str, core_view) -> str:
+    """基线版本中 nlg_from_core_view 的护栏写法"""
+    floor = int(core_view.get("lowest_price", 0))
+    safe_text = re.sub(r"\d{2,6}", lambda m: str(max(int(m.group(0)), floor)), text)
+    offer = str(core_view.get("offer_to_show", ""))
+    if offer:
+        nums = set(re.findall(r"\d{2,6}", safe_text))
+        for n in nums:
+            if n != offer:
+                safe_text = re.sub(rf"\b{n}\b", offer, safe_text)
+    return safe_text
+
+
+def make_reply(chars: int, seed: int = 0) -> str:
+    """拼接固定片段，并夹带随机价格（不同数字越多，旧实现的逐数字替换越慢）"""
+    rng = random.Random(seed)
+    out, n = [], 0
+    while n < chars:
+        frag = rng.choice(FRAGMENTS) if rng.random() < 0.7 else f"还有{rng.randint(100, 999)}元的款，"
+        out.append(frag)
+        n += len(frag)
+    return "".join(out)
+
+
+def stream_guard(text: str, core_view, step: int = 2) -> str:
+    guard = StreamPriceGuard(core_view)
+    out = [guard.feed(text[i:i + step]) for i in range(0, len(text), step)]
+    out.append(guard.flush())
+    return "".join(out)
+
+
+def check_regressions() -> None:
+    for text, expected in REGRESSION_CASES:
+        assert apply_price_guard(text, CORE_VIEW) == expected, (text, apply_price_guard(text, CORE_VIEW))
+        assert stream_guard(text, CORE_VIEW, step=1) == expected, text
+    assert guard_prices("350一件", floor=420)[0] == "420一件"
+
+
+def _time(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="价格护栏微基准")
+    ap.add_argument("--chars", type=int, nargs="+", default=[50, 500, 4000])
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    check_regressions()
+    print(f"{'chars':>6}  {'legacy µs':>10}  {'single-pass µs':>14}  {'stream µs':>10}  {'changes':>8}  {'legacy missed':>13}")
+    for chars in args.chars:
+        text = make_reply(chars)
+        legacy_us = _time(lambda: legacy_guard(text, CORE_VIEW), args.repeat)
+        new_us = _time(lambda: apply_price_guard(text, CORE_VIEW), args.repeat)
+        stream_us = _time(lambda: stream_guard(text, CORE_VIEW), max(args.repeat // 10, 1))
+        assert stream_guard(text, CORE_VIEW) == apply_price_guard(text, CORE_VIEW)
+
+        _, changes = guard_core_view(text, CORE_VIEW)
+        missed = sum(1 for c in changes if not c["original"].replace(",", "").replace(".", "").isdigit())
+        print(f"{len(text):>6}  {legacy_us:>10.1f}  {new_us:>14.1f}  {stream_us:>10.1f}  {len(changes):>8}  {missed:>13}")
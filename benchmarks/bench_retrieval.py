@@ -0,0 +1,50 @@
+# bench_retrieval.py
+# 少样本检索微基准：默认索引（dialogues.json + prompt.txt）与合成大索引上的单次查询耗时，
+# 分别测冷查询（绕过缓存）与缓存命中，并打印几条查询的检索结果供人工核对相关性。
+# 用法：python -m benchmarks.bench_retrieval --docs 5000 --queries 2000
+
+import argparse
+import random
+import time
+
+from retrieval import BM25Index, Example, get_index
+from benchmarks.bench_pipeline import synthetic_conversations
+
+SAMPLE_QUERIES = ["我想退款", "多久发货", "450行不行", "还能便宜点吗", "我还没买，先商量价格"]
+
+
+def _time_per_query(index: BM25Index, queries, budget: int) -> float:
+    t0 = time.perf_counter()
+    for q in queries:
+        index.select(q, 3, budget)
+    return (time.perf_counter() - t0) / len(queries) * 1e6
+
+
+def synthetic_index(n_docs: int, seed: int = 0) -> BM25Index:
+    rng = random.Random(seed)
+    texts = [t for conv in synthetic_conversations(n_docs // 5 + 1, 5, seed) for t in conv]
+    index = BM25Index()
+    index.add(Example(f"{t}#{i}", f"回复{rng.randint(1, 9999)}", "synthetic") for i, t in enumerate(texts[:n_docs]))
+    return index
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="少样本检索微基准")
+    ap.add_argument("--docs", type=int, default=5000, help="合成索引的示例条数")
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--budget", type=int, default=120)
+    args = ap.parse_args()
+
+    default = get_index()
+    for q in SAMPLE_QUERIES:
+        hits = default.select(q, 2, args.budget)
+        print(f"{q!r:>24} -> {[ex.user[:16] for ex in hits]}")
+
+    queries = [t for conv in synthetic_conversations(args.queries // 5 + 1, 5, 1) for t in conv][:args.queries]
+    for name, index in (("default", default), ("synthetic", synthetic_index(args.docs))):
+        index.cache.maxsize = 0                 # 冷查询：每次都重新打分
+        cold_us = _time_per_query(index, queries, args.budget)
+        index.cache.maxsize = len(queries)
+        _time_per_query(index, queries, args.budget)
+        warm_us = _time_per_query(index, queries, args.budget)
+        print(f"{name:>10}: docs={len(index):>5}  cold {cold_us:7.1f} µs/query  cached {warm_us:6.1f} µs/query")
@@ -0,0 +1,130 @@
+# bench_ttft.py
+# 首 token 延迟（TTFT）前后对比：
+#   before：旧提示词顺序（用户原话在前、固定说明在后）、不带 keep_alive、不预热
+#   after ：固定前缀在前（bridge/llama.make_user_prompt）、带 keep_alive、启动预热两个阶段
+# 每种模式先卸载模型（keep_alive=0），再按真实轮次交替执行 抽取（非流式）→ 话术（流式），
+# 记录首轮与稳态的 抽取耗时 / 话术 TTFT / 实际 prefill 的 token 数（prompt_eval_count）。
+# 默认对接内置桩服务（模拟模型加载与按前缀命中的 KV 缓存），也可 --ollama 对真实服务测量。
+# 用法：python -m benchmarks.bench_ttft --turns 20
+#       python -m benchmarks.bench_ttft --ollama http://localhost:11434 --model llama3.1
+
+from typing import Any, Dict, List
+import argparse
+import json
+import time
+
+import bridge
+import llama
+from fsm import NegotiationCtx, CompiledNegotiationModel
+from ollama_client import KEEP_ALIVE, OllamaClient, message_content
+from benchmarks.bench_pipeline import synthetic_conversations
+from benchmarks.stub_ollama import StubConfig, start_stub
+
+VALUE_REASONS = ["正品保障与售后", "做工与用料优于同级"]
+
+
+# ====== 旧版提示词（用户原话在前）======
+def legacy_extract_prompt(user_text: str) -> str:
+    return f"""用户原话：
+\"\"\"{user_text}\"\"\"
+
+请输出如下 JSON（不要多余文本、不要解释）：
+{{
+  "intent": "counter_offer|accept|ask|other",
+  "customer_price":  整数或 null,
+  "notes": "可选中文备注，不超过20字"
+}}"""
+
+
+def legacy_nlg_prompt(last_user_text: str, core_view: Dict[str, Any], value_reasons: List[str]) -> str:
+    extra_block = f"\n价值点（至多使用2个）：{'；'.join(value_reasons[:2])}"
+    return f"""
+# 上一句用户输入
+「{last_user_text}」
+
+# core_view（只读约束）
+{json.dumps(core_view, ensure_ascii=False, indent=2)}
+
+请根据以上信息，直接输出给用户看的中文话术（少于2句），
+以“确认成交与下一步安排”为导向；可点到产品价值，但不要新增价格或承诺。{extra_block}
+""".strip()
+
+
+def _pct(values: List[float], q: float) -> float:
+    data = sorted(values)
+    return round(data[min(int(q * len(data)), len(data) - 1)], 2) if data else 0.0
+
+
+def run_mode(base_url: str, model: str, turns: List[str], after: bool) -> Dict[str, Any]:
+    client = OllamaClient(base_url, keep_alive=KEEP_ALIVE if after else "")
+    client.chat(model, [], keep_alive=0)           # 先卸载，保证两种模式都从冷启动开始
+    warm_ms = 0.0
+    if after:
+        t0 = time.perf_counter()
+        client.warm_up(model, bridge.SYSTEM_PROMPT)
+        client.warm_up(model, llama.SYSTEM_PROMPT)
+        warm_ms = (time.perf_counter() - t0) * 1000
+
+    fsm = CompiledNegotiationModel(NegotiationCtx(list_price=500, bar_price=400, stop_floor=420, max_concessions=5))
+    rows = []
+    for text in turns:
+        prompt = bridge.make_user_prompt(text) if after else legacy_extract_prompt(text)
+        t0 = time.perf_counter()
+        data = client.chat(model, [{"role": "system", "content": bridge.SYSTEM_PROMPT},
+                                   {"role": "user", "content": prompt}])
+        extract_ms = (time.perf_counter() - t0) * 1000
+        out = bridge.advance_fsm(fsm, bridge.normalize_summary(message_content(data), text))
+
+        core_view = out["core_view"]
+        prompt = (llama.make_user_prompt(text, core_view, VALUE_REASONS) if after
+                  else legacy_nlg_prompt(text, core_view, VALUE_REASONS))
+        t0 = time.perf_counter()
+        ttft_ms, nlg_eval = None, 0
+        for chunk in client.chat_stream(model, [{"role": "system", "content": llama.SYSTEM_PROMPT},
+                                                {"role": "user", "content": prompt}]):
+            if ttft_ms is None and (chunk.get("message") or {}).get("content"):
+                ttft_ms = (time.perf_counter() - t0) * 1000
+            if chunk.get("done"):
+                nlg_eval = chunk.get("prompt_eval_count", 0)
+        rows.append({"extract_ms": extract_ms, "ttft_ms": ttft_ms or 0.0,
+                     "extract_prefill_tokens": data.get("prompt_eval_count", 0), "nlg_prefill_tokens": nlg_eval})
+    client.close()
+
+    steady = rows[1:] or rows
+    return {
+        "mode": "after" if after else "before",
+        "warm_up_ms": round(warm_ms, 1),
+        "first_turn": {k: round(v, 2) for k, v in rows[0].items()},
+        "steady": {
+            "extract_p50_ms": _pct([r["extract_ms"] for r in steady], 0.5),
+            "extract_p95_ms": _pct([r["extract_ms"] for r in steady], 0.95),
+            "ttft_p50_ms": _pct([r["ttft_ms"] for r in steady], 0.5),
+            "ttft_p95_ms": _pct([r["ttft_ms"] for r in steady], 0.95),
+            "extract_prefill_tokens_mean": round(sum(r["extract_prefill_tokens"] for r in steady) / len(steady), 1),
+            "nlg_prefill_tokens_mean": round(sum(r["nlg_prefill_tokens"] for r in steady) / len(steady), 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="TTFT 前后对比（提示前缀复用 + keep_alive + 预热）")
+    ap.add_argument("--ollama", help="对接真实 Ollama（默认启动内置桩服务）")
+    ap.add_argument("--model", default=llama.OLLAMA_MODEL)
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--load-ms", type=float, default=1500.0, help="桩服务：模型加载耗时")
+    ap.add_argument("--prefill-ms-per-char", type=float, default=0.4, help="桩服务：每字符 prefill 耗时")
+    ap.add_argument("--slots", type=int, default=2, help="桩服务：KV 缓存槽数")
+    args = ap.parse_args()
+
+    server = None
+    base_url = args.ollama
+    if not base_url:
+        server, base_url = start_stub(cfg=StubConfig(latency_ms=20, tokens_per_sec=200, load_ms=args.load_ms,
+                                                     prefill_ms_per_char=args.prefill_ms_per_char,
+                                                     slots=args.slots))
+    turns = synthetic_conversations(1, args.turns, args.seed)[0]
+    for after in (False, True):
+        print(json.dumps(run_mode(base_url, args.model, turns, after), ensure_ascii=False))
+    if server is not None:
+        server.shutdown()
@@ -0,0 +1,299 @@
+# stub_ollama.py
+# 本地 Ollama /api/chat 桩服务：无需 GPU / 模型 / 网络即可压测整条流水线
+#   - 可配置首 token 延迟（prefill）与生成速率（tokens/s）
+#   - 抽取请求（系统提示含“数据提取器”）返回模板化 JSON（批量提示按编号返回 items 数组）；
+#     话术请求返回含 offer_to_show 的模板话术
+#   - 支持 stream=true（NDJSON 分片）与 stream=false，返回体带 eval_count / *_duration 统计
+#   - 可选限制同时生成的请求数（parallel，对应 OLLAMA_NUM_PARALLEL），超出的请求排队
+#   - 可选模拟不守格式的模型（chatty）：请求未带 format 时，按概率在抽取 JSON 前后夹带说明文字/代码围栏；
+#     带 format（约束解码）时只输出 JSON 对象；options.num_predict 截断输出
+#   - 可选模拟偶发卡顿（stall_rate / stall_ms）：按概率在响应前额外停顿，用于观察尾延迟与超时/熔断
+#   - 可选模拟模型加载（load_ms，按 keep_alive 过期卸载）与按字符计费的 prefill：
+#     与 Ollama 一样保留 slots 个 KV 缓存槽，请求挑公共前缀最长的槽，只对未命中的部分计 prefill
+# 用法：python -m benchmarks.stub_ollama --port 11435 --latency-ms 80 --tokens-per-sec 40
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from numerals import iter_numbers
+
+EXTRACT_MARKER = "数据提取器"
+DEFAULT_NLG_TEMPLATE = "好的，我们给出的成交价为{offer}元，{reason}，确认后可立即为您安排发货。"
+DEFAULT_REASON = "正品保障与售后"
+CHATTY_TEMPLATE = "好的，以下是提取结果：\n```json\n{json}\n```\n如需调整请告诉我。"
+
+_OFFER_RE = re.compile(r'"offer_to_show"\s*[:=]\s*(\d+)|offer_to_show\s*[:=]\s*(\d+)')
+_USER_TEXT_RE = re.compile(r'"""(.*?)"""|「(.*?)」', re.S)
+_BATCH_ITEM_RE = re.compile(r'\[(\d+)\] """(.*?)"""', re.S)
+_REASON_RE = re.compile(r"价值点[^：:]*[：:]([^；;\n]+)")
+
+
+_DURATION_RE = re.compile(r"^(-?\d+(?:\.\d+)?)(ms|s|m|h)?$")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+DEFAULT_KEEP_ALIVE_S = 300.0            # Ollama 默认 5m
+
+
+def parse_keep_alive(value: Any) -> float:
+    """keep_alive（"30m" / "90s" / 0 / "-1m"）→ 秒；负数视为永久"""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE_S
+    m = _DURATION_RE.match(str(value).strip())
+    if not m:
+        return DEFAULT_KEEP_ALIVE_S
+    seconds = float(m.group(1)) * _DURATION_UNITS[m.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 50.0, tokens_per_sec: float = 50.0,
+                 chars_per_token: int = 2, nlg_template: str = DEFAULT_NLG_TEMPLATE,
+                 canned_extract: Optional[Dict[str, Any]] = None,
+                 load_ms: float = 0.0, prefill_ms_per_char: float = 0.0, slots: int = 4,
+                 parallel: int = 0, chatty: float = 0.0, seed: int = 0,
+                 stall_rate: float = 0.0, stall_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.chars_per_token = chars_per_token
+        self.nlg_template = nlg_template
+        self.canned_extract = canned_extract
+        self.load_ms = load_ms
+        self.prefill_ms_per_char = prefill_ms_per_char
+        self.chatty = chatty                # 未约束格式时，抽取输出夹带说明文字的概率
+        self.rng = random.Random(seed)
+        self.stall_rate = stall_rate        # 请求额外卡顿 stall_ms 的概率
+        self.stall_ms = stall_ms
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.loaded_until: Dict[str, float] = {}        # model -> 卸载时间
+        self.slots: List[Tuple[float, str]] = [(0.0, "")] * slots   # (最近使用时间, 已缓存的提示)
+        # 同时生成的请求数上限（对应 OLLAMA_NUM_PARALLEL），超出的排队；0 表示不限
+        self.gate = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+
+    def admit(self, model: str, prompt: str, keep_alive: Any) -> Tuple[float, float, int]:
+        """返回 (加载秒数, prefill 秒数, 未命中缓存的字符数)，并更新模型常驻与 KV 槽状态"""
+        now = time.time()
+        with self.lock:
+            load_s = 0.0
+            if self.loaded_until.get(model, 0.0) < now:
+                load_s = self.load_ms / 1000
+                self.slots = [(0.0, "")] * len(self.slots)      # 重新加载后 KV 缓存全部失效
+            self.loaded_until[model] = now + load_s + parse_keep_alive(keep_alive)
+            if not prompt or not self.slots:
+                return load_s, 0.0, len(prompt)
+            best, best_len = 0, -1
+            for i, (_, cached) in enumerate(self.slots):
+                n = len(os.path.commonprefix([cached, prompt]))
+                if n > best_len:
+                    best, best_len = i, n
+            if best_len < len(self.slots[best][1]):
+                # 与 Ollama 多槽缓存一致：会截断别的槽时，把公共前缀复制到最久未用的槽
+                best = min(range(len(self.slots)), key=lambda i: self.slots[i][0])
+            self.slots[best] = (now, prompt)
+            uncached = len(prompt) - best_len
+        return load_s, self.latency_ms / 1000 + uncached * self.prefill_ms_per_char / 1000, uncached
+
+
+def _user_text(prompt: str) -> str:
+    m = _USER_TEXT_RE.search(prompt)
+    if not m:
+        return prompt
+    return m.group(1) if m.group(1) is not None else m.group(2)
+
+
+def _extract_reply(prompt: str, cfg: StubConfig) -> str:
+    if cfg.canned_extract is not None:
+        return json.dumps(cfg.canned_extract, ensure_ascii=False)
+    batch = _BATCH_ITEM_RE.findall(prompt)
+    if batch:
+        # 批量抽取：按编号返回 {"items": [...]}（与批量提示一致，不含 notes）
+        items = []
+        for i, text in batch:
+            one = json.loads(_extract_one(text))
+            items.append({"id": int(i), "intent": one["intent"], "customer_price": one["customer_price"]})
+        return json.dumps({"items": items}, ensure_ascii=False)
+    return _extract_one(_user_text(prompt))
+
+
+def _extract_one(text: str) -> str:
+    prices = [v for _, _, v, _, _ in iter_numbers(text) if v >= 10]
+    price = prices[-1] if prices else None
+    if price is not None:
+        intent = "counter_offer"
+    elif any(w in text for w in ("行", "好", "成交", "可以")):
+        intent = "accept"
+    elif any(w in text for w in ("吗", "？", "?", "多少")):
+        intent = "ask"
+    else:
+        intent = "other"
+    return json.dumps({"intent": intent, "customer_price": price, "notes": "stub"}, ensure_ascii=False)
+
+
+def _nlg_reply(prompt: str, cfg: StubConfig) -> str:
+    m = _OFFER_RE.search(prompt)
+    offer = next((g for g in m.groups() if g), "") if m else ""
+    r = _REASON_RE.search(prompt)
+    reason = r.group(1).strip() if r else DEFAULT_REASON
+    return cfg.nlg_template.format(offer=offer, reason=reason)
+
+
+def _reply_for(messages: List[Dict[str, str]], cfg: StubConfig, constrained: bool = False) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+    if not prompt:
+        return ""                                   # 预热请求：空消息
+    if EXTRACT_MARKER in system:
+        reply = _extract_reply(prompt, cfg)
+        if cfg.chatty and not constrained:
+            with cfg.lock:
+                chatty = cfg.rng.random() < cfg.chatty
+            if chatty:
+                reply = CHATTY_TEMPLATE.format(json=reply)
+        return reply
+    return _nlg_reply(prompt, cfg)
+
+
+def _tokens(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _render(messages: List[Dict[str, str]]) -> str:
+    return "".join(f"<|{m.get('role', '')}|>{m.get('content', '')}" for m in messages)
+
+
+def _stats(uncached_chars: int, n_tokens: int, load_s: float, prefill_s: float, gen_s: float) -> Dict[str, Any]:
+    return {
+        "total_duration": int((load_s + prefill_s + gen_s) * 1e9),
+        "load_duration": int(load_s * 1e9),
+        "prompt_eval_count": uncached_chars // 2,
+        "prompt_eval_duration": int(prefill_s * 1e9),
+        "eval_count": n_tokens,
+        "eval_duration": int(gen_s * 1e9),
+    }
+
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"           # keep-alive，与真实 Ollama 一致
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, obj: Dict[str, Any], status: int = 200) -> None:
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/api/tags":
+                self._send_json({"models": [{"name": "stub"}]})
+            else:
+                self._send_json({"status": "ok"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.rstrip("/") != "/api/chat":
+                self._send_json({"error": "not found"}, 404)
+                return
+            with cfg.lock:
+                cfg.requests += 1
+            if cfg.gate is None:
+                self._generate(payload)
+                return
+            with cfg.gate:
+                self._generate(payload)
+
+        def _generate(self, payload: Dict[str, Any]) -> None:
+            messages = payload.get("messages") or []
+            model = payload.get("model", "stub")
+            text = _reply_for(messages, cfg, constrained=bool(payload.get("format")))
+            tokens = _tokens(text, cfg.chars_per_token) if text else []
+            num_predict = (payload.get("options") or {}).get("num_predict")
+            if num_predict and num_predict > 0:
+                tokens = tokens[:num_predict]
+                text = "".join(tokens)
+            per_token = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0.0
+            load_s, prefill_s, uncached = cfg.admit(model, _render(messages), payload.get("keep_alive"))
+            if not messages:
+                prefill_s = 0.0                     # 空消息：Ollama 只加载模型
+            stall_s = 0.0
+            if cfg.stall_rate and messages:
+                with cfg.lock:
+                    stall_s = cfg.stall_ms / 1000 if cfg.rng.random() < cfg.stall_rate else 0.0
+            time.sleep(load_s + prefill_s + stall_s)
+
+            if not payload.get("stream", True):
+                time.sleep(per_token * len(tokens))
+                self._send_json({
+                    "model": model, "done": True, "done_reason": "stop",
+                    "message": {"role": "assistant", "content": text},
+                    **_stats(uncached, len(tokens), load_s, prefill_s, per_token * len(tokens)),
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def chunk(obj: Dict[str, Any]) -> None:
+                data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            for tok in tokens:
+                time.sleep(per_token)
+                chunk({"model": model, "done": False, "message": {"role": "assistant", "content": tok}})
+            chunk({"model": model, "done": True, "done_reason": "stop",
+                   "message": {"role": "assistant", "content": ""},
+                   **_stats(uncached, len(tokens), load_s, prefill_s, per_token * len(tokens))})
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def start_stub(port: int = 0, host: str = "127.0.0.1", cfg: Optional[StubConfig] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """后台线程启动桩服务，返回 (server, base_url)；port=0 自动选择空闲端口"""
+    cfg = cfg or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    server.stub_config = cfg
+    threading.Thread(target=server.serve_forever, name="stub-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="本地 Ollama /api/chat 桩服务")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="首 token 前的固定延迟（模拟 prefill）")
+    ap.add_argument("--tokens-per-sec", type=float, default=50.0)
+    ap.add_argument("--load-ms", type=float, default=0.0, help="模型（重新）加载耗时")
+    ap.add_argument("--prefill-ms-per-char", type=float, default=0.0, help="未命中 KV 缓存的提示每字符 prefill 耗时")
+    ap.add_argument("--slots", type=int, default=4, help="KV 缓存槽数")
+    ap.add_argument("--parallel", type=int, default=0, help="同时生成的请求数上限（OLLAMA_NUM_PARALLEL），0 不限")
+    ap.add_argument("--chatty", type=float, default=0.0, help="未带 format 时抽取输出夹带说明文字的概率")
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="请求额外卡顿的概率")
+    ap.add_argument("--stall-ms", type=float, default=0.0, help="卡顿时长")
+    ap.add_argument("--nlg-template", default=DEFAULT_NLG_TEMPLATE, help="可用 {offer} {reason}")
+    ap.add_argument("--canned-extract", help="固定的抽取 JSON（字符串）")
+    args = ap.parse_args()
+
+    cfg = StubConfig(args.latency_ms, args.tokens_per_sec, nlg_template=args.nlg_template,
+                     canned_extract=json.loads(args.canned_extract) if args.canned_extract else None,
+                     load_ms=args.load_ms, prefill_ms_per_char=args.prefill_ms_per_char, slots=args.slots,
+                     parallel=args.parallel, chatty=args.chatty,
+                     stall_rate=args.stall_rate, stall_ms=args.stall_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    print(f"stub ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -1,59 +1,122 @@
 # bridge.py
 # 前端输入 → LLM抽取JSON → 解析customer_price → 调用FSM → 返回snapshot/contract
-# 依赖：requests（调用本地 Ollama），你的 fsm.py（NegotiationCtx / NegotiationModel）
+# 依赖：ollama_client（共享连接池调用本地 Ollama），你的 fsm.py（NegotiationCtx / NegotiationModel）
 
-from typing import Any, Dict, Optional
-import json, re, requests
+from typing import Any, Dict, List, Optional
+import os, re
 
+from ollama_client import message_content
+from fastpath import rule_extract, fastpath_stats, STATS as FASTPATH_STATS
+from cache import TTLCache, normalize_text
+from microbatch import FALLBACK, MicroBatcher
+from prompt_compiler import compile_extract
+from resilience import StageGuard, Unavailable, register as register_guard
+from routing import Route, route
+from schemas import BATCH_SUMMARY_FORMAT, PARSE_STATS, USER_SUMMARY_FORMAT, parse_batch, parse_summary, repair_summary
+import tracing
 
-# ====== 你可以在这里切换/配置模型 ======
-OLLAMA_BASE = "http://localhost:11434"
-OLLAMA_MODEL = "llama3.1"
+
+# ====== 模型 / options / 端点按阶段配置（见 routing.py：OLLAMA_ROUTES、EXTRACT_MODEL、OLLAMA_ENDPOINTS）======
+EXTRACT_ROUTE = route("extract")
+OLLAMA_MODEL = EXTRACT_ROUTE.model
+
+# 规则快路径置信度阈值：rule_extract 的 confidence ≥ 阈值时跳过 LLM（设为 >1 可关闭快路径）
+FASTPATH_THRESHOLD = 0.8
+
+# 抽取结果缓存：键 = 归一化原话 + 模型名 + 提示词版本（改动 SYSTEM_PROMPT / make_user_prompt 时递增）
+EXTRACT_PROMPT_VERSION = "v4"
+EXTRACT_CACHE_SIZE = 4096
+EXTRACT_CACHE_TTL = 24 * 3600        # 秒
+EXTRACT_CACHE_DISK = None            # 例如 "extract_cache.sqlite3"：开启磁盘层，重启后仍可命中
+EXTRACT_CACHE = TTLCache(EXTRACT_CACHE_SIZE, EXTRACT_CACHE_TTL, EXTRACT_CACHE_DISK, name="extract")
+
+# 约束解码：通过 Ollama `format` 传 UserSummary 的 JSON Schema（"json" 只约束为合法 JSON；"none" 不约束，
+# 适配不支持 schema 的旧版服务）；输出上限按 schema 估算，模型写完对象即停，不会生成多余说明
+EXTRACT_FORMAT = os.getenv("EXTRACT_FORMAT", "schema")
+EXTRACT_NUM_PREDICT = 64             # {"intent":"counter_offer","customer_price":123456,"notes":"<20字>"} 约 45 token
+EXTRACT_BATCH_ITEM_NUM_PREDICT = 32  # 批量每项（不含 notes）的输出上限
+
+# 尾延迟保护：自适应超时 + 熔断（见 resilience.py）；LLM 不可用时降级为规则抽取
+EXTRACT_SLO_MS = float(os.getenv("EXTRACT_SLO_MS", "2000"))
+EXTRACT_GUARD = register_guard(StageGuard("extract", EXTRACT_SLO_MS))
+
+# 抽取微批（可选）：并发到达的抽取请求攒成一批，一次 LLM 调用处理，输出异常时逐条回退
+EXTRACT_MICROBATCH = os.getenv("EXTRACT_MICROBATCH", "0") == "1"
+EXTRACT_BATCH_MAX = int(os.getenv("EXTRACT_BATCH_MAX", "8"))
+EXTRACT_BATCH_WAIT_MS = float(os.getenv("EXTRACT_BATCH_WAIT_MS", "10"))
+EXTRACT_BATCH_TIMEOUT_FACTOR = 2.0    # 批量抽取的超时 / SLO 相对单条放宽的倍数
+EXTRACT_BATCHER: Optional[MicroBatcher] = None      # 见文件末尾 enable_microbatch()
+
+tracing.register_gauges("fastpath", fastpath_stats)
+tracing.register_gauges("extract_cache", EXTRACT_CACHE.stats)
+tracing.register_gauges("extract_parse", PARSE_STATS.as_dict)
 
 # ====== System Prompt（固化边界）======
+# 字段说明与输出格式都放在系统提示里（跨轮不变的前缀），用户侧只放原话
 SYSTEM_PROMPT = """你是数据提取器。只根据用户输入生成 JSON，不要输出多余文字。
 字段：
 - "intent": one of ["counter_offer","accept","ask","other"]
 - "customer_price": 整数或 null（如果无法解析）
-- "notes": 可选，简短中文
+- "notes": 可选，简短中文，不超过20字
+输出示例：{"intent":"counter_offer","customer_price":450,"notes":""}
 严格输出合法 JSON。"""
 
-# ====== User Prompt 模板（指导模型输出固定 JSON）======
+# ====== User Prompt：只含用户原话（超出抽取预算时保留首尾）======
 def make_user_prompt(user_text: str) -> str:
-    return f"""用户原话：
-\"\"\"{user_text}\"\"\"
+    return compile_extract(user_text).text
 
-请输出如下 JSON（不要多余文本、不要解释）：
+# ====== 批量抽取提示：多条原话编号，要求按编号返回 {"items": [...]}（省略 notes 以减少输出 token）======
+def make_batch_prompt(user_texts: List[str]) -> str:
+    lines = "\n".join(f'[{i}] \"\"\"{t}\"\"\"' for i, t in enumerate(user_texts, 1))
+    return f"""下面有 {len(user_texts)} 条互相独立的用户原话，请逐条抽取，输出如下 JSON（不要多余文本、不要解释）：
 {{
-  "intent": "counter_offer|accept|ask|other",
-  "customer_price":  整数或 null,
-  "notes": "可选中文备注，不超过20字"
-}}"""
+  "items": [
+    {{"id": 编号, "intent": "counter_offer|accept|ask|other", "customer_price": 整数或 null}}
+  ]
+}}
+items 必须恰好 {len(user_texts)} 项，按编号顺序一一对应。
+
+用户原话：
+{lines}"""
 
 # ====== Ollama 调用：得到 JSON 字符串 ======
-def call_ollama(user_text: str, base_url: str = OLLAMA_BASE, model: str = OLLAMA_MODEL) -> str:
-    url = f"{base_url.rstrip('/')}/api/chat"
-    messages = [
+def make_messages(user_text: str):
+    prompt = compile_extract(user_text)
+    tracing.annotate(**prompt.attrs())
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": make_user_prompt(user_text)}
+        {"role": "user", "content": prompt.text}
     ]
-    resp = requests.post(
-        url,
-        json={"model": model, "messages": messages, "stream": False},
-        timeout=120
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return (data.get("message", {}) or {}).get("content", "").strip()
-
-# ====== 解析 LLM 输出为 JSON（带兜底）======
-def safe_load_json(text: str) -> Dict[str, Any]:
-    try:
-        return json.loads(text)
-    except Exception:
-        # 兜底：从文本里用正则抠数字当 price
-        num = extract_price_from_text(text)
-        return {"intent": "other", "customer_price": num, "notes": "fallback_from_text"}
+
+def extract_request(schema: Dict[str, Any], num_predict: int) -> Dict[str, Any]:
+    """抽取请求的 format / num_predict 参数（按 EXTRACT_FORMAT 选择约束方式）"""
+    extra: Dict[str, Any] = {"options": {"num_predict": num_predict}}
+    if EXTRACT_FORMAT == "schema":
+        extra["format"] = schema
+    elif EXTRACT_FORMAT == "json":
+        extra["format"] = "json"
+    return extra
+
+def call_ollama(user_text: str, route: Route = EXTRACT_ROUTE) -> str:
+    """失败/超时/熔断时抛 resilience.Unavailable"""
+    messages = make_messages(user_text)
+    extra = extract_request(USER_SUMMARY_FORMAT, EXTRACT_NUM_PREDICT)
+    data = EXTRACT_GUARD.call(lambda timeout: route.chat(messages, timeout=timeout, **extra))
+    content = message_content(data)
+    tracing.record_ollama(data, messages, content)
+    return content
+
+async def acall_ollama(user_text: str, route: Route = EXTRACT_ROUTE) -> str:
+    messages = make_messages(user_text)
+    extra = extract_request(USER_SUMMARY_FORMAT, EXTRACT_NUM_PREDICT)
+    data = await EXTRACT_GUARD.acall(lambda timeout: route.achat(messages, timeout=timeout, **extra))
+    content = message_content(data)
+    tracing.record_ollama(data, messages, content)
+    return content
+
+def warm_up(route: Route = EXTRACT_ROUTE) -> Dict[str, Any]:
+    """启动时在抽取路由的每个端点上预加载模型并预热 SYSTEM_PROMPT 前缀"""
+    return route.warm_up(SYSTEM_PROMPT)
 
 # ====== 可复用的数字提取（兜底）======
 def extract_price_from_text(text: str) -> Optional[int]:
@@ -61,20 +124,124 @@ def extract_price_from_text(text: str) -> Optional[int]:
     return int(m.group(1)) if m else None
 
 # ====== 封装：前端输入 → user_summary(JSON) ======
-def summarize_user_input(user_text: str) -> Dict[str, Any]:
-    raw = call_ollama(user_text)
-    summary = safe_load_json(raw)
-    # 规整字段
-    intent = summary.get("intent") or "other"
-    price = summary.get("customer_price")
-    if price is None:
-        price = extract_price_from_text(user_text)
-    # 只接受非负整数
-    ok = isinstance(price, int) or (isinstance(price, str) and price.isdigit())
-    summary["intent"] = intent
-    summary["customer_price"] = int(price) if ok else None
+def _fast_path(user_text: str, threshold: Optional[float]) -> Optional[Dict[str, Any]]:
+    """规则快路径：置信度达到阈值返回结果，否则返回 None（需要 LLM）；threshold 缺省取 FASTPATH_THRESHOLD"""
+    if threshold is None:
+        threshold = FASTPATH_THRESHOLD      # 运行时读取，便于压测/调参时改模块常量
+    fast = rule_extract(user_text)
+    hit = fast["confidence"] >= threshold
+    FASTPATH_STATS.record(hit)
+    tracing.annotate(fast_path=hit, confidence=fast["confidence"])
+    return fast if hit else None
+
+def _extract_cache_key(user_text: str) -> str:
+    return f"{EXTRACT_ROUTE.model}|{EXTRACT_PROMPT_VERSION}|{normalize_text(user_text)}"
+
+def summarize_user_input(user_text: str, threshold: Optional[float] = None) -> Dict[str, Any]:
+    # 级联：先走规则快路径，置信度不足再调用 LLM
+    fast = _fast_path(user_text, threshold)
+    if fast is not None:
+        return fast
+
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return llm_summarize(user_text)
+
+    try:
+        summary = dict(EXTRACT_CACHE.get_or_compute(_extract_cache_key(user_text), compute))
+    except Unavailable as e:
+        return _degraded_summary(user_text, e)
+    tracing.annotate(cache_hit=not computed)
+    return summary
+
+async def asummarize_user_input(user_text: str, threshold: Optional[float] = None) -> Dict[str, Any]:
+    """summarize_user_input 的 asyncio 版本（LLM 调用不阻塞事件循环）"""
+    fast = _fast_path(user_text, threshold)
+    if fast is not None:
+        return fast
+
+    computed = []
+
+    async def compute():
+        computed.append(True)
+        return await allm_summarize(user_text)
+
+    try:
+        summary = dict(await EXTRACT_CACHE.aget_or_compute(_extract_cache_key(user_text), compute))
+    except Unavailable as e:
+        return _degraded_summary(user_text, e)
+    tracing.annotate(cache_hit=not computed)
+    return summary
+
+def _degraded_summary(user_text: str, error: Unavailable) -> Dict[str, Any]:
+    """LLM 不可用（熔断/超时/出错）：不论置信度直接用规则抽取结果（不写缓存）"""
+    EXTRACT_GUARD.note_degraded()
+    tracing.annotate(degraded=error.reason)
+    return rule_extract(user_text)
+
+# ====== LLM 抽取（快路径不确定且缓存未命中时调用）======
+def normalize_summary(raw: str, user_text: str) -> Dict[str, Any]:
+    """模型输出 → 规整的 user_summary：先按 UserSummary 校验（必要时修复），都失败时从文本里抠价格兜底"""
+    parsed, outcome = parse_summary(raw)
+    tracing.annotate(parse=outcome)
+    if parsed is None:
+        return _with_price({"intent": "other", "customer_price": extract_price_from_text(raw),
+                            "notes": "fallback_from_text"}, user_text)
+    return _with_price(parsed.model_dump(), user_text)
+
+def _with_price(summary: Dict[str, Any], user_text: str) -> Dict[str, Any]:
+    # 模型没给价格时，从用户原话里补
+    if summary.get("customer_price") is None:
+        summary["customer_price"] = extract_price_from_text(user_text)
     return summary
 
+def llm_summarize(user_text: str) -> Dict[str, Any]:
+    if EXTRACT_BATCHER is not None:
+        tracing.annotate(microbatch=True)
+        return EXTRACT_BATCHER.call(user_text)
+    return llm_summarize_one(user_text)
+
+async def allm_summarize(user_text: str) -> Dict[str, Any]:
+    if EXTRACT_BATCHER is not None:
+        tracing.annotate(microbatch=True)
+        return await EXTRACT_BATCHER.acall(user_text)
+    return normalize_summary(await acall_ollama(user_text), user_text)
+
+def llm_summarize_one(user_text: str) -> Dict[str, Any]:
+    return normalize_summary(call_ollama(user_text), user_text)
+
+def llm_summarize_batch(user_texts: List[str], route: Route = EXTRACT_ROUTE) -> List[Any]:
+    """一次 LLM 调用抽取多条；无法对应到某条的结果以 FALLBACK 占位（由微批逐条回退）"""
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": make_batch_prompt(user_texts)},
+    ]
+    if EXTRACT_GUARD.breaker.is_open():
+        return [FALLBACK] * len(user_texts)        # 熔断中：逐条回退，由单条调用快速拒绝并降级
+    num_predict = EXTRACT_BATCH_ITEM_NUM_PREDICT * len(user_texts) + 16
+    extra = extract_request(BATCH_SUMMARY_FORMAT, num_predict)
+    # 经 StageGuard：失败 / 超时计入熔断（半开时也可作探测）；出错抛 Unavailable，由微批逐条回退
+    data = EXTRACT_GUARD.call(lambda timeout: route.chat(messages, timeout=timeout, **extra),
+                              timeout_factor=EXTRACT_BATCH_TIMEOUT_FACTOR, sample=False)
+    return split_batch_output(message_content(data), user_texts)
+
+def split_batch_output(raw: str, user_texts: List[str]) -> List[Any]:
+    """把批量输出拆回每条；整体无法解析时抛 ValueError"""
+    items = parse_batch(raw)
+    if items is None:
+        raise ValueError("batch output has no items array")
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for pos, item in enumerate(items, 1):
+        if isinstance(item, dict):
+            by_id.setdefault(item.get("id") if isinstance(item.get("id"), int) else pos, item)
+    results: List[Any] = []
+    for i, text in enumerate(user_texts, 1):
+        summary = repair_summary(by_id.get(i))
+        results.append(FALLBACK if summary is None else _with_price(summary.model_dump(), text))
+    return results
+
 
 # ====== 从三份原始数据提炼“核心视图”给 NLG ======
 # bridge.py（替换/更新 extract_core_view）
@@ -116,6 +283,7 @@ def extract_core_view(user_summary: Dict[str, Any],
         "intent": intent,
         "can_negotiate": can_negotiate,
         "allowed_actions": allowed_actions,
+        "token_budget": fsm_contract.get("persona", {}).get("token_budget"),   # 话术提示预算（不渲染给模型）
     }
     return core
 
@@ -124,7 +292,7 @@ def extract_core_view(user_summary: Dict[str, Any],
 # ====== 对接 FSM：把价格喂进去，拿到 snapshot/contract ======
 def run_fsm_turn(fsm, user_text: str) -> Dict[str, Any]:
     """
-    fsm: 你的 NegotiationModel 实例
+    fsm: 你的 NegotiationModel / CompiledNegotiationModel 实例
     返回结构：
     {
       "user_summary": {...},   # LLM提取结果
@@ -132,10 +300,40 @@ def run_fsm_turn(fsm, user_text: str) -> Dict[str, Any]:
       "fsm_contract": {...}    # 语言层合同（权威）
     }
     """
-    summary = summarize_user_input(user_text)
-    price = summary.get("customer_price")
+    with tracing.span("extract"):
+        summary = summarize_user_input(user_text)
+    return advance_fsm(fsm, summary)
 
+
+async def arun_fsm_turn(fsm, user_text: str) -> Dict[str, Any]:
+    """run_fsm_turn 的 asyncio 版本：只有抽取阶段涉及 I/O"""
+    with tracing.span("extract"):
+        summary = await asummarize_user_input(user_text)
+    return advance_fsm(fsm, summary)
+
+
+def advance_fsm(fsm, summary: Dict[str, Any]) -> Dict[str, Any]:
+    """把抽取结果喂给 FSM，返回 run_fsm_turn 的结构（纯 CPU，同步/异步共用）"""
     # 推进 FSM
+    with tracing.span("fsm") as sp:
+        snap, contract = step_fsm(fsm, summary)
+        sp.set(state=snap.get("state"), ai_offer=snap.get("ai_offer"))
+
+    # ★ 新增：提炼核心视图
+    with tracing.span("core_view"):
+        core_view = extract_core_view(summary, snap, contract)
+
+    return {
+        "user_summary": summary,
+        "fsm_snapshot": snap,
+        "fsm_contract": contract,
+        "core_view": core_view,      # ← 新增返回
+    }
+
+
+def step_fsm(fsm, summary: Dict[str, Any]):
+    """按抽取结果推进 FSM 一步，返回 (snapshot, contract)；不记 span（推测执行的空跑也用它）"""
+    price = summary.get("customer_price")
     if price is not None:
         snap = fsm.input_user_price(price)
     else:
@@ -144,14 +342,19 @@ def run_fsm_turn(fsm, user_text: str) -> Dict[str, Any]:
             fsm.start()         # INIT -> ANCHOR
             fsm.to_WAIT_USER()  # -> WAIT_USER
         snap = fsm.snapshot()
+    return snap, fsm.contract()
 
-    contract = fsm.contract()
-    # ★ 新增：提炼核心视图
-    core_view = extract_core_view(summary, snap, contract)
 
-    return {
-        "user_summary": summary,
-        "fsm_snapshot": snap,
-        "fsm_contract": contract,
-        "core_view": core_view,      # ← 新增返回
-    }
+def enable_microbatch(max_batch: int = EXTRACT_BATCH_MAX, max_wait_ms: float = EXTRACT_BATCH_WAIT_MS) -> MicroBatcher:
+    """开启抽取微批（替换已有的批处理器）"""
+    global EXTRACT_BATCHER
+    if EXTRACT_BATCHER is not None:
+        EXTRACT_BATCHER.close()
+    EXTRACT_BATCHER = MicroBatcher(llm_summarize_batch, llm_summarize_one,
+                                   max_batch=max_batch, max_wait_ms=max_wait_ms, name="extract_batch")
+    tracing.register_gauges("extract_batch", EXTRACT_BATCHER.stats)
+    return EXTRACT_BATCHER
+
+
+if EXTRACT_MICROBATCH:
+    enable_microbatch()
@@ -0,0 +1,354 @@
+# cache.py
+# 有界缓存：LRU 淘汰 + TTL 过期 + 命中/未命中/淘汰计数 + 可选 SQLite 磁盘层（重启后仍可用）
+# 线程安全；get_or_compute / aget_or_compute 对同一 key 做 single-flight（并发的相同请求只计算一次）
+# VariantCache：每个 key 收集若干个不同结果（如同一状态下的多种话术），集齐后轮换返回，避免千篇一律
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+_MISSING = object()
+DISK_SIZE_FACTOR = 10        # 磁盘层行数上限默认为内存容量的倍数
+DISK_PRUNE_EVERY = 256       # 每写入这么多次清理一遍磁盘层（过期行 + 超出上限的最早写入行）
+# 非字母数字字符（空白/标点/符号），但保留数字之间的小数点
+_PUNCT_OR_SPACE = re.compile(r"(?:(?!(?<=\d)\.(?=\d))[\W_])+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化用户原话用作缓存键：
+    全角→半角（NFKC）、小写、去空白、去标点（保留数字间的小数点）
+    """
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    return _PUNCT_OR_SPACE.sub("", s)
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+async def _single_flight(flights: Dict[str, asyncio.Future], key: str, lookup: Callable[[], Any],
+                         compute: Callable[[], Awaitable[Any]], store: Callable[[Any], None],
+                         on_shared: Callable[[], None]) -> Any:
+    """
+    asyncio 版 single-flight（TTLCache / VariantCache 共用）：同一 key 只有一个领头协程执行 compute，
+    其余 await 它的结果。领头协程被取消时不把取消传给等待者：flight 以 _MISSING 结束，
+    等待者重新查缓存，由第一个醒来的接手计算，其余改为等待新的领头者。
+    """
+    while True:
+        value = lookup()
+        if value is not _MISSING:
+            return value
+        flight = flights.get(key)
+        if flight is None:
+            break
+        on_shared()
+        value = await asyncio.shield(flight)
+        if value is not _MISSING:
+            return value
+
+    flight = flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await compute()
+        store(value)
+        flight.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        flight.set_result(_MISSING)     # 只取消领头者自己，等待者接手
+        raise
+    except BaseException as e:
+        flight.set_exception(e)
+        flight.exception()              # 已标记为取回，避免无人等待时告警
+        raise
+    finally:
+        flights.pop(key, None)
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600.0,
+                 disk_path: Optional[str] = None, name: str = "cache", disk_maxsize: Optional[int] = None):
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize or maxsize * DISK_SIZE_FACTOR
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.RLock()
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: Dict[str, asyncio.Future] = {}     # 异步版 single-flight（同一事件循环内）
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+        self.disk_pruned = 0
+        self._disk_writes = 0
+        self.shared = 0          # single-flight 中等待他人结果的次数
+
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+            self._db.commit()
+            self._disk_prune()
+
+    # ========== 基本读写 ==========
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl else float("inf")
+
+    def _disk_get(self, key: str) -> Tuple[Any, float]:
+        """(value, expires)；未命中或已过期时 value 为 _MISSING"""
+        row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return _MISSING, 0.0
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+            return _MISSING, 0.0
+        return json.loads(value), float("inf") if expires is None else expires
+
+    def _disk_set(self, key: str, value: Any, expires: float) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), None if expires == float("inf") else expires),
+        )
+        self._db.commit()
+        self._disk_writes += 1
+        if self._disk_writes % DISK_PRUNE_EVERY == 0:
+            self._disk_prune()
+
+    def _disk_prune(self) -> None:
+        """删掉过期行；仍超出 disk_maxsize 时按写入顺序（rowid，INSERT OR REPLACE 会换新 rowid）删最早的"""
+        cur = self._db.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        pruned = cur.rowcount
+        (rows,) = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if rows > self.disk_maxsize:
+            cur = self._db.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)",
+                (rows - self.disk_maxsize,),
+            )
+            pruned += cur.rowcount
+        self._db.commit()
+        self.disk_pruned += pruned
+
+    def _store(self, key: str, value: Any, expires: float) -> None:
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            if self._db is not None:
+                value, expires = self._disk_get(key)
+                if value is not _MISSING:
+                    self._store(key, value, expires)       # 沿用落盘时的过期时间，不因重启/淘汰而续期
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            expires = self._expires_at()
+            self._store(key, value, expires)
+            if self._db is not None:
+                self._disk_set(key, value, expires)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # ========== single-flight ==========
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """命中直接返回；未命中时同一 key 只有一个调用者执行 compute，其余等待共享结果。"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.time():
+                return item[1]          # 在两次加锁之间已被其他调用者写入
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+            self.set(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """get_or_compute 的 asyncio 版本：等待者 await 领头协程的结果，不占线程。"""
+        return await _single_flight(self._aflights, key, lambda: self.get(key, _MISSING),
+                                    compute, lambda value: self.set(key, value), self._count_shared)
+
+    def _count_shared(self) -> None:
+        with self._lock:
+            self.shared += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_hits": self.disk_hits,
+                "disk_pruned": self.disk_pruned,
+                "shared_inflight": self.shared,
+            }
+
+
+class VariantCache:
+    """
+    每个 key 最多保存 variants 个结果：前 variants 次请求各生成一个（同一 key 的并发请求只生成一次、共享结果），
+    之后轮换返回已有结果。生成结果与已有结果相同（如确定性解码）时也计入生成次数，不会无限重试。
+    存储复用 TTLCache（LRU + TTL）；value 为 {"values": [...], "fills": 已生成次数}。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600.0, variants: int = 3, name: str = "variants"):
+        self.variants = variants
+        self.name = name
+        self.store = TTLCache(maxsize, ttl, name=name)
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.fills = 0
+        self.shared = 0
+        self._served = 0
+
+    def pick(self, key: str) -> Any:
+        """已集齐时轮换返回一个结果，否则返回 None（调用方应生成新结果）"""
+        entry = self.store.get(key)
+        if entry is None or entry["fills"] < self.variants:
+            return None
+        with self._lock:
+            self.hits += 1
+            self._served += 1
+            return entry["values"][self._served % len(entry["values"])]
+
+    def add(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.fills += 1
+            entry = self.store.get(key) or {"values": [], "fills": 0}
+            values = entry["values"] if value in entry["values"] else entry["values"] + [value]
+            self.store.set(key, {"values": values, "fills": entry["fills"] + 1})
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.pick(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute()
+            self.add(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        return await _single_flight(self._aflights, key, lambda: self._pick_or_missing(key),
+                                    compute, lambda value: self.add(key, value), self._count_shared)
+
+    def _pick_or_missing(self, key: str) -> Any:
+        value = self.pick(key)
+        return _MISSING if value is None else value
+
+    def _count_shared(self) -> None:
+        with self._lock:
+            self.shared += 1
+
+    def stats(self) -> Dict[str, Any]:
+        store = self.store.stats()
+        with self._lock:
+            lookups = self.hits + self.fills + self.shared
+            return {
+                "name": self.name,
+                "keys": store["size"],
+                "maxsize": store["maxsize"],
+                "variants": self.variants,
+                "hits": self.hits,
+                "fills": self.fills,
+                "shared_inflight": self.shared,
+                "hit_rate": round((self.hits + self.shared) / lookups, 4) if lookups else 0.0,
+                "evictions": store["evictions"],
+                "expirations": store["expirations"],
+            }
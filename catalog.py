@@ -0,0 +1,301 @@
+# catalog.py
+# 商品目录：按 SKU 保存议价参数（标价 / 底价 / 停降价位 / 让价次数等）、价值点与话术人设，会话按 SKU 开启。
+#   - 存储：本地 SQLite（WAL，多进程可共享），sku 为主键：取一个商品是一次主键查找，不扫表，
+#     目录有几万条时开会话的开销也不变
+#   - 热数据：按 SKU 的 LRU（cache.TTLCache）缓存“水合”后的 CatalogEntry，即 NegotiationCtx 配置模板
+#     + 话术合同骨架（product / persona / nlg）。命中时开会话 = 一次字典查找 + 构造 ctx；查不到的 SKU 也缓存（None）
+#   - 合同：NegotiationCtx.sku 指向目录条目，contract() 从骨架取商品名 / 价值点 / 人设；
+#     无 SKU（或条目已下架）时用演示默认值（DEMO_ENTRY），与原先写死的合同一致
+#   - 更新：upsert / delete 后本进程立即失效对应 SKU；其他进程的缓存最多 CATALOG_CACHE_TTL 秒后刷新。
+#     已开的会话价格配置随 ctx 保存，不受目录改价影响
+# 命中率与回源查库耗时计入 "catalog" 指标。
+# 导入：python catalog.py import items.jsonl（每行一个商品，字段见 Product）
+#       python catalog.py demo 20000（生成演示商品）；python catalog.py get SKU
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+import tracing
+
+CATALOG_DB = os.getenv("CATALOG_DB", "catalog.sqlite3")
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "4096"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))      # 秒
+
+# 目录可配置的 NegotiationCtx 字段：前四个是必填列，其余可选（缺省取 NegotiationCtx 默认值）
+PRICE_FIELDS = ("list_price", "bar_price", "stop_floor", "max_concessions")
+PARAM_FIELDS = ("jump_improve_threshold", "psych_zone_price", "fraction_towards_user", "round_base", "min_tick")
+
+DEMO_TITLE = "演示商品"
+DEFAULT_VALUE_REASONS = ("正品保障与售后", "做工与用料优于同级", "现货可加急（以政策为准）")
+DEFAULT_PERSONA = {"style": "analytic", "politeness": "medium", "token_budget": 256}
+DEFAULT_NLG = {"tone": "professional", "length_hint": "2-4 sentences", "cta": "若确认可立即锁单并优先发货"}
+
+
+@dataclass
+class Product:
+    """目录里的一条商品（导入格式）"""
+    sku: str
+    title: str
+    list_price: int
+    bar_price: int
+    stop_floor: int
+    max_concessions: int = 5
+    params: Dict[str, Any] = field(default_factory=dict)         # PARAM_FIELDS 中的可选覆盖
+    value_reasons: List[str] = field(default_factory=lambda: list(DEFAULT_VALUE_REASONS))
+    persona: Dict[str, Any] = field(default_factory=dict)        # 覆盖 DEFAULT_PERSONA 的字段
+    cta: Optional[str] = None                                    # 覆盖 DEFAULT_NLG["cta"]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Product":
+        """接受扁平格式：PARAM_FIELDS 可直接写在顶层"""
+        data = dict(data)
+        params = dict(data.pop("params", None) or {})
+        for name in PARAM_FIELDS:
+            if name in data:
+                params[name] = data.pop(name)
+        known = {"sku", "title", "value_reasons", "persona", "cta", *PRICE_FIELDS}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"unknown product fields: {sorted(unknown)}")
+        return cls(params=params, **data)
+
+    def validate(self) -> "Product":
+        if not isinstance(self.sku, str) or not self.sku.strip():
+            raise ValueError("sku must be a non-empty string")
+        if not isinstance(self.title, str) or not self.title.strip():
+            raise ValueError(f"{self.sku}: title must be a non-empty string")
+        for name in PRICE_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f"{self.sku}: {name} must be an integer")
+        if not 0 <= self.bar_price <= self.list_price:
+            raise ValueError(f"{self.sku}: bar_price must be between 0 and list_price")
+        if not self.bar_price <= self.stop_floor <= self.list_price:
+            raise ValueError(f"{self.sku}: stop_floor must be between bar_price and list_price")
+        if self.max_concessions < 0:
+            raise ValueError(f"{self.sku}: max_concessions must be >= 0")
+        unknown = set(self.params) - set(PARAM_FIELDS)
+        if unknown:
+            raise ValueError(f"{self.sku}: unknown params: {sorted(unknown)}")
+        if not all(isinstance(r, str) for r in self.value_reasons):
+            raise ValueError(f"{self.sku}: value_reasons must be a list of strings")
+        return self
+
+
+class CatalogEntry:
+    """水合后的目录条目（只读，所有会话共享）：ctx 配置模板 + 合同骨架"""
+    __slots__ = ("sku", "title", "config", "value_reasons", "persona", "nlg")
+
+    def __init__(self, sku: Optional[str], title: str, config: Mapping[str, Any], value_reasons: Iterable[str],
+                 persona: Mapping[str, Any], nlg: Mapping[str, Any]):
+        self.sku = sku
+        self.title = title
+        self.config = MappingProxyType(dict(config))
+        self.value_reasons = tuple(value_reasons)
+        self.persona = MappingProxyType(dict(persona))
+        self.nlg = MappingProxyType(dict(nlg))
+
+    @classmethod
+    def from_product(cls, p: Product) -> "CatalogEntry":
+        config = {name: getattr(p, name) for name in PRICE_FIELDS}
+        config.update(p.params)
+        nlg = dict(DEFAULT_NLG)
+        if p.cta:
+            nlg["cta"] = p.cta
+        return cls(p.sku, p.title, config, p.value_reasons, {**DEFAULT_PERSONA, **p.persona}, nlg)
+
+    def product(self, value_reasons: List[str]) -> Dict[str, Any]:
+        """合同里的 product 段"""
+        out: Dict[str, Any] = {"title": self.title, "value_reasons": value_reasons}
+        if self.sku is not None:
+            out["sku"] = self.sku
+        return out
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"sku": self.sku, "title": self.title, "config": dict(self.config),
+                "value_reasons": list(self.value_reasons), "persona": dict(self.persona), "nlg": dict(self.nlg)}
+
+
+DEMO_ENTRY = CatalogEntry(None, DEMO_TITLE, {}, DEFAULT_VALUE_REASONS, DEFAULT_PERSONA, DEFAULT_NLG)
+_COLUMNS = ("sku, title, list_price, bar_price, stop_floor, max_concessions,"
+            " params, value_reasons, persona, cta")
+
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_DB, cache_size: int = CATALOG_CACHE_SIZE,
+                 cache_ttl: Optional[float] = CATALOG_CACHE_TTL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " sku TEXT PRIMARY KEY, title TEXT NOT NULL,"
+            " list_price INTEGER NOT NULL, bar_price INTEGER NOT NULL,"
+            " stop_floor INTEGER NOT NULL, max_concessions INTEGER NOT NULL,"
+            " params TEXT NOT NULL, value_reasons TEXT NOT NULL, persona TEXT NOT NULL, cta TEXT,"
+            " updated REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._db.commit()
+        self.cache = TTLCache(cache_size, ttl=cache_ttl or None, name="catalog")
+        self.loads = 0
+        self.load_s = 0.0
+
+    # ========== 读 ==========
+    def product(self, sku: str) -> Optional[Product]:
+        """直接查库（不走缓存）"""
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM products WHERE sku = ?", (sku,)).fetchone()
+        return None if row is None else _row_product(row)
+
+    def _load(self, sku: str) -> Optional[CatalogEntry]:
+        t0 = time.perf_counter()
+        p = self.product(sku)
+        with self._lock:
+            self.loads += 1
+            self.load_s += time.perf_counter() - t0
+        return None if p is None else CatalogEntry.from_product(p)
+
+    def get(self, sku: str) -> Optional[CatalogEntry]:
+        """按 SKU 取水合后的条目；不存在返回 None（同样缓存，下架 / 新增后由 upsert / delete 失效）"""
+        return self.cache.get_or_compute(sku, lambda: self._load(sku))
+
+    def skus(self, after: str = "", limit: int = 100) -> List[str]:
+        """按 SKU 顺序分页（键集分页，沿主键索引，不做 OFFSET 扫描）"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sku FROM products WHERE sku > ? ORDER BY sku LIMIT ?", (after, limit)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    # ========== 写 ==========
+    def upsert(self, products: Iterable[Product]) -> int:
+        now = time.time()
+        rows = [_product_row(p.validate(), now) for p in products]
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO products ({_COLUMNS}, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+        for row in rows:
+            self.cache.delete(row[0])
+        return len(rows)
+
+    def delete(self, sku: str) -> bool:
+        with self._lock:
+            n = self._db.execute("DELETE FROM products WHERE sku = ?", (sku,)).rowcount
+            self._db.commit()
+        self.cache.delete(sku)
+        return n > 0
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self.cache.stats()
+        with self._lock:
+            loads, load_s = self.loads, self.load_s
+        return {
+            "cached": cache["size"],
+            "hit_rate": cache["hit_rate"],
+            "db_loads": loads,
+            "mean_load_ms": round(load_s / loads * 1000, 3) if loads else 0.0,
+        }
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _product_row(p: Product, now: float) -> Tuple[Any, ...]:
+    return (p.sku, p.title, p.list_price, p.bar_price, p.stop_floor, p.max_concessions,
+            _dumps(p.params), _dumps(list(p.value_reasons)), _dumps(p.persona), p.cta, now)
+
+
+def _row_product(row: Tuple[Any, ...]) -> Product:
+    sku, title, list_price, bar_price, stop_floor, max_concessions, params, reasons, persona, cta = row
+    return Product(sku, title, list_price, bar_price, stop_floor, max_concessions,
+                   json.loads(params), json.loads(reasons), json.loads(persona), cta)
+
+
+# ====== 进程内默认目录（首次用到时打开）======
+_CATALOG: Optional[Catalog] = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_catalog() -> Catalog:
+    global _CATALOG
+    if _CATALOG is None:
+        with _CATALOG_LOCK:
+            if _CATALOG is None:
+                _CATALOG = Catalog(CATALOG_DB)
+    return _CATALOG
+
+
+def lookup(sku: str) -> Optional[CatalogEntry]:
+    return get_catalog().get(sku)
+
+
+def skeleton(sku: Optional[str]) -> CatalogEntry:
+    """合同骨架：无 SKU 或查不到时为 DEMO_ENTRY"""
+    if not sku:
+        return DEMO_ENTRY
+    return get_catalog().get(sku) or DEMO_ENTRY
+
+
+tracing.register_gauges("catalog", lambda: get_catalog().stats() if _CATALOG is not None else {})
+
+
+def demo_products(n: int, seed: int = 0) -> List[Product]:
+    """演示 / 压测用的合成商品"""
+    import random
+    rng = random.Random(seed)
+    kinds = ["保温杯", "双肩包", "蓝牙耳机", "机械键盘", "跑步鞋", "台灯", "床品四件套", "电饭煲"]
+    reasons = ["正品保障与售后", "做工与用料优于同级", "现货可加急（以政策为准）", "七天无理由退换", "一年质保"]
+    out = []
+    for i in range(n):
+        list_price = rng.randrange(100, 5000, 10)
+        bar_price = int(list_price * rng.uniform(0.6, 0.85)) // 5 * 5
+        stop_floor = min(bar_price + rng.randrange(0, 50, 5), list_price)
+        out.append(Product(
+            sku=f"SKU{i:06d}", title=f"{rng.choice(kinds)} {i}", list_price=list_price, bar_price=bar_price,
+            stop_floor=stop_floor, max_concessions=rng.randint(2, 6),
+            value_reasons=rng.sample(reasons, 2),
+            persona={"token_budget": rng.choice([192, 256, 320])},
+        ))
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    ap = argparse.ArgumentParser(description="商品目录（SQLite）")
+    ap.add_argument("--db", default=CATALOG_DB)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("import", help="从 JSON Lines 导入 / 更新商品").add_argument("path")
+    sub.add_parser("demo", help="生成演示商品").add_argument("n", type=int)
+    sub.add_parser("get", help="查看一个商品（水合后的条目）").add_argument("sku")
+    args = ap.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.cmd == "import":
+        with open(args.path, encoding="utf-8") as f:
+            products = [Product.from_dict(json.loads(line)) for line in f if line.strip()]
+        print(f"imported {catalog.upsert(products)} products into {args.db}")
+    elif args.cmd == "demo":
+        print(f"wrote {catalog.upsert(demo_products(args.n))} demo products into {args.db}")
+    else:
+        entry = catalog.get(args.sku)
+        if entry is None:
+            sys.exit(f"sku not found: {args.sku}")
+        print(json.dumps(entry.as_dict(), ensure_ascii=False, indent=2))
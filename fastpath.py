@@ -0,0 +1,190 @@
+# fastpath.py
+# 规则快路径：用确定性规则抽取 intent / customer_price，并给出置信度
+# 置信度达到阈值时 bridge.summarize_user_input 直接返回，不再调用 LLM
+
+from typing import Any, Dict, List, Tuple
+import re
+import threading
+
+from numerals import iter_numbers
+
+MIN_PRICE = 10          # 低于此值的数字不当作价格（“便宜一点”里的“一”）
+MAX_PRICE = 999999
+
+# ====== 关键词词典 ======
+ACCEPT_WORDS = ["就这个价", "就这价", "就按这个", "按你说的", "成交", "拍了", "拍下", "下单", "要了",
+                "没问题", "就这么定", "同意", "可以的", "好的", "行吧", "那就这样", "ok", "OK"]
+ACCEPT_SHORT = {"行", "好", "可以", "嗯", "中", "好吧", "行的", "可以了"}
+ASK_WORDS = ["多少", "最低", "便宜", "优惠", "折扣", "包邮", "还能", "能不能", "能否", "少点",
+             "再少", "降点", "让点", "底价", "几折", "怎么卖", "什么价"]
+NEGATE_WORDS = ["不行", "不可以", "不要", "太贵", "贵了", "算了", "不买", "没诚意", "不考虑"]
+# 接受词前 NEGATION_WINDOW 个字内出现否定字即视为否定（不同意 / 先不下单 / 这个价不能成交 / 不ok）
+NEGATORS = "不没别未甭"
+NEGATION_WINDOW = 3
+NOT_NEGATIONS = ("不错", "没错", "特别", "分别", "不客气")     # 含否定字但不是否定
+QUESTION_WORDS = ["吗", "么", "嘛", "呢", "?", "？", "行不行", "可不可以", "怎么样", "如何"]
+CHOICE_QUESTIONS = ("行不行", "可不可以", "要不要", "能不能")   # 含否定字但不是否定
+# 出现在数字前表示“不是用户出价”的上下文（原价500、你说的480）
+REFERENCE_PREFIXES = ("原价", "标价", "定价", "你说的", "你报的", "之前", "刚才", "上次")
+
+_PUNCT_RE = re.compile(r"[\s，。！!、,.~～…]+")
+
+
+def _contains(text: str, words: List[str]) -> bool:
+    return any(w in text for w in words)
+
+
+def _accept_match(text: str) -> Tuple[bool, bool, bool]:
+    """(是否含接受词, 是否有接受词被否定, 去掉接受词后是否仍有否定字)"""
+    matched = negated = False
+    for w in NOT_NEGATIONS:
+        text = text.replace(w, "_" * len(w))        # 等长占位，保持接受词与否定字的相对位置
+    rest = text
+    for w in ACCEPT_WORDS:
+        i = text.find(w)
+        while i != -1:
+            matched = True
+            if any(c in NEGATORS for c in text[max(0, i - NEGATION_WINDOW):i]):
+                negated = True
+            i = text.find(w, i + 1)
+        rest = rest.replace(w, "")
+    return matched, negated, any(c in NEGATORS for c in rest)
+
+
+def _candidate_prices(text: str) -> List[Dict[str, Any]]:
+    out = []
+    for start, end, value, has_unit, is_chinese in iter_numbers(text):
+        if not (MIN_PRICE <= value <= MAX_PRICE):
+            continue
+        # 纯中文数字且无单位时，只有较大的值才可信（排除“十分”“一两个”）
+        if is_chinese and not has_unit and value < 100:
+            continue
+        prefix = text[max(0, start - 4):start]
+        out.append({
+            "value": value,
+            "has_unit": has_unit,
+            "is_chinese": is_chinese,
+            "reference": any(p in prefix for p in REFERENCE_PREFIXES),
+        })
+    return out
+
+
+def rule_extract(user_text: str) -> Dict[str, Any]:
+    """
+    规则抽取：返回与 LLM 抽取同构的 user_summary，外加 confidence（0~1）
+    {"intent": ..., "customer_price": int|None, "notes": "fast_path", "confidence": float}
+    """
+    text = (user_text or "").strip()
+    core = _PUNCT_RE.sub("", text)
+    is_question = _contains(text, QUESTION_WORDS)
+    plain = text
+    for q in CHOICE_QUESTIONS:
+        plain = plain.replace(q, "")
+    negated = _contains(plain, NEGATE_WORDS)
+
+    prices = _candidate_prices(text)
+    offers = [p for p in prices if not p["reference"]]
+    distinct = sorted({p["value"] for p in offers})
+
+    accept_hit, accept_negated, has_negator = _accept_match(plain)
+    intent, price, confidence = "other", None, 0.0
+
+    if len(distinct) == 1:
+        # 单一出价：450 / 450可以吗 / 四百五行不行
+        intent, price = "counter_offer", distinct[0]
+        confidence = 0.9
+        if offers[-1]["has_unit"] or core.isdigit():
+            confidence = 0.95
+        if negated:
+            confidence -= 0.2          # “450不行”：可能是在拒绝对方报价
+    elif len(distinct) > 1:
+        # 多个候选价：取最后一个，但交给 LLM 判断
+        intent, price = "counter_offer", offers[-1]["value"]
+        confidence = 0.5
+    elif negated or accept_negated:
+        intent, confidence = "other", 0.6
+    elif core in ACCEPT_SHORT or (accept_hit and not is_question):
+        # 无价格的接受：行，就这个价 / 好的拍了；句中别处还有否定字（好的，不过先不急）时交给 LLM
+        intent, confidence = "accept", 0.6 if has_negator else 0.9
+    elif _contains(text, ASK_WORDS):
+        # 询价/求优惠：能便宜点吗 / 最低多少
+        intent, confidence = "ask", 0.85
+    elif is_question:
+        intent, confidence = "ask", 0.5
+
+    if prices and not offers:
+        # 只提到了参考价（原价500），意图不明
+        confidence = min(confidence, 0.5)
+
+    return {
+        "intent": intent,
+        "customer_price": price,
+        "notes": "fast_path",
+        "confidence": round(max(0.0, min(confidence, 1.0)), 2),
+    }
+
+
+# ====== 命中率统计 ======
+class FastPathStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.hits = 0
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            self.total += 1
+            self.hits += int(hit)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            total, hits = self.total, self.hits
+        return {
+            "total": total,
+            "hits": hits,
+            "llm_calls": total - hits,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = self.hits = 0
+
+
+STATS = FastPathStats()
+
+
+def fastpath_stats() -> Dict[str, Any]:
+    return STATS.as_dict()
+
+
+# 回归用例：(用户原话, 期望 intent, 是否应由快路径直接返回)；否定了接受词的句子绝不能当成交
+REGRESSION_CASES = [
+    ("不同意", "other", False),
+    ("不成交", "other", False),
+    ("不拍了", "other", False),
+    ("先不下单", "other", False),
+    ("不ok", "other", False),
+    ("这个价不能成交", "other", False),
+    ("好的，不过先不急", "accept", False),
+    ("不错，成交", "accept", True),
+    ("好的拍了", "accept", True),
+    ("没问题，就这个价", "accept", True),
+    ("行", "accept", True),
+]
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    from bridge import FASTPATH_THRESHOLD
+
+    if len(sys.argv) > 1:
+        for t in sys.argv[1:]:
+            print(t, json.dumps(rule_extract(t), ensure_ascii=False))
+    else:
+        for t, intent, fast in REGRESSION_CASES:
+            r = rule_extract(t)
+            assert r["intent"] == intent and (r["confidence"] >= FASTPATH_THRESHOLD) == fast, (t, r)
+        print(f"{len(REGRESSION_CASES)} cases ok")
@@ -1,10 +1,11 @@
-from dataclasses import dataclass, field, asdict
-from typing import List, Optional, Dict, Any
+from dataclasses import dataclass, field, fields
+from collections import deque
+from typing import Deque, List, Optional, Dict, Any
 from transitions import Machine
-import math
+from types import MappingProxyType
 
-def _round_to_base(x: float, base: int) -> int:
-    return int(base * round(x / base))
+from policy import compile_policy
+import catalog
 
 @dataclass
 class NegotiationCtx:
@@ -20,51 +21,51 @@ class NegotiationCtx:
     fraction_towards_user: float = 1/2   # 从 AI 价向用户价推进的比例（0~1）
     round_base: int = 5                 # 取整基数：整十=10，整五=5
     min_tick: int = 10                   # 最小让步跳动，避免“没降价”的取整
+    sku: Optional[str] = None            # 商品目录 SKU（合同里的商品名/价值点/人设取自目录；None 为演示商品）
 
     # —— 运行态 —— #
     k: int = 0                           # 已让次数
     ai_offer: int = field(init=False)    # 当前AI报价
     last_user_offer: Optional[int] = None
     ended: bool = False
-    history: List[Dict[str, Any]] = field(default_factory=list)  # 每轮记录
+    history: Deque[Dict[str, Any]] = field(default_factory=deque)  # 每轮记录（环形缓冲，只保留最近 history_cap 条）
+    history_cap: int = 200
 
     def __post_init__(self):
         self.ai_offer = self.list_price
-
-class NegotiationModel:
-    states = ["INIT", "ANCHOR", "WAIT_USER", "CONCESSION", "HOLD", "ACCEPT", "REJECT", "END"]
-
-    def __init__(self, ctx: NegotiationCtx):
-        self.ctx = ctx
-        self.user_offer: Optional[int] = None  # 本轮用户最新出价
-
-        self.machine = Machine(
-            model=self,
-            states=NegotiationModel.states,
-            initial="INIT",
-            ignore_invalid_triggers=True
-        )
-
-        # —— 转移表 —— #
-        self.machine.add_transition("start", "INIT", "ANCHOR", after="after_anchor")
-        self.machine.add_transition("user_quote", "WAIT_USER", "CONCESSION",
-                                    conditions=["can_concede"],
-                                    after="after_concession")
-        self.machine.add_transition("user_quote", "WAIT_USER", "HOLD",
-                                    conditions=["should_hold"],
-                                    after="after_hold")
-        self.machine.add_transition("user_quote", "WAIT_USER", "ACCEPT",
-                                    conditions=["user_accepts"],
-                                    after="after_accept")
-
-        # CONCESSION 结束后一般回 WAIT_USER（在 after_concession 内部决定）
-        self.machine.add_transition("confirm", "*", "ACCEPT", after="after_accept")
-        self.machine.add_transition("giveup",  "*", "REJECT", after="after_reject")
-        self.machine.add_transition("timeout", "*", "REJECT", after="after_reject")
-
-        # 终态
-        self.machine.add_transition("to_end", "ACCEPT", "END", after="after_end")
-        self.machine.add_transition("to_end", "REJECT", "END", after="after_end")
+        self.history = deque(self.history, maxlen=self.history_cap)
+
+    # —— 紧凑序列化（会话存储用）—— #
+    def to_dict(self) -> Dict[str, Any]:
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        data["history"] = list(self.history)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NegotiationCtx":
+        init_names = {f.name for f in fields(cls) if f.init}
+        ctx = cls(**{k: v for k, v in data.items() if k in init_names})
+        if "ai_offer" in data:
+            ctx.ai_offer = data["ai_offer"]
+        return ctx
+
+    @classmethod
+    def for_sku(cls, sku: str, **overrides: Any) -> "NegotiationCtx":
+        """按目录里的 SKU 配置新建 ctx（走 catalog 的 LRU，不扫表）；overrides 覆盖目录参数。SKU 不存在时抛 KeyError"""
+        entry = catalog.lookup(sku)
+        if entry is None:
+            raise KeyError(sku)
+        return cls(sku=sku, **{**entry.config, **overrides})
+
+STATES = ("INIT", "ANCHOR", "WAIT_USER", "CONCESSION", "HOLD", "ACCEPT", "REJECT", "END")
+
+class _NegotiationLogic:
+    """
+    议价策略本体：guards / 回调 / 对外接口 / 快照与合同。
+    状态推进由子类提供（transitions.Machine 或编译后的转移表），两者共享这里的全部逻辑。
+    """
+    __slots__ = ()
+    states = list(STATES)
 
     # ========== 条件（guards） ==========
     def user_accepts(self) -> bool:
@@ -131,23 +132,18 @@ class NegotiationModel:
         ai = self.ctx.ai_offer
         u  = self.user_offer
 
-        # 兜底：若没有用户数值出价，退回原 step_schedule 逻辑
+        # 兜底：若没有用户数值出价，按最小跳动让一步（step_schedule 已停用）
         if u is None:
-            step = self.ctx.step_schedule[min(self.ctx.k, len(self.ctx.step_schedule)-1)]
-            candidate = ai - step
+            candidate = ai - self.ctx.min_tick
         else:
             gap = ai - u
             if gap <= 0:
                 # 用户 >= AI，按接受处理（也可直接 self.confirm()）
                 self.after_accept()
                 return
-            # 从用户价往上推 2/3*gap（更靠近 AI）
-            raw_target = u + self.ctx.fraction_towards_user * gap
-            candidate  = _round_to_base(raw_target, self.ctx.round_base)
-
-            # 不得升价：若取整后未降价（≥ ai），强制降一个最小跳动
-            if candidate >= ai:
-                candidate = ai - self.ctx.min_tick
+            # 从用户价往上推 fraction*gap 并取整；取整后未降价则强制降一个最小跳动
+            # 按配置预编译的让价表查表（O(1)，与逐步计算一致，见 policy.py）
+            candidate = compile_policy(self.ctx).next_offer(ai, u)
 
         # —— 双护栏：不得低于停降/底线 —— #
         floor = max(self.ctx.stop_floor, self.ctx.bar_price)
@@ -203,6 +199,21 @@ class NegotiationModel:
         self.confirm()
         return self.snapshot()
 
+    # ========== 序列化：会话存储 / 跨进程恢复 ==========
+    def dump_state(self) -> Dict[str, Any]:
+        """紧凑的可 JSON 序列化状态（ctx + 当前状态 + 本轮出价）"""
+        return {"state": self.state, "user_offer": self.user_offer, "ctx": self.ctx.to_dict()}
+
+    @classmethod
+    def load_state(cls, data: Dict[str, Any]):
+        fsm = cls(NegotiationCtx.from_dict(data["ctx"]))
+        fsm._restore_state(data["state"])
+        fsm.user_offer = data.get("user_offer")
+        return fsm
+
+    def _restore_state(self, state: str) -> None:
+        self.state = state
+
     # ========== 输出：快照 / 合同（供语言层使用） ==========
     def snapshot(self) -> Dict[str, Any]:
         """
@@ -219,10 +230,11 @@ class NegotiationModel:
 
     def contract(self, value_reasons: Optional[List[str]] = None) -> Dict[str, Any]:
         """
-        语言层的“话术合同”（Language Contract）。
+        语言层的“话术合同”（Language Contract）。商品 / 人设 / 话术段取自目录骨架（catalog.skeleton）。
         """
+        entry = catalog.skeleton(self.ctx.sku)
         if value_reasons is None:
-            value_reasons = ["正品保障与售后", "做工与用料优于同级", "现货可加急（以政策为准）"]
+            value_reasons = list(entry.value_reasons)
 
         phase_map = {"INIT":"INIT","ANCHOR":"ANCHOR","WAIT_USER":"WAIT_USER",
                      "CONCESSION":"CONCESSION","HOLD":"HOLD","ACCEPT":"ACCEPT","REJECT":"REJECT","END":"END"}
@@ -247,14 +259,113 @@ class NegotiationModel:
                 "allowed": ["HOLD","ACCEPT"] if self.reached_stop() else ["CONCESSION","HOLD","ACCEPT"],
                 "forbidden": ["LOWER_PRICE"] if self.reached_stop() else []
             },
-            "product": {
-                "title": "演示商品",
-                "value_reasons": value_reasons
-            },
-            "persona": {"style": "analytic", "politeness": "medium", "token_budget": 256},
-            "nlg": {"tone": "professional", "length_hint": "2-4 sentences", "cta": "若确认可立即锁单并优先发货"},
+            "product": entry.product(value_reasons),
+            "persona": dict(entry.persona),
+            "nlg": dict(entry.nlg),
             "hard_guards": {
                 "must_not_price_below": max(self.ctx.stop_floor, self.ctx.bar_price),
                 "must_not_change_state": True
             }
         }
+
+
+class NegotiationModel(_NegotiationLogic):
+    """基于 transitions.Machine 的实现：每个会话构建一台状态机并注册全部转移。"""
+
+    def __init__(self, ctx: NegotiationCtx):
+        self.ctx = ctx
+        self.user_offer: Optional[int] = None  # 本轮用户最新出价
+
+        self.machine = Machine(
+            model=self,
+            states=STATES,
+            initial="INIT",
+            ignore_invalid_triggers=True
+        )
+
+        # —— 转移表 —— #
+        self.machine.add_transition("start", "INIT", "ANCHOR", after="after_anchor")
+        self.machine.add_transition("user_quote", "WAIT_USER", "CONCESSION",
+                                    conditions=["can_concede"],
+                                    after="after_concession")
+        self.machine.add_transition("user_quote", "WAIT_USER", "HOLD",
+                                    conditions=["should_hold"],
+                                    after="after_hold")
+        self.machine.add_transition("user_quote", "WAIT_USER", "ACCEPT",
+                                    conditions=["user_accepts"],
+                                    after="after_accept")
+
+        # CONCESSION 结束后一般回 WAIT_USER（在 after_concession 内部决定）
+        self.machine.add_transition("confirm", "*", "ACCEPT", after="after_accept")
+        self.machine.add_transition("giveup",  "*", "REJECT", after="after_reject")
+        self.machine.add_transition("timeout", "*", "REJECT", after="after_reject")
+
+        # 终态
+        self.machine.add_transition("to_end", "ACCEPT", "END", after="after_end")
+        self.machine.add_transition("to_end", "REJECT", "END", after="after_end")
+
+    def _restore_state(self, state: str) -> None:
+        self.machine.set_state(state)
+
+
+# ====== 编译后的转移表（进程内共享、只读）======
+# trigger -> ((来源状态集合 或 None 表示 "*", 目标状态, 条件名元组, after 回调名), ...)
+# 同一 trigger 的多条转移按顺序尝试，第一条条件全部满足的生效（与 transitions 一致）
+_TRANSITION_SPECS = (
+    ("start",      ("INIT",),              "ANCHOR",     (),                "after_anchor"),
+    ("user_quote", ("WAIT_USER",),         "CONCESSION", ("can_concede",),  "after_concession"),
+    ("user_quote", ("WAIT_USER",),         "HOLD",       ("should_hold",),  "after_hold"),
+    ("user_quote", ("WAIT_USER",),         "ACCEPT",     ("user_accepts",), "after_accept"),
+    ("confirm",    None,                   "ACCEPT",     (),                "after_accept"),
+    ("giveup",     None,                   "REJECT",     (),                "after_reject"),
+    ("timeout",    None,                   "REJECT",     (),                "after_reject"),
+    ("to_end",     ("ACCEPT", "REJECT"),   "END",        (),                "after_end"),
+) + tuple(
+    # transitions 的 auto_transitions：任意状态 → to_<STATE>()，无条件无回调
+    (f"to_{st}", None, st, (), None) for st in STATES
+)
+
+def _compile_transitions(specs):
+    table: Dict[Any, tuple] = {}
+    for trigger, sources, dest, conditions, after in specs:
+        for src in (sources or STATES):
+            table.setdefault((src, trigger), []).append((dest, conditions, after))
+    return MappingProxyType({k: tuple(v) for k, v in table.items()})
+
+TRANSITION_TABLE = _compile_transitions(_TRANSITION_SPECS)
+TRIGGERS = tuple(dict.fromkeys(spec[0] for spec in _TRANSITION_SPECS))
+
+
+class CompiledNegotiationModel(_NegotiationLogic):
+    """
+    表驱动的轻量实现：所有会话共享 TRANSITION_TABLE，会话对象只有三个槽位。
+    与 NegotiationModel 行为一致（快照/合同/触发器/非法触发器静默忽略）。
+    """
+    __slots__ = ("ctx", "user_offer", "state")
+
+    def __init__(self, ctx: NegotiationCtx):
+        self.ctx = ctx
+        self.user_offer: Optional[int] = None  # 本轮用户最新出价
+        self.state = "INIT"
+
+    def trigger(self, name: str) -> bool:
+        candidates = TRANSITION_TABLE.get((self.state, name))
+        if candidates is None:
+            return False                        # ignore_invalid_triggers=True
+        for dest, conditions, after in candidates:
+            if all(getattr(self, cond)() for cond in conditions):
+                self.state = dest
+                if after is not None:
+                    getattr(self, after)()
+                return True
+        return False
+
+
+def _make_trigger(name: str):
+    def fire(self) -> bool:
+        return self.trigger(name)
+    fire.__name__ = name
+    return fire
+
+for _name in TRIGGERS:
+    setattr(CompiledNegotiationModel, _name, _make_trigger(_name))
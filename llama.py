@@ -1,11 +1,46 @@
 # nlg_from_core_view.py
+import hashlib
 import json
-import re
-import requests
-from typing import Dict, Any, List, Optional
+import os
+import time
+from typing import AsyncIterator, Callable, Dict, Any, Iterator, List, Optional
 
-OLLAMA_BASE = "http://localhost:11434"
-OLLAMA_MODEL = "llama3.1"
+from cache import VariantCache
+from ollama_client import message_content
+from prompt_compiler import NLG_FIELDS, CompiledPrompt, compile_nlg, render_fields
+from retrieval import select_examples
+from price_guard import guard_core_view, guard_prices, has_numeral, holdback_index
+from templates import BUSY_REPLY, is_deterministic, render_template, template_stats
+from resilience import StageGuard, Unavailable, register as register_guard
+from routing import Route, route
+import tracing
+
+# 模型 / options / 端点按阶段配置（见 routing.py：OLLAMA_ROUTES、NLG_MODEL、OLLAMA_ENDPOINTS）
+NLG_ROUTE = route("nlg")
+OLLAMA_MODEL = NLG_ROUTE.model
+
+# 确定性阶段（ACCEPT；HOLD 且不可再谈）直接用模板话术，不调用 LLM；设为 False 全部走 LLM
+TEMPLATE_NLG = True
+
+tracing.register_gauges("nlg_template", template_stats)
+
+# 尾延迟保护：非流式按整次调用、流式按首 token 延迟计 SLO；LLM 不可用时降级为模板话术
+NLG_SLO_MS = float(os.getenv("NLG_SLO_MS", "2000"))
+NLG_GUARD = register_guard(StageGuard("nlg", NLG_SLO_MS))
+
+# 少样本示例：按用户原话从 dialogues.json / prompt.txt 检索 top-k 放进话术提示（0 关闭，默认关闭）
+NLG_FEWSHOT_K = int(os.getenv("NLG_FEWSHOT_K", "0"))
+NLG_FEWSHOT_BUDGET = int(os.getenv("NLG_FEWSHOT_BUDGET", "120"))     # 示例部分的 token 上限
+
+# 话术缓存（可选，NLG_CACHE=1 开启）：键 = core_view 中提示实际用到的字段 + 价值点 + CTA 的规范化哈希，
+# 不含用户原话（措辞不同、状态相同的轮次共用）；每个键先收集 NLG_CACHE_VARIANTS 种说法再轮换返回，
+# 入库的是已过价格护栏的文本，降级兜底不入库；非流式的相同请求并发时只生成一次
+NLG_CACHE_ENABLED = os.getenv("NLG_CACHE", "0") == "1"
+NLG_CACHE_SIZE = int(os.getenv("NLG_CACHE_SIZE", "2048"))
+NLG_CACHE_TTL = float(os.getenv("NLG_CACHE_TTL", "3600"))      # 秒
+NLG_CACHE_VARIANTS = int(os.getenv("NLG_CACHE_VARIANTS", "3"))
+NLG_CACHE = VariantCache(NLG_CACHE_SIZE, NLG_CACHE_TTL, NLG_CACHE_VARIANTS, name="nlg")
+tracing.register_gauges("nlg_cache", NLG_CACHE.stats)
 
 SYSTEM_PROMPT = """
 你是一名电商客服的“语言层”助手，只能基于我提供的 core_view（结构化状态）生成中文回复，且必须遵守：
@@ -18,48 +53,158 @@ SYSTEM_PROMPT = """
 不要出现其他价格相关数字或历史报价，直接给出回复，不要掺入杂质。
 """.strip()
 
+# 用户侧提示的固定开头：放在最前面，与 SYSTEM_PROMPT 一起构成跨轮不变的前缀（服务端 KV 缓存可复用）
+USER_PROMPT_HEAD = """请根据以下信息，直接输出给用户看的中文话术（少于2句），
+以“确认成交与下一步安排”为导向；可点到产品价值，但不要新增价格或承诺。"""
+
+# 提示词版本：改动 SYSTEM_PROMPT / USER_PROMPT_HEAD 后话术缓存自动失效
+PROMPT_VERSION = hashlib.sha1((SYSTEM_PROMPT + USER_PROMPT_HEAD).encode("utf-8")).hexdigest()[:8]
+
+def nlg_cache_key(
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = None,
+    model: str = OLLAMA_MODEL,
+) -> str:
+    """话术缓存键：只取提示里渲染的 core_view 字段（固定顺序、紧凑 JSON），再加价值点与 CTA"""
+    canonical = json.dumps([model, PROMPT_VERSION, core_view.get("token_budget"),
+                            render_fields(core_view, NLG_FIELDS), list(value_reasons or []), cta or ""],
+                           ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+def cached_reply(key: str, trace: Optional[tracing.TurnTrace] = None) -> Optional[str]:
+    """话术缓存查询：该键已集齐时轮换返回一条，否则 None"""
+    with tracing.span("nlg_cache", trace=trace) as sp:
+        text = NLG_CACHE.pick(key)
+        sp.set(hit=text is not None)
+        return text
+
+def compile_user_prompt(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = None,
+) -> CompiledPrompt:
+    """
+    把上一句+合同编译成给 LLM 的用户侧提示（只含话术需要的字段，受 persona.token_budget 约束）。
+    按变化频率排序：固定说明 → 会话内不变的价值点/CTA → 每轮变化的状态 → 用户原话，
+    让相邻两轮的提示共享尽可能长的前缀。
+    """
+    examples = None
+    if NLG_FEWSHOT_K > 0:
+        examples = [ex.text for ex in select_examples(last_user_text, NLG_FEWSHOT_K, NLG_FEWSHOT_BUDGET)]
+    return compile_nlg(USER_PROMPT_HEAD, last_user_text, core_view, value_reasons, cta, examples=examples)
+
 def make_user_prompt(
     last_user_text: str,
     core_view: Dict[str, Any],
     value_reasons: Optional[List[str]] = None,
     cta: Optional[str] = None,
 ) -> str:
-    """把上一句+合同拼成给 LLM 的用户侧提示"""
-    extra = []
-    if value_reasons:
-        extra.append(f"价值点（至多使用2个）：{'；'.join(value_reasons[:2])}")
-    if cta:
-        extra.append(f"结尾CTA：{cta}")
-    extra_block = ("\n" + "\n".join(extra)) if extra else ""
-    return f"""
-# 上一句用户输入
-「{last_user_text}」
-
-# core_view（只读约束）
-{json.dumps(core_view, ensure_ascii=False, indent=2)}
-
-请根据以上信息，直接输出给用户看的中文话术（少于2句），
-以“确认成交与下一步安排”为导向；可点到产品价值，但不要新增价格或承诺。{extra_block}
-""".strip()
+    return compile_user_prompt(last_user_text, core_view, value_reasons, cta).text
 
-def call_ollama_chat(system_prompt: str, user_prompt: str,
-                     base_url: str = OLLAMA_BASE, model: str = OLLAMA_MODEL) -> str:
-    url = f"{base_url.rstrip('/')}/api/chat"
-    messages = [
+def _chat_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-    resp = requests.post(url, json={"model": model, "messages": messages, "stream": False}, timeout=120)
-    resp.raise_for_status()
-    data = resp.json()
-    return (data.get("message", {}) or {}).get("content", "").strip()
+
+def call_ollama_chat(system_prompt: str, user_prompt: str, route: Route = NLG_ROUTE,
+                     timeout: Optional[float] = None) -> str:
+    messages = _chat_messages(system_prompt, user_prompt)
+    data = route.chat(messages, timeout=timeout)
+    content = message_content(data)
+    tracing.record_ollama(data, messages, content)
+    return content
+
+async def acall_ollama_chat(system_prompt: str, user_prompt: str, route: Route = NLG_ROUTE,
+                            timeout: Optional[float] = None) -> str:
+    messages = _chat_messages(system_prompt, user_prompt)
+    data = await route.achat(messages, timeout=timeout)
+    content = message_content(data)
+    tracing.record_ollama(data, messages, content)
+    return content
+
+def warm_up(route: Route = NLG_ROUTE) -> Dict[str, Any]:
+    """启动时在话术路由的每个端点上预加载模型并预热 SYSTEM_PROMPT 前缀"""
+    return route.warm_up(SYSTEM_PROMPT)
 
 def enforce_floor(text: str, lowest_price: int) -> str:
-    """把文本中低于红线的数字替换为红线，避免穿底"""
-    def repl(m):
-        n = int(m.group(0))
-        return str(max(n, lowest_price))
-    return re.sub(r"\d{2,6}", repl, text)
+    """把文本中低于红线的价格替换为红线，避免穿底"""
+    return guard_prices(text, floor=lowest_price)[0]
+
+def apply_price_guard(text: str, core_view: Dict[str, Any],
+                      changes: Optional[List[Dict[str, Any]]] = None) -> str:
+    """价格红线 + 只允许出现 offer_to_show（流式与非流式共用）；changes 传入列表时追加改动明细"""
+    safe_text, changed = guard_core_view(text, core_view)
+    if changes is not None:
+        changes.extend(changed)
+    return safe_text
+
+class StreamPriceGuard:
+    """
+    流式价格护栏：对逐 token 到达的文本增量执行 apply_price_guard。
+    末尾未结束的数字记号（阿拉伯或中文，如 "4" + "05"、"四百" + "五十"）以及还在等单位/量词的数字先扣住，
+    判定完整后才放行，保证低于红线的价格不会先显示出来；拼接结果与整段 apply_price_guard 一致。
+    """
+
+    def __init__(self, core_view: Dict[str, Any]):
+        self.core_view = core_view
+        self._pending = ""
+        self._emitted = 0
+        self.changes: List[Dict[str, Any]] = []
+
+    def _guard(self, text: str) -> str:
+        if not has_numeral(text):          # 绝大多数分片不含数字，跳过扫描
+            self._emitted += len(text)
+            return text
+        changed: List[Dict[str, Any]] = []
+        safe = apply_price_guard(text, self.core_view, changed)
+        for c in changed:                   # 偏移换算为整段原文中的位置
+            c["start"] += self._emitted
+            c["end"] += self._emitted
+        self.changes.extend(changed)
+        self._emitted += len(text)
+        return safe
+
+    def feed(self, delta: str) -> str:
+        buf = self._pending + delta
+        cut = holdback_index(buf)
+        self._pending = buf[cut:]
+        return self._guard(buf[:cut])
+
+    def flush(self) -> str:
+        tail, self._pending = self._pending, ""
+        return self._guard(tail)
+
+def template_reply(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    trace: Optional[tracing.TurnTrace] = None,
+) -> Optional[str]:
+    """模板快路径：命中时返回已过价格护栏的话术，否则 None（回退 LLM）"""
+    if not TEMPLATE_NLG or not is_deterministic(core_view):
+        return None
+    with tracing.span("nlg_template", trace=trace) as sp:
+        text = render_template(last_user_text, core_view, value_reasons, cta)
+        sp.set(hit=text is not None)
+        return apply_price_guard(text, core_view) if text is not None else None
+
+def degraded_reply(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    reason: str = "",
+    trace: Optional[tracing.TurnTrace] = None,
+) -> str:
+    """LLM 不可用（熔断/超时/出错）时的模板兜底：任何阶段都给出带 offer 的话术"""
+    NLG_GUARD.note_degraded()
+    with tracing.span("nlg_degraded", trace=trace, reason=reason):
+        text = render_template(last_user_text, core_view, value_reasons, cta, force=True)
+        return apply_price_guard(text, core_view) if text is not None else BUSY_REPLY
 
 def nlg_from_core_view(
     last_user_text: str,
@@ -67,27 +212,232 @@ def nlg_from_core_view(
     value_reasons: Optional[List[str]] = None,
     # cta: Optional[str] = "若确认我可立即为你锁单并优先发货",
     cta: Optional[str] = "",
-    base_url: str = OLLAMA_BASE,
-    model: str = OLLAMA_MODEL,
+    route: Route = NLG_ROUTE,
 ) -> str:
     """主入口：返回给用户看的话术（已做价格红线校验）"""
-    user_prompt = make_user_prompt(last_user_text, core_view, value_reasons, cta)
-    raw = call_ollama_chat(SYSTEM_PROMPT, user_prompt, base_url, model)
-
-    # 价格红线兜底
-    floor = int(core_view.get("lowest_price", 0))
-    safe_text = enforce_floor(raw, floor)
-
-    # 只允许出现 offer_to_show 这一个价格（尽量减少其他数字）
-    offer = str(core_view.get("offer_to_show", ""))
-    if offer:
-        # 可选进一步限制：若出现多个不同数字，强制把非 offer 的数字替换为 offer
-        nums = set(re.findall(r"\d{2,6}", safe_text))
-        for n in nums:
-            if n != offer:
-                safe_text = re.sub(rf"\b{n}\b", offer, safe_text)
+    text = template_reply(last_user_text, core_view, value_reasons, cta)
+    if text is not None:
+        return text
 
-    return safe_text
+    def generate() -> str:
+        prompt = compile_user_prompt(last_user_text, core_view, value_reasons, cta)
+        with tracing.span("nlg", **prompt.attrs()):
+            raw = NLG_GUARD.call(lambda timeout: call_ollama_chat(SYSTEM_PROMPT, prompt.text, route, timeout))
+        with tracing.span("price_guard") as sp:
+            changes: List[Dict[str, Any]] = []
+            safe = apply_price_guard(raw, core_view, changes)
+            sp.set(price_changes=len(changes))
+            return safe
+
+    try:
+        if not NLG_CACHE_ENABLED:
+            return generate()
+        key = nlg_cache_key(core_view, value_reasons, cta, route.model)
+        return cached_reply(key) or NLG_CACHE.get_or_compute(key, generate)
+    except Unavailable as e:
+        return degraded_reply(last_user_text, core_view, value_reasons, cta, e.reason)
+
+async def anlg_from_core_view(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    route: Route = NLG_ROUTE,
+) -> str:
+    """nlg_from_core_view 的 asyncio 版本"""
+    text = template_reply(last_user_text, core_view, value_reasons, cta)
+    if text is not None:
+        return text
+
+    async def generate() -> str:
+        prompt = compile_user_prompt(last_user_text, core_view, value_reasons, cta)
+        with tracing.span("nlg", **prompt.attrs()):
+            raw = await NLG_GUARD.acall(
+                lambda timeout: acall_ollama_chat(SYSTEM_PROMPT, prompt.text, route, timeout))
+        with tracing.span("price_guard") as sp:
+            changes: List[Dict[str, Any]] = []
+            safe = apply_price_guard(raw, core_view, changes)
+            sp.set(price_changes=len(changes))
+            return safe
+
+    try:
+        if not NLG_CACHE_ENABLED:
+            return await generate()
+        key = nlg_cache_key(core_view, value_reasons, cta, route.model)
+        return cached_reply(key) or await NLG_CACHE.aget_or_compute(key, generate)
+    except Unavailable as e:
+        return degraded_reply(last_user_text, core_view, value_reasons, cta, e.reason)
+
+def stream_ollama_chat(system_prompt: str, user_prompt: str, route: Route = NLG_ROUTE,
+                       on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       timeout: Optional[float] = None) -> Iterator[str]:
+    """逐个产出模型回复的文本增量；on_done 收到最后一片（含 eval_count 等统计）"""
+    for chunk in route.chat_stream(_chat_messages(system_prompt, user_prompt), timeout=timeout):
+        delta = (chunk.get("message", {}) or {}).get("content", "")
+        if delta:
+            yield delta
+        if chunk.get("done") and on_done is not None:
+            on_done(chunk)
+
+async def astream_ollama_chat(system_prompt: str, user_prompt: str, route: Route = NLG_ROUTE,
+                              on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                              timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """stream_ollama_chat 的 asyncio 版本"""
+    async for chunk in route.achat_stream(_chat_messages(system_prompt, user_prompt), timeout=timeout):
+        delta = (chunk.get("message", {}) or {}).get("content", "")
+        if delta:
+            yield delta
+        if chunk.get("done") and on_done is not None:
+            on_done(chunk)
+
+class _GuardedStream:
+    """
+    流式话术的护栏与计时（同步/异步流共用）：去掉首部空白、记录 ttft 与护栏耗时；
+    settle() 按首个增量的到达时间（首 token 延迟）给 NLG_GUARD 记账
+    """
+
+    def __init__(self, core_view: Dict[str, Any], sp: tracing.Span):
+        self.guard = StreamPriceGuard(core_view)
+        self.sp = sp
+        self.started = False
+        self.guard_s = 0.0
+        self.t0 = time.perf_counter()
+        self.first_s: Optional[float] = None
+
+    def feed(self, delta: str) -> str:
+        t0 = time.perf_counter()
+        if self.first_s is None:
+            self.first_s = t0 - self.t0
+        safe = self.guard.feed(delta)
+        self.guard_s += time.perf_counter() - t0
+        if not self.started:
+            safe = safe.lstrip()
+            self.started = bool(safe)
+            if self.started:
+                self.sp.set(ttft_ms=round((time.perf_counter() - self.sp.start) * 1000, 2))
+        return safe
+
+    def settle(self, error: Optional[Exception]) -> None:
+        elapsed = time.perf_counter() - self.t0
+        if error is None:
+            NLG_GUARD.record_success(self.first_s if self.first_s is not None else elapsed)
+        else:
+            NLG_GUARD.record_failure(elapsed)
+            self.sp.set(error=type(error).__name__)
+
+    def close(self) -> str:
+        tail = self.guard.flush().rstrip()
+        self.sp.set(guard_ms=round(self.guard_s * 1000, 3), price_changes=len(self.guard.changes))
+        return tail
+
+def nlg_stream_from_core_view(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    route: Route = NLG_ROUTE,
+    trace: Optional[tracing.TurnTrace] = None,
+    stage: str = "nlg",
+) -> Iterator[str]:
+    """
+    流式入口：逐段产出已过价格护栏的文本增量（拼接结果与 nlg_from_core_view 一致）
+    trace：跨 yield 显式传入本轮追踪（生成器恢复时 contextvars 不可靠）
+    stage：span 名（推测执行用 "nlg_speculative"，不混入正式话术的延迟统计）
+    熔断打开、或首段输出前就失败/超时时，改为产出模板兜底话术；中途失败则保留已输出部分
+    话术缓存命中时整段产出；未命中时边生成边输出，完整结束后入库（流式不合并并发请求：跟随者的首 token
+    会被推迟到领头者生成结束）
+    """
+    text = template_reply(last_user_text, core_view, value_reasons, cta, trace)
+    if text is not None:
+        yield text
+        return
+    key = nlg_cache_key(core_view, value_reasons, cta, route.model) if NLG_CACHE_ENABLED else None
+    if key is not None:
+        text = cached_reply(key, trace)
+        if text is not None:
+            yield text
+            return
+    if not NLG_GUARD.allow():
+        yield degraded_reply(last_user_text, core_view, value_reasons, cta, "breaker_open", trace)
+        return
+    prompt = compile_user_prompt(last_user_text, core_view, value_reasons, cta)
+    user_prompt = prompt.text
+    timeout = NLG_GUARD.timeout()
+    error: Optional[Exception] = None
+    with tracing.span(stage, trace=trace, stream=True, timeout_ms=round(timeout * 1000), **prompt.attrs()) as sp:
+        sp.set(prompt_chars=len(SYSTEM_PROMPT) + len(user_prompt))
+        stream = _GuardedStream(core_view, sp)
+        parts: List[str] = []
+        on_done = lambda data: tracing.record_ollama(data, target=sp)
+        try:
+            for delta in stream_ollama_chat(SYSTEM_PROMPT, user_prompt, route, on_done, timeout):
+                safe = stream.feed(delta)
+                if safe:
+                    parts.append(safe)
+                    yield safe
+        except Exception as e:
+            error = e
+        stream.settle(error)
+        tail = stream.close()
+    tracing.observe("price_guard", stream.guard_s)
+    if error is not None and not stream.started:
+        yield degraded_reply(last_user_text, core_view, value_reasons, cta, type(error).__name__, trace)
+        return
+    if tail:
+        yield tail
+    if key is not None and error is None:
+        NLG_CACHE.add(key, "".join(parts) + tail)
+
+async def anlg_stream_from_core_view(
+    last_user_text: str,
+    core_view: Dict[str, Any],
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    route: Route = NLG_ROUTE,
+    trace: Optional[tracing.TurnTrace] = None,
+    stage: str = "nlg",
+) -> AsyncIterator[str]:
+    """nlg_stream_from_core_view 的 asyncio 版本（逐 token 不阻塞事件循环）"""
+    text = template_reply(last_user_text, core_view, value_reasons, cta, trace)
+    if text is not None:
+        yield text
+        return
+    key = nlg_cache_key(core_view, value_reasons, cta, route.model) if NLG_CACHE_ENABLED else None
+    if key is not None:
+        text = cached_reply(key, trace)
+        if text is not None:
+            yield text
+            return
+    if not NLG_GUARD.allow():
+        yield degraded_reply(last_user_text, core_view, value_reasons, cta, "breaker_open", trace)
+        return
+    prompt = compile_user_prompt(last_user_text, core_view, value_reasons, cta)
+    user_prompt = prompt.text
+    timeout = NLG_GUARD.timeout()
+    error: Optional[Exception] = None
+    with tracing.span(stage, trace=trace, stream=True, timeout_ms=round(timeout * 1000), **prompt.attrs()) as sp:
+        sp.set(prompt_chars=len(SYSTEM_PROMPT) + len(user_prompt))
+        stream = _GuardedStream(core_view, sp)
+        parts: List[str] = []
+        on_done = lambda data: tracing.record_ollama(data, target=sp)
+        try:
+            async for delta in astream_ollama_chat(SYSTEM_PROMPT, user_prompt, route, on_done, timeout):
+                safe = stream.feed(delta)
+                if safe:
+                    parts.append(safe)
+                    yield safe
+        except Exception as e:
+            error = e
+        stream.settle(error)
+        tail = stream.close()
+    tracing.observe("price_guard", stream.guard_s)
+    if error is not None and not stream.started:
+        yield degraded_reply(last_user_text, core_view, value_reasons, cta, type(error).__name__, trace)
+        return
+    if tail:
+        yield tail
+    if key is not None and error is None:
+        NLG_CACHE.add(key, "".join(parts) + tail)
 
 # ---------------- 使用示例 ----------------
 if __name__ == "__main__":
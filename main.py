@@ -1,13 +1,14 @@
 # main.py
-from fsm import NegotiationCtx, NegotiationModel
-from bridge import run_fsm_turn
+from fsm import NegotiationCtx, CompiledNegotiationModel
+from bridge import run_fsm_turn, EXTRACT_CACHE
+from fastpath import fastpath_stats
 import json
 from llama import *
 
 
 if __name__ == "__main__":
     ctx = NegotiationCtx(list_price=500, bar_price=400, stop_floor=420, max_concessions=5)
-    fsm = NegotiationModel(ctx)
+    fsm = CompiledNegotiationModel(ctx)
 
     while True:
         user_text = input("用户：").strip()
@@ -21,6 +22,8 @@ if __name__ == "__main__":
 
         print("\n[LLM抽取 user_summary]")
         print(out["user_summary"])
+        print("规则快路径：", fastpath_stats())
+        print("抽取缓存：", EXTRACT_CACHE.stats())
 
         print("\n[FSM snapshot]")
         print(out["fsm_snapshot"])
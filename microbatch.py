@@ -0,0 +1,136 @@
+# microbatch.py
+# 微批处理：把同一时刻到达的小请求攒成一批（最多 max_batch 条，最多等 max_wait_ms），一次调用处理，
+# 再把结果按顺序分发回各个调用方。同步调用方 call()，asyncio 调用方 acall()，共用一个后台收集线程。
+#   - 批处理函数返回与输入等长的结果列表；某项为 FALLBACK 或整批抛异常时，对应项逐条回退到 single()
+#   - 只有 1 条时直接走 single()，不构造批量提示
+#   - 多个批次可同时在途（workers），收集下一批不必等上一批的 LLM 返回
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import queue
+import threading
+import time
+
+import tracing
+
+FALLBACK = object()        # 批处理结果中的占位：该项需要逐条回退
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], single_fn: Callable[[Any], Any],
+                 max_batch: int = 8, max_wait_ms: float = 10.0, workers: int = 4, name: str = "microbatch"):
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.batches = 0
+        self.items = 0
+        self.singles = 0            # 只攒到 1 条，直接逐条处理
+        self.malformed = 0          # 整批输出无法解析
+        self.fallbacks = 0          # 回退到逐条处理的条数
+
+        self._thread = threading.Thread(target=self._collect, name=f"{name}-collector", daemon=True)
+        self._thread.start()
+
+    # ========== 调用方 ==========
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        if self._closed:
+            fut.set_exception(RuntimeError(f"{self.name} is closed"))
+        else:
+            self._queue.put((item, fut))
+        return fut
+
+    def call(self, item: Any, timeout: Optional[float] = None) -> Any:
+        return self.submit(item).result(timeout)
+
+    async def acall(self, item: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(item))
+
+    def close(self) -> None:
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    # ========== 收集与执行 ==========
+    def _collect(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)       # 处理完本批后再退出
+                    break
+                batch.append(nxt)
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: List[Tuple[Any, Future]]) -> None:
+        items = [item for item, _ in batch]
+        t0 = time.perf_counter()
+        if len(batch) == 1:
+            with self._lock:
+                self.singles += 1
+                self.items += 1
+            self._resolve(batch[0], lambda: self.single_fn(items[0]))
+            return
+
+        try:
+            results = list(self.batch_fn(items))
+            if len(results) != len(items):
+                raise ValueError(f"batch returned {len(results)} results for {len(items)} items")
+        except Exception:
+            results = [FALLBACK] * len(items)
+            with self._lock:
+                self.malformed += 1
+        tracing.observe(f"{self.name}_batch", time.perf_counter() - t0)
+
+        n_fallback = sum(1 for r in results if r is FALLBACK)
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+            self.fallbacks += n_fallback
+
+        for entry, result in zip(batch, results):
+            if result is FALLBACK:
+                # 逐条回退并行执行，不阻塞本 worker
+                self._pool.submit(self._resolve, entry, lambda item=entry[0]: self.single_fn(item))
+            else:
+                entry[1].set_result(result)
+
+    @staticmethod
+    def _resolve(entry: Tuple[Any, Future], fn: Callable[[], Any]) -> None:
+        _, fut = entry
+        try:
+            fut.set_result(fn())
+        except Exception as e:
+            fut.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch": round((self.items - self.singles) / self.batches, 2) if self.batches else 0.0,
+                "singles": self.singles,
+                "malformed": self.malformed,
+                "fallbacks": self.fallbacks,
+                "queued": self._queue.qsize(),
+            }
@@ -0,0 +1,98 @@
+# numerals.py
+# 价格数字的识别与解析：阿拉伯数字、中文数字（四百五十 / 四百五 / 两千）、混写（4百5）
+# 供规则抽取（fastpath.py）与价格护栏（price_guard.py）使用
+
+from typing import Iterator, Optional, Tuple
+import re
+
+CN_DIGITS = {
+    "零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+    "五": 5, "六": 6, "七": 7, "八": 8, "九": 9,
+    "壹": 1, "贰": 2, "叁": 3, "肆": 4, "伍": 5, "陆": 6, "柒": 7, "捌": 8, "玖": 9,
+}
+CN_UNITS = {"十": 10, "拾": 10, "百": 100, "佰": 100, "千": 1000, "仟": 1000}
+CN_WAN = {"万": 10000, "萬": 10000}
+
+DIGIT_CHARS = "0-9" + "".join(CN_DIGITS)
+UNIT_CHARS = "".join(CN_UNITS) + "".join(CN_WAN)
+
+# 一个“数字记号”：阿拉伯数字（可带千分位逗号）或中文/混写数字，后面可跟 元/块/块钱
+NUMBER_RE = re.compile(
+    rf"(?P<num>\d{{1,3}}(?:,\d{{3}})+|[{DIGIT_CHARS}{UNIT_CHARS}]+)"
+    r"(?P<unit>块钱|元|块|rmb|RMB)?"
+)
+
+
+def _parse_section(s: str) -> Optional[int]:
+    """解析不含“万”的一段：四百五十 / 四百五 / 4百5 / 十五 / 450 / 四五零"""
+    if not s:
+        return 0
+    if all(c.isdigit() or c in CN_DIGITS for c in s):
+        # 纯数字序列：450 / 四五零
+        return int("".join(str(CN_DIGITS[c]) if c in CN_DIGITS else c for c in s))
+
+    total, digit, last_unit = 0, None, None
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c.isdigit() or c in CN_DIGITS:
+            # 允许混写里的多位阿拉伯数字：“12百”
+            j = i
+            while j < len(s) and s[j].isdigit():
+                j += 1
+            if j > i:
+                digit = int(s[i:j])
+                i = j
+                continue
+            digit = CN_DIGITS[c]
+        elif c in CN_UNITS:
+            unit = CN_UNITS[c]
+            if digit is None:
+                if unit != 10 or total:
+                    return None         # “百”“千”前必须有数字；“十”开头可省略“一”
+                digit = 1
+            if last_unit is not None and unit >= last_unit:
+                return None
+            total += digit * unit
+            digit, last_unit = None, unit
+        else:
+            return None
+        i += 1
+
+    if digit is not None:
+        # 口语省略：四百五 = 450、两千二 = 2200；“三百零五”末位前是“零”，不放大
+        if last_unit is not None and last_unit >= 100 and s[-2] in CN_UNITS:
+            digit *= last_unit // 10
+        total += digit
+    return total
+
+
+def parse_number(s: str) -> Optional[int]:
+    """把一个数字记号解析为整数；无法解析返回 None。"""
+    s = s.replace(",", "").strip()
+    if not s:
+        return None
+    if s.isdigit():
+        return int(s)
+    for ch, mult in CN_WAN.items():
+        if ch in s:
+            head, _, tail = s.partition(ch)
+            hi = _parse_section(head) if head else None
+            lo = _parse_section(tail)
+            if not hi or lo is None:
+                return None
+            if tail and len(tail) == 1 and tail in CN_DIGITS:
+                lo *= 1000                  # 一万二 = 12000
+            return hi * mult + lo
+    return _parse_section(s)
+
+
+def iter_numbers(text: str) -> Iterator[Tuple[int, int, int, bool, bool]]:
+    """逐个产出 (start, end, value, has_unit, is_chinese)；无法解析的记号跳过。"""
+    for m in NUMBER_RE.finditer(text):
+        num = m.group("num")
+        value = parse_number(num)
+        if value is None:
+            continue
+        is_chinese = any(not c.isdigit() and c != "," for c in num)
+        yield m.start(), m.end(), value, m.group("unit") is not None, is_chinese
@@ -0,0 +1,202 @@
+# ollama_client.py
+# 共享的 Ollama HTTP 客户端：连接池 + keep-alive + 分离的连接/读取超时 + 退避重试
+# 同步接口基于 requests.Session；异步接口基于 httpx.AsyncClient（gradio 已依赖 httpx）
+# bridge.py（抽取）与 llama.py（话术）经 routing.py 的阶段路由调用，同一 URL 的端点通过 get_client() 复用同一个客户端
+# 每次请求都带 keep_alive，避免两轮之间模型被卸载；warm_up() 在启动时预加载模型并预热静态前缀
+# 各接口可按次传入 timeout（读超时，秒），供 resilience 的自适应超时使用；缺省为 READ_TIMEOUT
+
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+OLLAMA_BASE = "http://localhost:11434"
+
+# ====== 连接与重试参数 ======
+CONNECT_TIMEOUT = 3.05      # 建连超时（秒）：本地服务，建不上就尽快重试
+READ_TIMEOUT = 120.0        # 读取超时（秒）：覆盖最长的一次生成
+MAX_RETRIES = 2             # 仅对建连失败 / 502/503/504 重试；读超时不重试，避免重复生成
+BACKOFF_FACTOR = 0.3        # 退避：0.3s, 0.6s, 1.2s ...
+POOL_MAXSIZE = 32           # 每个 host 的 keep-alive 连接数上限
+RETRY_STATUS = (502, 503, 504)
+# 模型常驻时长（Ollama 默认 5m，空闲稍久就会卸载，下一轮要重新加载）；负值（如 "-1m"）表示永不卸载
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+class OllamaClient:
+    """对单个 Ollama 服务的 /api/chat 封装，线程安全，可被多个会话共享。"""
+
+    def __init__(self,
+                 base_url: str = OLLAMA_BASE,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 max_retries: int = MAX_RETRIES,
+                 backoff_factor: float = BACKOFF_FACTOR,
+                 pool_maxsize: int = POOL_MAXSIZE,
+                 keep_alive: str = KEEP_ALIVE):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+
+        # —— 同步：requests.Session + 连接池 —— #
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset({"GET", "POST"}),  # /api/chat 无副作用，可安全重放
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # —— 异步：httpx.AsyncClient 按事件循环惰性创建 —— #
+        self._aclient = None
+        self._aclient_loop = None
+
+    def _payload(self, model: str, messages: List[Dict[str, str]], stream: bool,
+                 extra: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {"model": model, "messages": messages, "stream": stream}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        payload.update(extra)
+        return payload
+
+    # ========== 同步接口 ==========
+    def _timeouts(self, timeout: Optional[float]):
+        return (self.connect_timeout, timeout or self.read_timeout)
+
+    def chat(self, model: str, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+             **extra: Any) -> Dict[str, Any]:
+        """POST /api/chat（非流式），返回完整响应体。"""
+        payload = self._payload(model, messages, False, extra)
+        resp = self.session.post(
+            f"{self.base_url}/api/chat",
+            json=payload,
+            timeout=self._timeouts(timeout),
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def chat_stream(self, model: str, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                    **extra: Any) -> Iterator[Dict[str, Any]]:
+        """POST /api/chat（流式）：逐个产出 NDJSON 分片，最后一片 done=True 带统计字段；timeout 约束每个分片的等待"""
+        payload = self._payload(model, messages, True, extra)
+        with self.session.post(
+            f"{self.base_url}/api/chat",
+            json=payload,
+            timeout=self._timeouts(timeout),
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def warm_up(self, model: str, system_prompt: str = "",
+                options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        预加载模型（messages 为空时 Ollama 只加载不生成）；给出 system_prompt 时再生成 1 个 token，
+        让服务端 KV 缓存持有该静态前缀，后续请求的 prefill 只需处理动态部分。
+        options 应与正式请求一致（num_ctx 等不同会让服务端重新加载模型）。
+        """
+        data = self.chat(model, [], **({"options": options} if options else {}))
+        if system_prompt:
+            data = self.chat(model, [{"role": "system", "content": system_prompt}],
+                             options={**(options or {}), "num_predict": 1})
+        return data
+
+    def close(self) -> None:
+        self.session.close()
+
+    # ========== 异步接口 ==========
+    def _get_aclient(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                    max_keepalive_connections=self.pool_maxsize),
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries),  # 建连失败重试
+            )
+            self._aclient_loop = loop
+        return self._aclient
+
+    def _atimeout(self, timeout: Optional[float]):
+        import httpx
+
+        return httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+
+    async def achat(self, model: str, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                    **extra: Any) -> Dict[str, Any]:
+        """chat() 的 asyncio 版本：不阻塞事件循环，502/503/504 按退避重试。"""
+        client = self._get_aclient()
+        payload = self._payload(model, messages, False, extra)
+        for attempt in range(self.max_retries + 1):
+            resp = await client.post("/api/chat", json=payload, timeout=self._atimeout(timeout))
+            if resp.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+        resp.raise_for_status()
+        return resp.json()
+
+    async def achat_stream(self, model: str, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                           **extra: Any) -> AsyncIterator[Dict[str, Any]]:
+        """chat_stream() 的 asyncio 版本：逐个产出 NDJSON 分片。"""
+        client = self._get_aclient()
+        payload = self._payload(model, messages, True, extra)
+        async with client.stream("POST", "/api/chat", json=payload, timeout=self._atimeout(timeout)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+            self._aclient_loop = None
+
+
+# ====== 进程级共享实例（按 base_url 区分）======
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str = OLLAMA_BASE) -> OllamaClient:
+    key = base_url.rstrip("/")
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = OllamaClient(key)
+    return client
+
+
+def register_client(base_url: str, client: OllamaClient) -> None:
+    """把 base_url 映射到指定客户端（例如指向压测用的本地桩服务）。"""
+    with _clients_lock:
+        _clients[base_url.rstrip("/")] = client
+
+
+def message_content(data: Dict[str, Any]) -> str:
+    """从 /api/chat 响应体中取出回复文本。"""
+    return (data.get("message", {}) or {}).get("content", "").strip()
@@ -0,0 +1,203 @@
+# policy.py
+# 让价策略编译：after_concession 的下一报价只取决于 (当前 AI 报价, 用户出价)，能否继续让价只取决于 k，
+# 二者在一组配置（POLICY_FIELDS）下都是纯函数。compile_policy(ctx) 把它预先展开为只读结构：
+#   - ladder：从标价出发、max_concessions 次以内可能到达的全部报价（降序），depth 为到达所需的最少让价次数
+#   - 下一报价表：阶梯上每个仍可让价的报价一行，按 用户出价 - 行首 直接下标取值（O(1)）；
+#     低于行首的出价一律落到底价，不低于当前报价的出价不在表内（调用方按成交处理）
+# 按配置键记忆化（同配置的会话 / 调参任务共享一份），编译次数与耗时计入 "policy" 指标。
+# 表格总格数超过 POLICY_MAX_CELLS 时停止展开（complete=False），未展开的报价按公式现算，结果一致。
+# 用法：compile_policy(ctx).next_offer(ai_offer, user_offer)
+
+from typing import Any, Dict, List, Optional, Tuple
+import math
+import os
+import threading
+import time
+
+from cache import TTLCache
+import tracing
+
+# 决定让价结果的 NegotiationCtx 配置项（跳步相关字段当前不参与让价计算）
+POLICY_FIELDS = ("list_price", "bar_price", "stop_floor", "max_concessions",
+                 "fraction_towards_user", "round_base", "min_tick")
+# 按整数展开的字段（出价表逐个整数出价一格）；浮点配置在编译前取整
+INT_FIELDS = ("list_price", "bar_price", "stop_floor", "max_concessions", "round_base", "min_tick")
+POLICY_CACHE_SIZE = int(os.getenv("POLICY_CACHE_SIZE", "1024"))
+POLICY_MAX_CELLS = int(os.getenv("POLICY_MAX_CELLS", "200000"))
+
+# 一行：(行首出价 start, 低于行首时的报价, 从 start 到 当前报价-1 逐个出价的下一报价)
+Row = Tuple[int, int, Tuple[int, ...]]
+
+
+def round_to_base(x: float, base: int) -> int:
+    return int(base * round(x / base))
+
+
+def concession_offer(ai: int, user: int, fraction: float, round_base: int, min_tick: int, floor: int) -> int:
+    """after_concession 的报价公式：从用户价向 AI 价推进 fraction 并取整；未降价则降 min_tick；不低于 floor"""
+    candidate = round_to_base(user + fraction * (ai - user), round_base)
+    if candidate >= ai:
+        candidate = ai - min_tick
+    return max(candidate, floor)
+
+
+class CompiledPolicy:
+    __slots__ = ("config", "floor", "ladder", "depth", "rows", "cells", "complete", "compile_ms")
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.floor = max(config["stop_floor"], config["bar_price"])
+        self.depth: Dict[int, int] = {}
+        self.rows: Dict[int, Row] = {}
+        self.cells = 0
+        self.complete = True
+        self.compile_ms = 0.0
+        self.ladder: Tuple[int, ...] = ()
+
+    # ========== 查询 ==========
+    def can_concede(self, ai: int, k: int) -> bool:
+        """与 reached_stop / over_limit / has_budget 一致（不含成交判断）"""
+        return ai > self.floor and k < self.config["max_concessions"]
+
+    def next_offer(self, ai: int, user: int) -> int:
+        """当前报价 ai、用户出价 user（< ai）时的下一报价"""
+        row = self.rows.get(ai)
+        if row is not None and isinstance(user, int):      # 非整数出价（450.5）不在表格下标里，按公式现算
+            start, low, cells = row
+            if user < start:
+                return low
+            i = user - start
+            if i < len(cells):
+                return cells[i]
+        return self._formula(ai, user)
+
+    def table(self, ai: int) -> List[Tuple[Optional[int], int, int]]:
+        """ai 这一行按下一报价合并成区间：[(出价下限（None 为不限）, 出价上限, 下一报价), ...]"""
+        row = self.rows.get(ai)
+        if row is None:
+            return []
+        start, low, cells = row
+        out: List[Tuple[Optional[int], int, int]] = [(None, start - 1, low)]
+        for i, offer in enumerate(cells):
+            lo, hi, prev = out[-1]
+            if offer == prev:
+                out[-1] = (lo, start + i, prev)
+            else:
+                out.append((start + i, start + i, offer))
+        return out
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "floor": self.floor,
+            "ladder": list(self.ladder),
+            "depth": {str(p): d for p, d in self.depth.items()},
+            "rows": len(self.rows),
+            "cells": self.cells,
+            "complete": self.complete,
+            "compile_ms": self.compile_ms,
+        }
+
+    # ========== 编译 ==========
+    def _formula(self, ai: int, user: int) -> int:
+        c = self.config
+        return concession_offer(ai, user, c["fraction_towards_user"], c["round_base"], c["min_tick"], self.floor)
+
+    def _row_start(self, ai: int) -> int:
+        # 推进目标 u + f*(ai-u) 随 u 单调不减：目标低于 floor - base 的出价都落到底价，从那里开始逐个展开
+        f, base = self.config["fraction_towards_user"], self.config["round_base"]
+        return min(math.floor((self.floor - abs(base) - f * ai) / (1 - f)) - 1, ai)
+
+    def _row(self, ai: int, start: int) -> Row:
+        c = self.config
+        f, base, tick, floor = c["fraction_towards_user"], c["round_base"], c["min_tick"], self.floor
+        # concession_offer 的内联版本（编译期热循环）
+        targets = [int(base * round((u + f * (ai - u)) / base)) for u in range(start, ai)]
+        cells = [max(t if t < ai else ai - tick, floor) for t in targets]
+        skip = 0
+        while skip < len(cells) and cells[skip] == self.floor:
+            skip += 1
+        return start + skip, self.floor, tuple(cells[skip:])
+
+    def compile(self) -> "CompiledPolicy":
+        c = self.config
+        tabulate = 0 <= c["fraction_towards_user"] < 1     # 单调性只在此区间成立；否则全部按公式现算
+        self.depth = {c["list_price"]: 0}
+        frontier = [c["list_price"]]
+        k = 0
+        while frontier and k < c["max_concessions"]:
+            reached: List[int] = []
+            for ai in frontier:
+                if not self.can_concede(ai, k):
+                    continue
+                start = self._row_start(ai) if tabulate else ai
+                if not tabulate or self.cells + ai - start > POLICY_MAX_CELLS:
+                    self.complete = False
+                    continue
+                row = self._row(ai, start)
+                self.rows[ai] = row
+                self.cells += len(row[2])
+                for offer in {row[1], *row[2]}:
+                    if offer not in self.depth:
+                        self.depth[offer] = k + 1
+                        reached.append(offer)
+            frontier = reached
+            k += 1
+        self.ladder = tuple(sorted(self.depth, reverse=True))
+        return self
+
+
+class PolicyStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.compiles = 0
+        self.compile_s = 0.0
+
+    def record(self, elapsed: float) -> None:
+        with self._lock:
+            self.compiles += 1
+            self.compile_s += elapsed
+
+    def as_dict(self) -> Dict[str, Any]:
+        cache = _CACHE.stats()
+        with self._lock:
+            return {
+                "policies": cache["size"],
+                "compiles": self.compiles,
+                "mean_compile_ms": round(self.compile_s / self.compiles * 1000, 3) if self.compiles else 0.0,
+                "hit_rate": cache["hit_rate"],
+            }
+
+
+_CACHE = TTLCache(POLICY_CACHE_SIZE, ttl=None, name="policy")
+STATS = PolicyStats()
+tracing.register_gauges("policy", STATS.as_dict)
+
+
+def policy_config(ctx: Any) -> Dict[str, Any]:
+    """取出策略配置并规整：INT_FIELDS 取整、比例转 float；round_base < 1 无法取整，抛 ValueError"""
+    config = {name: getattr(ctx, name) for name in POLICY_FIELDS}
+    for name in INT_FIELDS:
+        config[name] = int(config[name])
+    config["fraction_towards_user"] = float(config["fraction_towards_user"])
+    if config["round_base"] < 1:
+        raise ValueError(f"round_base must be >= 1, got {config['round_base']}")
+    return config
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    return "|".join(repr(config[name]) for name in POLICY_FIELDS)
+
+
+def _compile(config: Dict[str, Any]) -> CompiledPolicy:
+    t0 = time.perf_counter()
+    policy = CompiledPolicy(config).compile()
+    elapsed = time.perf_counter() - t0
+    policy.compile_ms = round(elapsed * 1000, 3)
+    STATS.record(elapsed)
+    return policy
+
+
+def compile_policy(ctx: Any) -> CompiledPolicy:
+    """ctx 为 NegotiationCtx（或带 POLICY_FIELDS 属性的对象）；同配置只编译一次，并发编译同一配置只算一份"""
+    config = policy_config(ctx)
+    return _CACHE.get_or_compute(config_key(config), lambda: _compile(config))
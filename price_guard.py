@@ -0,0 +1,147 @@
+# price_guard.py
+# 价格护栏：一次扫描找出回复里的全部价格（阿拉伯 / 中文 / 混写 / 小数，可带 ¥ 前缀与 元/块 单位），
+# 按规则改写并报告改动。这是每轮话术输出前的最后一道防线，流式与非流式共用。
+#   - 有 offer：所有不等于 offer 的价格统一改写为 offer（SYSTEM_PROMPT：只能出现 offer_to_show）
+#   - 无 offer：只把低于 floor 的价格抬到 floor
+#   - 带数量单位的数字（24小时、7天、12个月、2件…）不是价格，原样保留
+
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+from numerals import CN_DIGITS, CN_UNITS, CN_WAN, DIGIT_CHARS, UNIT_CHARS, parse_number
+
+PRICE_UNITS = ("块钱", "元", "块", "rmb", "RMB")
+# 跟在数字后面表示“数量”而非“价格”的词（按长度降序匹配）
+QUANTITY_SUFFIXES = (
+    "分钟", "小时", "个月", "公斤", "厘米",
+    "天", "日", "周", "月", "年", "秒", "个", "件", "台", "次", "人", "号", "期",
+    "倍", "折", "斤", "克", "米", "寸", "码", "岁", "%", "％",
+)
+LOOKAHEAD = max(len(s) for s in PRICE_UNITS + QUANTITY_SUFFIXES)   # 判定单位/量词需要看到的后续字符数
+
+_units = "|".join(re.escape(u) for u in PRICE_UNITS)
+_suffixes = "|".join(re.escape(s) for s in sorted(QUANTITY_SUFFIXES, key=len, reverse=True))
+
+_cn_digits = "".join(CN_DIGITS)
+
+# 一个数字记号（与 numerals.NUMBER_RE 同源，额外支持小数），后随价格单位或量词；
+# 紧跟中文数字的阿拉伯数字单独成记号（350一件 = 350 + 一件），混写 4百5 不受影响；
+# 货币前缀 ¥ 不放进正则（可选前缀会让每个位置都多一次尝试），命中后再回看
+PRICE_RE = re.compile(
+    rf"(?P<num>\d{{1,3}}(?:,\d{{3}})+(?:\.\d+)?|\d+\.\d+|\d+(?=[{_cn_digits}])|[{DIGIT_CHARS}{UNIT_CHARS}]+)"
+    rf"(?P<unit>{_units})?"
+    rf"(?P<qty>{_suffixes})?"
+)
+_NUMERAL_CHARS = frozenset("0123456789.,") | frozenset(CN_DIGITS) | frozenset(CN_UNITS) | frozenset(CN_WAN)
+_SCALE_CHARS = frozenset(UNIT_CHARS)
+
+
+def _has_currency(text: str, start: int) -> bool:
+    """数字前（可隔空白）是否有 ¥ / ￥"""
+    i = start - 1
+    while i >= 0 and text[i] == " ":
+        i -= 1
+    return i >= 0 and text[i] in "¥￥"
+
+
+def _count_split(num: str) -> int:
+    """
+    “三百五一个”这类价格后紧跟数量的中文写法：返回数量（末尾一个中文数字）的起点，无则 0。
+    只在前半段已是“X百Y”式省略写法时拆分；十一个 / 一百一十一个 / 一千零一个 仍整体当数量。
+    """
+    if len(num) < 3 or CN_DIGITS.get(num[-1], 0) == 0 or num[-3] not in _SCALE_CHARS:
+        return 0
+    prev = num[-2]
+    return len(num) - 1 if (prev.isdigit() and prev != "0") or CN_DIGITS.get(prev, 0) else 0
+
+
+def price_value(cur: bool, num: str, unit: Optional[str], qty: Optional[str]) -> Optional[float]:
+    """PRICE_RE 一次匹配的各组 → 价格数值；不是价格（或无法解析）返回 None"""
+    if qty and not unit and not cur:
+        return None                             # 24小时 / 7天 / 12个月：数量；带 ¥ 的一律当价格
+    marked = bool(cur or unit)
+    if num.isdigit():
+        value = int(num)
+        # 裸阿拉伯数字：2~6 位视为价格（与旧规则一致；更长的多为单号/电话）
+        return value if marked or (value >= 10 and len(num) <= 6) else None
+    plain = num.replace(",", "")
+    if plain.replace(".", "", 1).isdigit():
+        value = float(plain) if "." in plain else int(plain)
+        return value if marked or (value >= 10 and len(plain.split(".")[0]) <= 6) else None
+    if not marked and not any(c in _SCALE_CHARS for c in num):
+        return None                             # 裸中文且不带 十/百/千/万：“一下”“三”等普通用语
+    value = parse_number(plain)
+    if value is None or (not marked and value < 100):
+        return None                             # “十分”“二十”这类裸中文小数目不当价格
+    return value
+
+
+def guard_prices(text: str, floor: Optional[float] = None,
+                 offer: Optional[int] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    单次扫描改写价格，返回 (改写后文本, 改动列表)。
+    改动项：{"start", "end", "original", "value", "replacement", "reason"}，
+    reason 为 "not_offer"（有 offer 时出现了别的价格）或 "below_floor"。
+    """
+    out: List[str] = []
+    changes: List[Dict[str, Any]] = []
+    pos = 0
+    for m in PRICE_RE.finditer(text):
+        num, unit, qty = m.groups()
+        start, end = m.span(1)
+        if qty and not unit:
+            cut = _count_split(num)
+            if cut:                             # 三百五|一个：前半是价格，量词只属于后面的数量
+                num, qty, end = num[:cut], None, start + cut
+        value = price_value(_has_currency(text, start), num, unit, qty)
+        if value is None:
+            continue
+        if offer is not None:
+            if value == offer:
+                continue
+            replacement, reason = str(int(offer)), "not_offer"
+        elif floor is not None and value < floor:
+            replacement, reason = str(int(floor)), "below_floor"
+        else:
+            continue
+        out.append(text[pos:start])
+        out.append(replacement)
+        pos = end
+        changes.append({"start": start, "end": end, "original": num, "value": value,
+                        "replacement": replacement, "reason": reason})
+    if not changes:
+        return text, changes
+    out.append(text[pos:])
+    return "".join(out), changes
+
+
+def guard_core_view(text: str, core_view: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    """按 core_view 的 lowest_price / offer_to_show 改写"""
+    floor = core_view.get("lowest_price")
+    offer = core_view.get("offer_to_show")
+    if offer is not None and floor is not None:
+        offer = max(int(offer), int(floor))
+    return guard_prices(text, floor, offer)
+
+
+def has_numeral(text: str) -> bool:
+    return not _NUMERAL_CHARS.isdisjoint(text)
+
+
+def holdback_index(buf: str) -> int:
+    """
+    流式场景下可以安全放行的前缀长度：末尾的数字记号（及其后不足 LOOKAHEAD 个字符、
+    还无法判断单位/量词的部分）先扣住，等下一个分片续上后再判定。
+    """
+    start = len(buf)
+    # 最近 LOOKAHEAD 个字符内出现的数字记号（末尾未结束，或还在等单位/量词）
+    for i in range(len(buf) - 1, max(len(buf) - LOOKAHEAD - 1, -1), -1):
+        if buf[i] in _NUMERAL_CHARS:
+            start = i
+            while start > 0 and buf[start - 1] in _NUMERAL_CHARS:
+                start -= 1
+            break
+    # 货币前缀与数字之间的空白也一并扣住
+    while start > 0 and (buf[start - 1] in "¥￥" or buf[start - 1].isspace()):
+        start -= 1
+    return start
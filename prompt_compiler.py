@@ -0,0 +1,177 @@
+# prompt_compiler.py
+# 提示词编译：每个阶段只渲染它需要的字段（紧凑 JSON，无缩进），估算 token 数，
+# 超出阶段预算时按优先级丢弃/截断可选段落；CompiledPrompt.attrs() 供调用方写入本轮 span，
+# 各阶段的提示规模汇总为 "prompt" 指标。
+#   - 抽取：系统提示里已有字段说明，用户侧只放原话（超长时保留首尾）
+#   - 话术：core_view 只保留 NLG_FIELDS（不给模型看 customer_price / ai_offer 等它不该复述的数字），
+#           预算取合同 persona.token_budget（经 core_view["token_budget"] 传入）；可选附带检索到的参考示例
+# token 估算为启发式：CJK 字符约 1 token，其余字符约 3.5 个 1 token（与 llama3 分词大致相符，宁多勿少）
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import json
+import math
+import threading
+
+import tracing
+
+# 话术阶段需要的 core_view 字段（顺序即渲染顺序：会话内较稳定的在前，利于前缀复用）
+NLG_FIELDS = ("lowest_price", "phase", "can_negotiate", "allowed_actions", "intent", "offer_to_show")
+
+DEFAULT_BUDGETS = {"extract": 96, "nlg": 256}      # 用户侧提示的 token 上限（系统提示为固定前缀，不计入）
+ELLIPSIS = "…"
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+            or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF)
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 3.5)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """超出预算时保留首尾、中间用省略号（价格既可能在开头也可能在结尾）"""
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:                      # 二分：保留的总字符数
+        mid = (lo + hi + 1) // 2
+        head = mid // 2
+        candidate = text[:head] + ELLIPSIS + text[len(text) - (mid - head):]
+        if estimate_tokens(candidate) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    head = lo // 2
+    return text[:head] + ELLIPSIS + text[len(text) - (lo - head):]
+
+
+def render_fields(view: Dict[str, Any], fields: Iterable[str]) -> str:
+    """只渲染给定字段，紧凑 JSON"""
+    picked = {k: view[k] for k in fields if k in view}
+    return json.dumps(picked, ensure_ascii=False, separators=(",", ":"))
+
+
+class Section:
+    """提示中的一段；required=False 的段可在超预算时丢弃，drop_order 小的先丢"""
+    __slots__ = ("name", "text", "required", "drop_order")
+
+    def __init__(self, name: str, text: str, required: bool = True, drop_order: int = 0):
+        self.name = name
+        self.text = text
+        self.required = required
+        self.drop_order = drop_order
+
+
+class CompiledPrompt:
+    __slots__ = ("stage", "text", "tokens", "budget", "dropped")
+
+    def __init__(self, stage: str, text: str, tokens: int, budget: Optional[int], dropped: List[str]):
+        self.stage = stage
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        self.dropped = dropped
+
+    def attrs(self) -> Dict[str, Any]:
+        """写入 tracing span 的属性"""
+        out: Dict[str, Any] = {"prompt_tokens_est": self.tokens, "prompt_budget": self.budget}
+        if self.dropped:
+            out["prompt_dropped"] = ",".join(self.dropped)
+        return out
+
+
+class PromptStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_stage: Dict[str, Dict[str, int]] = {}
+
+    def record(self, compiled: CompiledPrompt) -> None:
+        with self._lock:
+            st = self.by_stage.setdefault(compiled.stage, {"prompts": 0, "tokens": 0, "trimmed": 0})
+            st["prompts"] += 1
+            st["tokens"] += compiled.tokens
+            st["trimmed"] += bool(compiled.dropped)
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for stage, st in self.by_stage.items():
+                out[f"{stage}_prompts"] = st["prompts"]
+                out[f"{stage}_mean_tokens"] = round(st["tokens"] / st["prompts"], 1) if st["prompts"] else 0.0
+                out[f"{stage}_trimmed"] = st["trimmed"]
+        return out
+
+
+STATS = PromptStats()
+tracing.register_gauges("prompt", STATS.as_dict)
+
+
+def compile_sections(stage: str, sections: Sequence[Section], budget: Optional[int] = None,
+                     sep: str = "\n") -> CompiledPrompt:
+    """按预算拼接：超出时按 drop_order 依次丢弃可选段，直到不超预算或只剩必需段"""
+    kept = [s for s in sections if s.text]
+    dropped: List[str] = []
+    text = sep.join(s.text for s in kept)
+    tokens = estimate_tokens(text)
+    if budget is not None:
+        for victim in sorted((s for s in kept if not s.required), key=lambda s: s.drop_order):
+            if tokens <= budget:
+                break
+            kept.remove(victim)
+            dropped.append(victim.name)
+            text = sep.join(s.text for s in kept)
+            tokens = estimate_tokens(text)
+    return CompiledPrompt(stage, text, tokens, budget, dropped)
+
+
+# ====== 各阶段 ======
+def compile_extract(user_text: str, budget: Optional[int] = DEFAULT_BUDGETS["extract"]) -> CompiledPrompt:
+    """抽取提示：只有用户原话（字段说明在系统提示里）；超预算时保留首尾"""
+    head = "用户原话：\n"
+    raw = user_text.strip()
+    text = raw if budget is None else truncate_to_tokens(raw, budget - estimate_tokens(head) - 2)
+    dropped = ["user_text_truncated"] if text != raw else []
+    text = f'{head}"""{text}"""'
+    compiled = CompiledPrompt("extract", text, estimate_tokens(text), budget, dropped)
+    STATS.record(compiled)
+    return compiled
+
+
+def compile_nlg(head: str, last_user_text: str, core_view: Dict[str, Any],
+                value_reasons: Optional[List[str]] = None, cta: Optional[str] = None,
+                budget: Optional[int] = None, examples: Optional[List[str]] = None) -> CompiledPrompt:
+    """
+    话术提示：固定说明 → 价值点/CTA → 参考示例（可选）→ 状态（只含 NLG_FIELDS）→ 用户原话。
+    超预算时依次丢弃：参考示例 → 第 2 个价值点 → CTA → 第 1 个价值点，最后截断用户原话。
+    """
+    if budget is None:
+        budget = core_view.get("token_budget") or DEFAULT_BUDGETS["nlg"]
+    reasons = [r for r in (value_reasons or [])[:2] if r]
+    state = Section("state", "状态：" + render_fields(core_view, NLG_FIELDS))
+    user = Section("user", f"用户：「{last_user_text}」")
+    sections = [
+        Section("head", head),
+        Section("reason_1", f"价值点：{reasons[0]}" if reasons else "", required=False, drop_order=2),
+        Section("reason_2", f"价值点：{reasons[1]}" if len(reasons) > 1 else "", required=False, drop_order=0),
+        Section("cta", f"结尾CTA：{cta}" if cta else "", required=False, drop_order=1),
+        Section("examples", "参考示例（仅参考语气，价格以状态为准）：\n" + "\n".join(examples) if examples else "",
+                required=False, drop_order=-1),
+        state,
+        user,
+    ]
+    compiled = compile_sections("nlg", sections, budget)
+    if compiled.tokens > budget:
+        # 必需段仍超预算：截断用户原话（状态字段不能动）
+        fixed = estimate_tokens(compiled.text) - estimate_tokens(user.text) + estimate_tokens("用户：「」") + 1
+        user.text = f"用户：「{truncate_to_tokens(last_user_text, max(budget - fixed, 8))}」"
+        text = "\n".join(s.text for s in sections if s.text and s.name not in compiled.dropped)
+        compiled.text, compiled.tokens = text, estimate_tokens(text)
+        compiled.dropped.append("user_text_truncated")
+    STATS.record(compiled)
+    return compiled
@@ -0,0 +1,289 @@
+# resilience.py
+# LLM 调用的尾延迟保护（按阶段各一个 StageGuard）：
+#   - 自适应超时：取最近 WINDOW 次调用的 p95 × TIMEOUT_FACTOR，夹在 [MIN_TIMEOUT_S, MAX_TIMEOUT_S]；
+#     用 p95 而非 p99：偶发卡顿（正是要切掉的那部分）不会把超时本身抬上去。
+#     样本不足时按 SLO × TIMEOUT_FACTOR（均远低于客户端默认的 120s 读超时）
+#   - 对冲请求（可选）：主请求超过近期 p95 仍未返回时再发一份，取先成功的（异步版取消落后的一份）
+#   - 熔断：连续 BREAKER_FAILURES 次失败（出错 / 超时）即打开，期间直接拒绝（调用方降级为规则抽取/模板话术）；
+#     RESET_S 秒后半开，放行一个探测请求，成功（不论快慢）则关闭、失败则重新打开。
+#     默认值：超出 SLO 的成功调用不计入熔断（只计入 slow 指标），即默认不按“连续慢调用”熔断；
+#     BREAKER_TRIP_ON_SLOW=1 时慢调用与失败一样计入连续失败（适合 SLO 已按实测延迟校准的部署——
+#     纯 CPU 机器上默认 SLO 偏紧，计入会让熔断反复打开）
+#   - 批量调用（如微批抽取）同样经 call()：timeout_factor 放宽超时与 SLO，sample=False 不进延迟窗口
+#     （多条一次的耗时与单条不可比），但成功 / 失败照常计入熔断
+# 被拒绝或失败时统一抛 Unavailable，调用方据此降级。
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+import asyncio
+import os
+import threading
+import time
+
+import tracing
+
+T = TypeVar("T")
+
+WINDOW = 256                 # 参与分位数计算的最近调用数
+MIN_SAMPLES = 20             # 样本少于此数时不做自适应
+TIMEOUT_QUANTILE = 0.95
+TIMEOUT_FACTOR = 3.0
+MIN_TIMEOUT_S = 2.0
+MAX_TIMEOUT_S = float(os.getenv("LLM_MAX_TIMEOUT_S", "30"))
+HEDGE_QUANTILE = 0.95
+HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+BREAKER_TRIP_ON_SLOW = os.getenv("BREAKER_TRIP_ON_SLOW", "0") == "1"
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# 同步对冲用的线程池（落后的那份请求无法中途取消，会跑到自身超时为止，池要留足余量）
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+class Unavailable(Exception):
+    """熔断拒绝或调用失败/超时：调用方应降级"""
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage} unavailable: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_s: float = BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probe_at: Optional[float] = None       # 半开状态下探测请求的放行时间
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        now = time.time()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.reset_s:
+                self.state, self.probe_at = HALF_OPEN, None
+            if self.state == CLOSED:
+                return True
+            # 半开：只放行一个探测；探测迟迟没有结果（如调用方中途放弃流）时重新放行
+            if self.state == HALF_OPEN and (self.probe_at is None or now - self.probe_at >= self.reset_s):
+                self.probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self) -> bool:
+        """只查询、不占用半开探测名额（给不参与熔断记账的旁路调用用）"""
+        with self._lock:
+            return self.state == OPEN and time.time() - self.opened_at < self.reset_s
+
+    def record(self, ok: bool, slow: bool = False) -> None:
+        """slow：成功但超出 SLO，只在关闭状态下计入连续失败；半开探测成功一律关闭"""
+        with self._lock:
+            if ok and (not slow or self.state != CLOSED):
+                self.consecutive = 0
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                return
+            self.consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive >= self.failures):
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive,
+                    "trips": self.trips, "rejected": self.rejected}
+
+
+class StageGuard:
+    """单个阶段（extract / nlg）的 SLO、自适应超时、对冲与熔断"""
+
+    def __init__(self, name: str, slo_ms: float, hedge: bool = HEDGE,
+                 min_timeout_s: float = MIN_TIMEOUT_S, max_timeout_s: float = MAX_TIMEOUT_S,
+                 breaker: Optional[CircuitBreaker] = None, trip_on_slow: bool = BREAKER_TRIP_ON_SLOW):
+        self.name = name
+        self.slo_s = slo_ms / 1000
+        self.hedge = hedge
+        self.min_timeout_s = min_timeout_s
+        self.max_timeout_s = max_timeout_s
+        self.breaker = breaker or CircuitBreaker()
+        self.trip_on_slow = trip_on_slow
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=WINDOW)
+        self.calls = 0
+        self.failures = 0
+        self.slow = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.degraded = 0
+
+    # ========== 自适应参数 ==========
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            data = sorted(self._latencies)
+        return data[min(int(q * len(data)), len(data) - 1)]
+
+    def timeout(self) -> float:
+        base = self.quantile(TIMEOUT_QUANTILE)
+        if base is None:
+            base = self.slo_s
+        return min(max(base * TIMEOUT_FACTOR, self.min_timeout_s), self.max_timeout_s)
+
+    # ========== 记账 ==========
+    def allow(self) -> bool:
+        return self.breaker.allow()
+
+    def record_success(self, elapsed: float, slo_factor: float = 1.0, sample: bool = True) -> None:
+        slow = elapsed > self.slo_s * slo_factor
+        with self._lock:
+            self.calls += 1
+            self.slow += slow
+            if sample:
+                self._latencies.append(elapsed)
+        self.breaker.record(True, slow=slow and self.trip_on_slow)
+
+    def record_failure(self, elapsed: float, sample: bool = True) -> None:
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            if sample:
+                self._latencies.append(elapsed)    # 超时也进窗口：服务整体变慢时超时阈值随之上调（受 max 限制）
+        self.breaker.record(False)
+
+    def note_degraded(self) -> None:
+        with self._lock:
+            self.degraded += 1
+
+    # ========== 调用 ==========
+    def call(self, fn: Callable[[float], T], timeout_factor: float = 1.0, sample: bool = True) -> T:
+        """
+        fn(timeout_s) 执行一次 LLM 调用；熔断打开或调用失败时抛 Unavailable。
+        批量调用传 timeout_factor（超时与 SLO 同比放宽）和 sample=False（不进延迟窗口、不对冲）。
+        """
+        if not self.allow():
+            raise Unavailable(self.name, "breaker_open")
+        timeout = self.timeout() * timeout_factor
+        tracing.annotate(timeout_ms=round(timeout * 1000))
+        t0 = time.perf_counter()
+        try:
+            result = self._hedged(fn, timeout) if self.hedge and sample else fn(timeout)
+        except Exception as e:
+            self.record_failure(time.perf_counter() - t0, sample)
+            raise Unavailable(self.name, type(e).__name__) from e
+        self.record_success(time.perf_counter() - t0, timeout_factor, sample)
+        return result
+
+    def hedge_delay(self) -> float:
+        """主请求超过此时长仍未返回才发对冲请求；样本不足时取 SLO"""
+        delay = self.quantile(HEDGE_QUANTILE)
+        return self.slo_s if delay is None else delay
+
+    def _hedged(self, fn: Callable[[float], T], timeout: float) -> T:
+        delay = self.hedge_delay()
+        if delay >= timeout:
+            return fn(timeout)
+        first = _HEDGE_POOL.submit(fn, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        second = _HEDGE_POOL.submit(fn, timeout - delay)
+        with self._lock:
+            self.hedges += 1
+        tracing.annotate(hedged=True)
+        return self._first_success([first, second], second)
+
+    def _first_success(self, pending: List[Future], hedge: Future) -> T:
+        error: Optional[BaseException] = None
+        while pending:
+            done, rest = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return fut.result()
+                error = fut.exception()
+            pending = list(rest)
+        raise error
+
+    async def acall(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """call() 的 asyncio 版本：整体用 wait_for 兜住超时，对冲时取消落后的一份"""
+        if not self.allow():
+            raise Unavailable(self.name, "breaker_open")
+        timeout = self.timeout()
+        tracing.annotate(timeout_ms=round(timeout * 1000))
+        t0 = time.perf_counter()
+        try:
+            if self.hedge:
+                result = await asyncio.wait_for(self._ahedged(fn, timeout), timeout)
+            else:
+                result = await asyncio.wait_for(fn(timeout), timeout)
+        except Exception as e:
+            self.record_failure(time.perf_counter() - t0)
+            raise Unavailable(self.name, type(e).__name__) from e
+        self.record_success(time.perf_counter() - t0)
+        return result
+
+    async def _ahedged(self, fn: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(fn(timeout))
+        if delay >= timeout:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(fn(timeout - delay))
+        with self._lock:
+            self.hedges += 1
+        tracing.annotate(hedged=True)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95, p99 = self.quantile(0.5), self.quantile(0.95), self.quantile(0.99)
+        with self._lock:
+            out = {
+                "slo_ms": round(self.slo_s * 1000),
+                "timeout_ms": None,
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow": self.slow,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "degraded": self.degraded,
+            }
+        out["timeout_ms"] = round(self.timeout() * 1000)
+        out.update(self.breaker.stats())
+        return out
+
+
+def register(guard: StageGuard) -> StageGuard:
+    tracing.register_gauges(f"breaker_{guard.name}", guard.stats)
+    return guard
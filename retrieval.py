@@ -0,0 +1,213 @@
+# retrieval.py
+# 话术少样本检索：dialogues.json 与 prompt.txt【示例】里的问答对建成字符 n-gram BM25 倒排索引，
+# 常驻内存、可增量 add()；每轮按用户原话取 top-k，并在 token 预算内挑选（放不下的跳过，取下一名）。
+#   - 查询结果按 归一化原话 + k + 预算 缓存（TTLCache，add() 后整体失效）
+#   - 纯 Python、无外部服务；idf 与词频权重在 add() 后惰性重算一次，5000 条示例时冷查询约 0.5ms
+# 用法：select_examples("450行不行", k=2, budget=120) → [Example, ...]
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from cache import TTLCache, normalize_text
+from prompt_compiler import estimate_tokens
+import tracing
+
+DIALOGUES_PATH = "dialogues.json"
+PROMPT_PATH = "prompt.txt"
+NGRAM = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+QUERY_CACHE_SIZE = 2048
+CANDIDATE_FACTOR = 4        # 预算筛选前先取 k * CANDIDATE_FACTOR 个候选
+
+# prompt.txt：用户：“……” 换行 你：…… 直到空行或下一个【段落】
+_PROMPT_EXAMPLE_RE = re.compile(r"用户：[“\"](.+?)[”\"]\s*\n你：\s*\n?(.*?)(?=\n\s*\n|\n【|\Z)", re.S)
+
+
+class Example:
+    __slots__ = ("user", "assistant", "source", "text", "tokens")
+
+    def __init__(self, user: str, assistant: str, source: str = ""):
+        self.user = user.strip()
+        self.assistant = assistant.strip()
+        self.source = source
+        self.text = f"用户：{self.user}\n客服：{self.assistant}"
+        self.tokens = estimate_tokens(self.text)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"user": self.user, "assistant": self.assistant, "source": self.source}
+
+
+def ngrams(text: str, n: int = NGRAM) -> List[str]:
+    """归一化后的字符 n-gram；不足 n 个字符时退化为整串"""
+    s = normalize_text(text)
+    if len(s) < n:
+        return [s] if s else []
+    return [s[i:i + n] for i in range(len(s) - n + 1)]
+
+
+class BM25Index:
+    def __init__(self, n: int = NGRAM, k1: float = BM25_K1, b: float = BM25_B,
+                 cache_size: int = QUERY_CACHE_SIZE, name: str = "fewshot"):
+        self.n = n
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.docs: List[Example] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}     # term -> [(doc_id, tf)]
+        # term -> (idf, [(doc_id, 词频归一化后的权重)])；add() 改变 N / avgdl 后整体重算（惰性）
+        self._weights: Dict[str, Tuple[float, List[Tuple[int, float]]]] = {}
+        self._lengths: List[int] = []
+        self._total_len = 0
+        self._seen: set = set()                                     # 已收录的归一化用户原话（去重）
+        self.cache = TTLCache(cache_size, ttl=None, name=name)
+        self.queries = 0
+        self.query_s = 0.0
+
+    # ========== 构建 ==========
+    def add(self, examples: Iterable[Example]) -> int:
+        """增量加入示例（按归一化用户原话去重），返回新增条数"""
+        added = 0
+        with self._lock:
+            for ex in examples:
+                key = normalize_text(ex.user)
+                if not key or key in self._seen:
+                    continue
+                self._seen.add(key)
+                doc_id = len(self.docs)
+                self.docs.append(ex)
+                terms = ngrams(ex.user, self.n)
+                tf: Dict[str, int] = {}
+                for t in terms:
+                    tf[t] = tf.get(t, 0) + 1
+                for t, c in tf.items():
+                    self._postings.setdefault(t, []).append((doc_id, c))
+                self._lengths.append(len(terms))
+                self._total_len += len(terms)
+                added += 1
+            if added:
+                self._weights = {}
+                self.cache.clear()
+        return added
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ========== 查询 ==========
+    def _reweight(self) -> None:
+        n_docs = len(self.docs)
+        avgdl = self._total_len / n_docs
+        k1, b = self.k1, self.b
+        norms = [k1 * (1 - b + b * length / avgdl) for length in self._lengths]
+        self._weights = {
+            term: (math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)),
+                   [(doc_id, tf * (k1 + 1) / (tf + norms[doc_id])) for doc_id, tf in postings])
+            for term, postings in self._postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[float, int]]:
+        """BM25 得分最高的 k 条 (score, doc_id)，只返回得分 > 0 的"""
+        with self._lock:
+            if not self.docs or k <= 0:
+                return []
+            if not self._weights:
+                self._reweight()
+            scores: Dict[int, float] = {}
+            get = scores.get
+            for term in set(ngrams(query, self.n)):
+                entry = self._weights.get(term)
+                if entry is None:
+                    continue
+                idf, postings = entry
+                for doc_id, w in postings:
+                    scores[doc_id] = get(doc_id, 0.0) + idf * w
+        return heapq.nlargest(k, ((s, d) for d, s in scores.items()), key=lambda x: x[0])
+
+    def select(self, query: str, k: int, budget: Optional[int] = None) -> List[Example]:
+        """top-k 示例，总 token 不超过 budget（按名次贪心，放不下的跳过）；结果按查询缓存"""
+        norm = normalize_text(query)
+        if not norm or k <= 0:
+            return []
+        key = f"{k}|{budget}|{norm}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [self.docs[i] for i in cached]
+        t0 = time.perf_counter()
+        picked: List[int] = []
+        used = 0
+        for _, doc_id in self.search(norm, k * CANDIDATE_FACTOR):
+            cost = self.docs[doc_id].tokens
+            if budget is not None and used + cost > budget:
+                continue
+            picked.append(doc_id)
+            used += cost
+            if len(picked) >= k:
+                break
+        self.cache.set(key, picked)
+        with self._lock:
+            self.queries += 1
+            self.query_s += time.perf_counter() - t0
+        return [self.docs[i] for i in picked]
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self.cache.stats()
+        with self._lock:
+            return {
+                "docs": len(self.docs),
+                "terms": len(self._postings),
+                "queries": self.queries,
+                "mean_query_us": round(self.query_s / self.queries * 1e6, 1) if self.queries else 0.0,
+                "cache_hit_rate": cache["hit_rate"],
+            }
+
+
+# ====== 数据源 ======
+def load_dialogues(path: str = DIALOGUES_PATH) -> List[Example]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    # assistant 为 JSON 的条目是状态标注而非话术，不作为示例
+    return [Example(ex["user"], ex["assistant"], "dialogues") for ex in data.get("examples", [])
+            if ex.get("user") and ex.get("assistant") and not ex["assistant"].lstrip().startswith("{")]
+
+
+def load_prompt_examples(path: str = PROMPT_PATH) -> List[Example]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return [Example(user, assistant, "prompt") for user, assistant in _PROMPT_EXAMPLE_RE.findall(text)]
+
+
+# ====== 默认索引（首次使用或启动时构建）======
+_INDEX: Optional[BM25Index] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> BM25Index:
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                index = BM25Index()
+                index.add(load_dialogues())
+                index.add(load_prompt_examples())
+                tracing.register_gauges("fewshot", index.stats)
+                _INDEX = index
+    return _INDEX
+
+
+def select_examples(query: str, k: int, budget: Optional[int] = None) -> List[Example]:
+    return get_index().select(query, k, budget)
+
+
+def add_examples(examples: Iterable[Example]) -> int:
+    """运行期追加示例（如人工标注的优质回复）"""
+    return get_index().add(examples)
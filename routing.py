@@ -0,0 +1,327 @@
+# routing.py
+# 按阶段路由 LLM 调用：每个阶段（extract 抽取 / nlg 话术）一条 Route = 模型 + options + 一组 Ollama 端点。
+# 抽取只需输出几十 token 的 JSON，可以放到小的量化模型上（如 qwen2.5:1.5b-instruct-q4_K_M），话术仍用大模型。
+#   - 配置：OLLAMA_ROUTES（JSON 字符串，或 @path/to/routes.json），按阶段给出 model / options / endpoints，例如
+#       {"extract": {"model": "qwen2.5:1.5b-instruct-q4_K_M", "options": {"temperature": 0, "num_ctx": 1024},
+#                    "endpoints": ["http://gpu-a:11434", "http://gpu-b:11434"]},
+#        "nlg": {"model": "llama3.1", "options": {"temperature": 0.7, "num_ctx": 4096}}}
+#     未配置的项取缺省：模型 EXTRACT_MODEL / NLG_MODEL（默认 llama3.1），端点 OLLAMA_ENDPOINTS（逗号分隔，
+#     默认 ollama_client.OLLAMA_BASE）——不做任何配置时与原先完全一致
+#   - options 作为该阶段的缺省参数；调用方显式给出的同名项优先（如抽取按 schema 估算的 num_predict，
+#     批量抽取按条数放大的上限），所以 num_predict 对话术生效，对抽取只作兜底
+#   - 负载均衡：最少在途请求（least outstanding requests）；同一 URL 的端点在各阶段间共享在途计数
+#   - 故障转移：每个端点一个 resilience.CircuitBreaker（连续 ENDPOINT_FAILURES 次失败即摘除，
+#     ENDPOINT_RESET_S 秒后半开探测）；调用失败时换下一个端点重试，每个端点最多一次，且都在调用方给的
+#     timeout 内（不会把阶段的自适应超时放大）；全部失败时抛最后一个错误，由阶段 StageGuard 记账 / 熔断 / 降级。
+#     只有端点故障（建连失败、超时、5xx）才换端点并计入端点熔断；4xx（模型不存在、请求有误）换端点也一样，
+#     直接抛给调用方，也不会让各阶段共享的端点被摘除
+#   - 流式：只在首个分片之前失败才换端点（已输出的部分不能重放）
+#   - StageGuard 对冲发出的第二份请求同样经过路由：第一份还在途，自然落到另一个端点
+# 每个端点的在途数 / 调用 / 失败 / 转移次数计入 "endpoint_<host>_<port>" 指标，各阶段模型见 "routing"。
+
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import requests
+
+from ollama_client import OLLAMA_BASE, get_client
+from resilience import CircuitBreaker
+import tracing
+
+DEFAULT_MODEL = "llama3.1"
+EXTRACT_MODEL = os.getenv("EXTRACT_MODEL", DEFAULT_MODEL)
+NLG_MODEL = os.getenv("NLG_MODEL", DEFAULT_MODEL)
+OLLAMA_ENDPOINTS = [u.strip() for u in os.getenv("OLLAMA_ENDPOINTS", OLLAMA_BASE).split(",") if u.strip()]
+OLLAMA_ROUTES = os.getenv("OLLAMA_ROUTES", "")
+
+ENDPOINT_FAILURES = int(os.getenv("ENDPOINT_FAILURES", "3"))
+ENDPOINT_RESET_S = float(os.getenv("ENDPOINT_RESET_S", "10"))
+MIN_ATTEMPT_S = 0.05            # 剩余预算不足此值时不再换端点
+
+STAGE_MODELS = {"extract": EXTRACT_MODEL, "nlg": NLG_MODEL}
+
+
+class NoEndpoint(Exception):
+    """该阶段的端点全部被摘除（各自的熔断打开）"""
+
+
+_TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                     OSError, TimeoutError)
+
+
+def endpoint_fault(error: BaseException) -> bool:
+    """是否算端点故障：建连失败 / 超时 / 5xx 是；4xx 及其他（请求本身的问题）不是"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status >= 500
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    httpx = sys.modules.get("httpx")            # 异步客户端按需导入 httpx；没导入过就不会有它的异常
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+class Endpoint:
+    """一个 Ollama 服务：在途计数 + 熔断；客户端每次按 URL 取（ollama_client.register_client 的替换照常生效）"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.breaker = CircuitBreaker(ENDPOINT_FAILURES, ENDPOINT_RESET_S)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.calls = 0
+        self.failures = 0
+        self.failovers = 0          # 在此端点失败后改投其他端点的次数
+
+    @property
+    def client(self):
+        return get_client(self.url)
+
+    def acquire(self) -> None:
+        with self._lock:
+            self.inflight += 1
+            self.calls += 1
+
+    def release(self, ok: bool) -> None:
+        with self._lock:
+            self.inflight -= 1
+            self.failures += not ok
+        self.breaker.record(ok)
+
+    def note_failover(self) -> None:
+        with self._lock:
+            self.failovers += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {"url": self.url, "inflight": self.inflight, "calls": self.calls,
+                   "failures": self.failures, "failovers": self.failovers}
+        out.update(self.breaker.stats())
+        return out
+
+
+_ENDPOINTS: Dict[str, Endpoint] = {}
+_ENDPOINTS_LOCK = threading.Lock()
+
+
+def endpoint(url: str) -> Endpoint:
+    """按 URL 取共享的 Endpoint（各阶段共用同一服务时在途计数合并）"""
+    key = url.rstrip("/")
+    with _ENDPOINTS_LOCK:
+        ep = _ENDPOINTS.get(key)
+        if ep is None:
+            ep = _ENDPOINTS[key] = Endpoint(key)
+            slug = re.sub(r"[^0-9a-zA-Z]+", "_", urlparse(key).netloc or key).strip("_")
+            tracing.register_gauges(f"endpoint_{slug}", ep.stats)
+    return ep
+
+
+class Route:
+    """一个阶段的模型 + options + 端点组"""
+
+    def __init__(self, stage: str, model: str, options: Optional[Dict[str, Any]] = None,
+                 endpoints: Optional[List[str]] = None):
+        self.stage = stage
+        self.model = model
+        self.options = dict(options or {})
+        self.endpoints = [endpoint(u) for u in (endpoints or OLLAMA_ENDPOINTS)]
+        if not self.endpoints:
+            raise ValueError(f"route {stage}: no endpoints")
+        self._rr = 0
+
+    # ========== 选端点 ==========
+    def candidates(self) -> List[Endpoint]:
+        """按在途请求数升序排列的端点（并列时轮转）"""
+        n = len(self.endpoints)
+        if n == 1:
+            return self.endpoints
+        self._rr = (self._rr + 1) % n
+        order = sorted(range(n), key=lambda i: (self.endpoints[i].inflight, (i - self._rr) % n))
+        return [self.endpoints[i] for i in order]
+
+    def request(self, extra: Dict[str, Any]) -> Dict[str, Any]:
+        """合并阶段 options 与调用方参数（调用方显式给出的优先）"""
+        if not self.options:
+            return extra
+        return {**extra, "options": {**self.options, **(extra.get("options") or {})}}
+
+    def _attempts(self, timeout: Optional[float]) -> Iterator[Tuple[Endpoint, Optional[float]]]:
+        """依次给出 (端点, 本次可用的读超时)；总时长不超过 timeout"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        prev: Optional[Endpoint] = None
+        for ep in self.candidates():
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining < MIN_ATTEMPT_S:
+                return
+            if not ep.breaker.allow():          # 按需询问：半开探测名额只给真正要发的请求
+                continue
+            if prev is not None:
+                prev.note_failover()
+                tracing.annotate(failover=ep.url)
+            yield ep, remaining
+            prev = ep
+
+    def _no_endpoint(self, error: Optional[BaseException]) -> BaseException:
+        return error if error is not None else NoEndpoint(f"{self.stage}: all endpoints unavailable")
+
+    # ========== 同步 ==========
+    def chat(self, messages: List[Dict[str, str]], timeout: Optional[float] = None, **extra: Any) -> Dict[str, Any]:
+        extra = self.request(extra)
+        error: Optional[BaseException] = None
+        for ep, remaining in self._attempts(timeout):
+            ep.acquire()
+            try:
+                data = ep.client.chat(self.model, messages, timeout=remaining, **extra)
+            except Exception as e:
+                fault = endpoint_fault(e)
+                ep.release(not fault)
+                if not fault:
+                    raise
+                error = e
+                continue
+            ep.release(True)
+            return data
+        raise self._no_endpoint(error)
+
+    def chat_stream(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                    **extra: Any) -> Iterator[Dict[str, Any]]:
+        extra = self.request(extra)
+        error: Optional[BaseException] = None
+        for ep, remaining in self._attempts(timeout):
+            ep.acquire()
+            ok = False
+            started = False
+            try:
+                for chunk in ep.client.chat_stream(self.model, messages, timeout=remaining, **extra):
+                    started = True
+                    yield chunk
+                ok = True
+                return
+            except Exception as e:
+                ok = not endpoint_fault(e)
+                if started or ok:
+                    raise
+                error = e
+            except BaseException:
+                ok = True                   # 调用方关闭生成器（GeneratorExit）：不算端点故障
+                raise
+            finally:
+                ep.release(ok)
+        raise self._no_endpoint(error)
+
+    # ========== 异步 ==========
+    async def achat(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                    **extra: Any) -> Dict[str, Any]:
+        extra = self.request(extra)
+        error: Optional[BaseException] = None
+        for ep, remaining in self._attempts(timeout):
+            ep.acquire()
+            try:
+                data = await ep.client.achat(self.model, messages, timeout=remaining, **extra)
+            except Exception as e:
+                fault = endpoint_fault(e)
+                ep.release(not fault)
+                if not fault:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                ep.release(True)            # 被取消（对冲落后 / 外层超时）：不算端点故障
+                raise
+            ep.release(True)
+            return data
+        raise self._no_endpoint(error)
+
+    async def achat_stream(self, messages: List[Dict[str, str]], timeout: Optional[float] = None,
+                           **extra: Any) -> AsyncIterator[Dict[str, Any]]:
+        extra = self.request(extra)
+        error: Optional[BaseException] = None
+        for ep, remaining in self._attempts(timeout):
+            ep.acquire()
+            ok = False
+            started = False
+            try:
+                async for chunk in ep.client.achat_stream(self.model, messages, timeout=remaining, **extra):
+                    started = True
+                    yield chunk
+                ok = True
+                return
+            except Exception as e:
+                ok = not endpoint_fault(e)
+                if started or ok:
+                    raise
+                error = e
+            except BaseException:
+                ok = True                   # 被取消 / 调用方关闭生成器：不算端点故障
+                raise
+            finally:
+                ep.release(ok)
+        raise self._no_endpoint(error)
+
+    # ========== 预热 ==========
+    def warm_up(self, system_prompt: str = "") -> Dict[str, Any]:
+        """在每个端点上预加载模型（带上阶段 options，num_ctx 不同会导致服务端重新加载）并预热前缀"""
+        data: Dict[str, Any] = {}
+        for ep in self.endpoints:
+            data = ep.client.warm_up(self.model, system_prompt, options=self.options)
+        return data
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"model": self.model, "options": dict(self.options), "endpoints": [ep.url for ep in self.endpoints]}
+
+
+# ====== 配置 ======
+def load_config(spec: str = OLLAMA_ROUTES) -> Dict[str, Dict[str, Any]]:
+    """OLLAMA_ROUTES：JSON 字符串或 @文件路径；空为 {}"""
+    spec = spec.strip()
+    if not spec:
+        return {}
+    if spec.startswith("@"):
+        with open(spec[1:], encoding="utf-8") as f:
+            spec = f.read()
+    config = json.loads(spec)
+    if not isinstance(config, dict):
+        raise ValueError("OLLAMA_ROUTES must be a JSON object keyed by stage")
+    return config
+
+
+def build_route(stage: str, config: Optional[Dict[str, Any]] = None) -> Route:
+    config = config or {}
+    endpoints = config.get("endpoints")
+    if isinstance(endpoints, str):
+        endpoints = [u.strip() for u in endpoints.split(",") if u.strip()]
+    return Route(stage, config.get("model") or STAGE_MODELS.get(stage, DEFAULT_MODEL),
+                 config.get("options"), endpoints)
+
+
+_CONFIG = load_config()
+_ROUTES: Dict[str, Route] = {}
+_ROUTES_LOCK = threading.Lock()
+
+
+def route(stage: str) -> Route:
+    """取阶段路由（首次使用时按配置建立）"""
+    r = _ROUTES.get(stage)
+    if r is None:
+        with _ROUTES_LOCK:
+            r = _ROUTES.get(stage)
+            if r is None:
+                r = _ROUTES[stage] = build_route(stage, _CONFIG.get(stage))
+    return r
+
+
+def routing_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for stage, r in sorted(_ROUTES.items()):
+        out[f"{stage}_model"] = r.model
+        out[f"{stage}_endpoints"] = len(r.endpoints)
+        out[f"{stage}_inflight"] = sum(ep.inflight for ep in r.endpoints)
+    return out
+
+
+tracing.register_gauges("routing", routing_stats)
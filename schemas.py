@@ -0,0 +1,194 @@
+# schemas.py
+# 抽取结果的类型化模型：UserSummary（单条）/ BatchSummary（微批）。
+#   - ollama_format(model)：由模型生成传给 Ollama `format` 的 JSON Schema（约束解码，模型写完对象即停）
+#   - parse_summary(raw)：先严格校验；不合法时做一次修复（剥代码围栏/前后缀、单引号、尾逗号、
+#     字段取值规整），仍失败才返回 None，由调用方走兜底。解析/修复/失败次数记入 PARSE_STATS。
+
+from typing import Any, Dict, List, Literal, Optional, Tuple, Type
+import json
+import re
+import threading
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from numerals import parse_number
+
+INTENTS = ("counter_offer", "accept", "ask", "other")
+NOTES_MAX = 20
+
+Intent = Literal["counter_offer", "accept", "ask", "other"]
+
+# 常见的非规范写法 → 规范 intent（修复阶段使用）
+INTENT_ALIASES = {
+    "counter": "counter_offer", "counteroffer": "counter_offer", "counter-offer": "counter_offer",
+    "offer": "counter_offer", "bargain": "counter_offer", "还价": "counter_offer",
+    "accepted": "accept", "agree": "accept", "deal": "accept", "成交": "accept", "接受": "accept",
+    "question": "ask", "inquiry": "ask", "询问": "ask", "提问": "ask",
+}
+
+
+class UserSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    intent: Intent
+    customer_price: Optional[int] = Field(default=None, ge=0)
+    notes: str = Field(default="", max_length=NOTES_MAX)
+
+
+class BatchItem(BaseModel):
+    """批量抽取的一项：省略 notes 以减少输出 token"""
+    model_config = ConfigDict(extra="ignore")
+
+    id: int
+    intent: Intent
+    customer_price: Optional[int] = Field(default=None, ge=0)
+
+
+class BatchSummary(BaseModel):
+    items: List[BatchItem]
+
+
+def _strip_meta(node: Any) -> Any:
+    if isinstance(node, dict):
+        return {k: _strip_meta(v) for k, v in node.items() if k not in ("title", "description", "default")}
+    if isinstance(node, list):
+        return [_strip_meta(v) for v in node]
+    return node
+
+
+def ollama_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    模型 → Ollama `format` 用的 JSON Schema：去掉 title/description/default，所有字段设为必填
+    （约束解码下字段顺序与存在性都由语法保证）。
+    """
+    schema = _strip_meta(model.model_json_schema())
+    for node in [schema, *schema.get("$defs", {}).values()]:
+        props = node.get("properties")
+        if not props:
+            continue
+        node["required"] = list(props)
+        node["additionalProperties"] = False
+    return schema
+
+
+USER_SUMMARY_FORMAT = ollama_format(UserSummary)
+BATCH_SUMMARY_FORMAT = ollama_format(BatchSummary)
+
+
+# ====== 统计 ======
+class ParseStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.parsed = 0         # 一次通过严格校验
+        self.repaired = 0       # 修复后通过
+        self.failed = 0         # 修复也失败，走兜底
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.parsed + self.repaired + self.failed
+            return {
+                "parsed": self.parsed,
+                "repaired": self.repaired,
+                "failed": self.failed,
+                "repair_rate": round(self.repaired / total, 4) if total else 0.0,
+                "failure_rate": round(self.failed / total, 4) if total else 0.0,
+            }
+
+
+PARSE_STATS = ParseStats()
+
+
+# ====== 修复 ======
+_FENCE_RE = re.compile(r"```(?:json)?", re.I)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_BARE_LITERALS = (("None", "null"), ("True", "true"), ("False", "false"))
+
+
+def _loads_lenient(raw: str) -> Any:
+    """从夹带说明文字/代码围栏的输出里取出最外层 JSON 对象；取不出返回 None"""
+    text = _FENCE_RE.sub("", raw)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    body = text[start:end + 1]
+    for attempt in range(2):
+        try:
+            return json.loads(body)
+        except ValueError:
+            if attempt:
+                return None
+            body = _TRAILING_COMMA_RE.sub(r"\1", body)
+            if '"' not in body:
+                body = body.replace("'", '"')
+            for py, js in _BARE_LITERALS:
+                body = re.sub(rf"\b{py}\b", js, body)
+    return None
+
+
+def _coerce_price(value: Any) -> Optional[int]:
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value)) if value >= 0 else None
+    if isinstance(value, str):
+        plain = value.strip().lstrip("¥￥").replace(",", "")
+        for unit in ("块钱", "元", "块"):
+            plain = plain.removesuffix(unit)
+        if not plain or plain.lower() in ("null", "none"):
+            return None
+        number = parse_number(plain)
+        return int(number) if number is not None and number >= 0 else None
+    return None
+
+
+def _coerce_fields(obj: Dict[str, Any]) -> Dict[str, Any]:
+    intent = obj.get("intent")
+    if isinstance(intent, str):             # 缺 intent 仍判失败（交给兜底），只规整写法
+        intent = intent.strip().lower()
+        intent = intent if intent in INTENTS else INTENT_ALIASES.get(intent, "other")
+    notes = obj.get("notes")
+    return {
+        **obj,
+        "intent": intent,
+        "customer_price": _coerce_price(obj.get("customer_price")),
+        "notes": str(notes)[:NOTES_MAX] if notes is not None else "",
+    }
+
+
+def repair_summary(obj: Any) -> Optional[UserSummary]:
+    """已解析出的对象按字段规整后再校验（批量输出逐项也走这里）"""
+    if not isinstance(obj, dict):
+        return None
+    try:
+        return UserSummary.model_validate(_coerce_fields(obj))
+    except ValidationError:
+        return None
+
+
+def parse_summary(raw: str) -> Tuple[Optional[UserSummary], str]:
+    """模型输出 → (UserSummary 或 None, "parsed" | "repaired" | "failed")，并计入 PARSE_STATS"""
+    try:
+        summary, outcome = UserSummary.model_validate_json(raw), "parsed"
+    except ValidationError:
+        summary = repair_summary(_loads_lenient(raw))
+        outcome = "repaired" if summary is not None else "failed"
+    PARSE_STATS.record(outcome)
+    return summary, outcome
+
+
+def parse_batch(raw: str) -> Optional[List[Any]]:
+    """批量输出 → items 列表（元素为原始 dict，逐项再用 repair_summary 校验）；整体无法解析返回 None"""
+    try:
+        return [item.model_dump() for item in BatchSummary.model_validate_json(raw).items]
+    except ValidationError:
+        pass
+    try:
+        obj = json.loads(raw)
+    except ValueError:
+        obj = _loads_lenient(raw)
+    items = obj.get("items") if isinstance(obj, dict) else obj
+    return items if isinstance(items, list) else None
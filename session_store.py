@@ -0,0 +1,236 @@
+# session_store.py
+# 会话存储：把 FSM/ctx 的紧凑序列化状态放到进程外，便于多个 app worker 共享会话、重启不丢
+#   - MemorySessionStore：进程内 LRU（容量上限 + 空闲淘汰）
+#   - SQLiteSessionStore：本地 SQLite（WAL，多进程可共享），空闲淘汰
+# 记录为可 JSON 序列化的 dict，例如 {"fsm": fsm.dump_state(), "chat": [[user, bot], ...]}
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_IDLE_TTL = 30 * 60          # 秒：超过此时长未访问的会话被淘汰
+DEFAULT_MAX_SESSIONS = 10000
+EVICT_EVERY = 256                   # 每写入多少次顺带做一次空闲淘汰
+
+
+def _encode(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(blob: str) -> Dict[str, Any]:
+    return json.loads(blob)
+
+
+class SessionStore(ABC):
+    """会话存储接口：get / put / delete / evict_idle / snapshot / restore"""
+
+    idle_ttl: Optional[float] = DEFAULT_IDLE_TTL
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, session_id: str, record: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """淘汰空闲超过 idle_ttl 的会话，返回淘汰数量"""
+        ...
+
+    @abstractmethod
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    # —— 快照 / 恢复（JSON Lines，与后端无关，可在两种存储间迁移）—— #
+    def snapshot(self, path: str) -> int:
+        n = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for session_id, record in self.items():
+                f.write(_encode({"id": session_id, "record": record}) + "\n")
+                n += 1
+        return n
+
+    def restore(self, path: str) -> int:
+        n = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = _decode(line)
+                    self.put(row["id"], row["record"])
+                    n += 1
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__, "sessions": len(self), "idle_ttl": self.idle_ttl}
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 idle_ttl: Optional[float] = DEFAULT_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()   # id -> (last_access, blob)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.evicted = 0
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is None:
+                return None
+            last, blob = item
+            if self.idle_ttl and time.time() - last > self.idle_ttl:
+                del self._data[session_id]
+                self.evicted += 1
+                return None
+            self._data[session_id] = (time.time(), blob)
+            self._data.move_to_end(session_id)
+        return _decode(blob)
+
+    def put(self, session_id: str, record: Dict[str, Any]) -> None:
+        blob = _encode(record)
+        with self._lock:
+            self._data[session_id] = (time.time(), blob)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+                self.evicted += 1
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict_idle()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        if not self.idle_ttl:
+            return 0
+        cutoff = (now or time.time()) - self.idle_ttl
+        n = 0
+        with self._lock:
+            # OrderedDict 按最近访问排序，最旧的在前
+            while self._data:
+                session_id, (last, _) = next(iter(self._data.items()))
+                if last > cutoff:
+                    break
+                del self._data[session_id]
+                n += 1
+            self.evicted += n
+        return n
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = [(sid, blob) for sid, (_, blob) in self._data.items()]
+        for sid, blob in rows:
+            yield sid, _decode(blob)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "max_sessions": self.max_sessions, "evicted": self.evicted}
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str = "sessions.sqlite3", idle_ttl: Optional[float] = DEFAULT_IDLE_TTL):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.evicted = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        self._db.commit()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT data, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            blob, updated = row
+            if self.idle_ttl and now - updated > self.idle_ttl:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self._db.commit()
+                self.evicted += 1
+                return None
+            self._db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (now, session_id))
+            self._db.commit()
+        return _decode(blob)
+
+    def put(self, session_id: str, record: Dict[str, Any]) -> None:
+        blob = _encode(record)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+                (session_id, blob, time.time()),
+            )
+            self._db.commit()
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict_idle()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        if not self.idle_ttl:
+            return 0
+        cutoff = (now or time.time()) - self.idle_ttl
+        with self._lock:
+            n = self._db.execute("DELETE FROM sessions WHERE updated <= ?", (cutoff,)).rowcount
+            self._db.commit()
+            self.evicted += n
+        return n
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._db.execute("SELECT id, data FROM sessions").fetchall()
+        for sid, blob in rows:
+            yield sid, _decode(blob)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "path": self.path, "evicted": self.evicted}
+
+
+def open_store(url: str = "memory", idle_ttl: Optional[float] = DEFAULT_IDLE_TTL) -> SessionStore:
+    """按 URL 打开存储："memory" 或 "sqlite:///path/to/sessions.sqlite3" """
+    if url in ("", "memory"):
+        return MemorySessionStore(idle_ttl=idle_ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], idle_ttl=idle_ttl)
+    raise ValueError(f"unsupported session store url: {url}")
@@ -0,0 +1,179 @@
+# simulate.py
+# 向量化批量议价模拟：用 NumPy 对大量合成买家出价轨迹同时执行与 FSM 完全一致的 让价/持价/成交 策略
+# 用于调参（fraction_towards_user / round_base / min_tick / stop_floor / max_concessions …）
+# 用法：python simulate.py --paths 1000000 --turns 8 --grid fraction_towards_user=0.33,0.5,0.67 --grid min_tick=5,10
+
+from dataclasses import fields
+from itertools import product
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+
+import numpy as np
+
+from fsm import NegotiationCtx, CompiledNegotiationModel
+
+# 模拟中的状态编码（首轮出价后 INIT/ANCHOR 已自动进入 WAIT_USER）
+WAIT, HOLD, ACCEPT = 0, 1, 2
+STATE_NAMES = {WAIT: "WAIT_USER", HOLD: "HOLD", ACCEPT: "ACCEPT"}
+
+# 影响策略的 NegotiationCtx 配置项
+POLICY_FIELDS = [f.name for f in fields(NegotiationCtx)
+                 if f.init and f.name not in ("k", "last_user_offer", "ended", "history", "history_cap")]
+
+
+def synthetic_offers(n: int, turns: int, list_price: int = 500,
+                     seed: Optional[int] = None, skip_prob: float = 0.0) -> np.ndarray:
+    """
+    合成买家出价轨迹 (n, turns)：开价为标价的 60%~90%，每轮加价 0~5%，
+    加到各自的心理价位（标价的 80%~105%）为止；出价取整到 5。
+    skip_prob：某轮没有给出价格（-1，FSM 不推进）的概率。
+    """
+    rng = np.random.default_rng(seed)
+    start = list_price * rng.uniform(0.6, 0.9, size=(n, 1))
+    steps = list_price * rng.uniform(0.0, 0.05, size=(n, turns))
+    steps[:, 0] = 0
+    reservation = list_price * rng.uniform(0.8, 1.05, size=(n, 1))
+    offers = np.minimum(start + np.cumsum(steps, axis=1), reservation)
+    offers = (5 * np.round(offers / 5)).astype(np.int64)
+    if skip_prob > 0:
+        offers[rng.random(size=offers.shape) < skip_prob] = -1
+    return offers
+
+
+def simulate(offers: np.ndarray, **ctx_kwargs: Any) -> Dict[str, np.ndarray]:
+    """
+    对 offers (n, turns) 逐轮向量化执行 NegotiationModel.input_user_price 的策略。
+    offers 中 <0 表示该轮无价格（与 run_fsm_turn 未解析出价格时一致，FSM 不推进）。
+    返回每条轨迹的最终 state / ai_offer / k / close_turn（成交轮次，未成交为 -1）。
+    """
+    ctx = NegotiationCtx(**ctx_kwargs)
+    offers = np.asarray(offers, dtype=np.int64)
+    n, turns = offers.shape
+
+    floor = max(ctx.stop_floor, ctx.bar_price)
+    ai = np.full(n, ctx.list_price, dtype=np.int64)
+    k = np.zeros(n, dtype=np.int64)
+    state = np.full(n, WAIT, dtype=np.int8)
+    close_turn = np.full(n, -1, dtype=np.int64)
+
+    for t in range(turns):
+        u = offers[:, t]
+        active = (state == WAIT) & (u >= 0)
+
+        # —— guards（与 can_concede / should_hold / user_accepts 一一对应）—— #
+        accepts = u >= ai
+        stuck = (ai <= ctx.stop_floor) | (k >= ctx.max_concessions) | (ai <= floor)
+        concede = active & ~accepts & ~stuck
+        hold = active & stuck & ~accepts
+        accept = active & ~concede & ~hold & accepts
+
+        # —— after_concession —— #
+        raw_target = u + ctx.fraction_towards_user * (ai - u)
+        candidate = (ctx.round_base * np.round(raw_target / ctx.round_base)).astype(np.int64)
+        candidate = np.where(candidate >= ai, ai - ctx.min_tick, candidate)
+        candidate = np.maximum(candidate, floor)
+
+        ai = np.where(concede, candidate, ai)
+        k = np.where(concede, k + 1, k)
+        to_hold = hold | (concede & ((ai <= ctx.stop_floor) | (k >= ctx.max_concessions)))
+
+        state = np.where(to_hold, HOLD, state).astype(np.int8)
+        state = np.where(accept, ACCEPT, state).astype(np.int8)
+        close_turn = np.where(accept, t + 1, close_turn)
+
+    return {"state": state, "ai_offer": ai, "k": k, "close_turn": close_turn}
+
+
+def summarize(result: Dict[str, np.ndarray], stop_floor: int) -> Dict[str, Any]:
+    """把 simulate() 的逐轨迹结果汇总为分布指标。"""
+    state, ai, close_turn = result["state"], result["ai_offer"], result["close_turn"]
+    closed = state == ACCEPT
+    n = len(state)
+
+    def pct(x: np.ndarray) -> Dict[str, float]:
+        if x.size == 0:
+            return {"mean": None, "p10": None, "p50": None, "p90": None}
+        p10, p50, p90 = np.percentile(x, [10, 50, 90])
+        return {"mean": round(float(x.mean()), 2), "p10": float(p10), "p50": float(p50), "p90": float(p90)}
+
+    return {
+        "paths": n,
+        "deal_rate": round(float(closed.mean()), 4),
+        "hold_rate": round(float((state == HOLD).mean()), 4),
+        "floor_hit_rate": round(float((ai <= stop_floor).mean()), 4),
+        "final_price": pct(ai),
+        "deal_price": pct(ai[closed]),
+        "turns_to_close": pct(close_turn[closed]),
+    }
+
+
+def simulate_grid(offers: np.ndarray, grid: Dict[str, List[Any]],
+                  base: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """对参数网格的每个点跑一次 simulate()，返回 [{"params": ..., **summary}, ...]。"""
+    unknown = set(grid) - set(POLICY_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown NegotiationCtx fields: {sorted(unknown)}")
+    base = dict(base or {})
+    names = list(grid)
+    rows = []
+    for values in product(*(grid[name] for name in names)):
+        params = {**base, **dict(zip(names, values))}
+        ctx = NegotiationCtx(**params)
+        rows.append({"params": params, **summarize(simulate(offers, **params), ctx.stop_floor)})
+    return rows
+
+
+def verify_against_scalar(offers: np.ndarray, sample: int = 2000, model_cls=CompiledNegotiationModel,
+                          **ctx_kwargs: Any) -> int:
+    """
+    抽样用逐会话的 FSM 重放，与向量化结果逐条比对（state / ai_offer / k / close_turn）。
+    返回不一致的条数（0 表示等价）。
+    """
+    offers = np.asarray(offers, dtype=np.int64)[:sample]
+    vec = simulate(offers, **ctx_kwargs)
+    mismatches = 0
+    for i, row in enumerate(offers):
+        fsm = model_cls(NegotiationCtx(**ctx_kwargs))
+        close_turn = -1
+        for t, u in enumerate(row):
+            if u < 0:
+                continue
+            before = fsm.state
+            fsm.input_user_price(int(u))
+            if fsm.state == "ACCEPT" and before != "ACCEPT":
+                close_turn = t + 1
+        state = fsm.state if fsm.state != "INIT" else "WAIT_USER"
+        if (state != STATE_NAMES[int(vec["state"][i])] or fsm.ctx.ai_offer != vec["ai_offer"][i]
+                or fsm.ctx.k != vec["k"][i] or close_turn != vec["close_turn"][i]):
+            mismatches += 1
+    return mismatches
+
+
+def _parse_grid(items: List[str]) -> Dict[str, List[Any]]:
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        kind = float if name == "fraction_towards_user" else int
+        grid[name] = [kind(v) for v in values.split(",") if v]
+    return grid
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="向量化议价策略模拟")
+    ap.add_argument("--paths", type=int, default=1_000_000)
+    ap.add_argument("--turns", type=int, default=8)
+    ap.add_argument("--list-price", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--grid", action="append", default=[], help="name=v1,v2,... 可重复")
+    ap.add_argument("--verify", type=int, default=2000, help="与 FSM 逐条比对的抽样条数，0 跳过")
+    args = ap.parse_args()
+
+    offers = synthetic_offers(args.paths, args.turns, args.list_price, seed=args.seed)
+    grid = _parse_grid(args.grid) or {"fraction_towards_user": [1 / 2]}
+    base = {"list_price": args.list_price}
+
+    for row in simulate_grid(offers, grid, base):
+        if args.verify:
+            row["scalar_mismatches"] = verify_against_scalar(offers, args.verify, **row["params"])
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,258 @@
+# speculative.py
+# 推测式话术：抽取 LLM 与话术 LLM 原本串行（两次生成相加），这里让二者重叠：
+#   1) 本地猜测：rule_extract 的 intent + 价格（规则没取到时用 extract_price_from_text），几乎零开销
+#   2) 空跑：在 FSM 克隆（dump_state / load_state）上按猜测推进一步，得到预测的 core_view（不动原会话）
+#   3) 预测 core_view 的话术流与正式抽取并发启动，输出先缓冲、不下发
+#   4) 正式抽取返回后推进真实 FSM：话术提示涉及的字段（NLG_FIELDS + token_budget）与预测一致则采用缓冲的流
+#      （命中，省下的时间 = 抽取期间话术已经跑掉的部分）；不一致则取消推测流、按正式 core_view 重新生成
+# 规则快路径本身就能确定抽取结果时不做推测（抽取不调 LLM，没有可重叠的时间）。
+# 命中率与节省的延迟计入 "speculative" 指标；每轮在 trace 里记一个 speculate span。
+# 默认关闭（SPECULATIVE_NLG=1 开启）：未命中时多消耗一次（被取消的）话术生成。
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import os
+import queue
+import threading
+import time
+
+import bridge
+import llama
+import tracing
+from fastpath import rule_extract
+from prompt_compiler import NLG_FIELDS, render_fields
+
+SPECULATIVE_NLG = os.getenv("SPECULATIVE_NLG", "0") == "1"
+SPECULATIVE_STAGE = "nlg_speculative"
+
+# 同步版的推测话术在线程里跑（异步版用 asyncio 任务）
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="speculate")
+_DONE = object()
+
+
+class _Failed:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class SpeculationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0        # 快路径可确定抽取结果，不推测
+        self.saved_s = 0.0      # 命中时与抽取重叠掉的话术耗时
+
+    def record(self, outcome: str, saved_s: float = 0.0) -> None:
+        with self._lock:
+            if outcome != "skipped":
+                self.attempts += 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.saved_s += saved_s
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": round(self.hits / self.attempts, 4) if self.attempts else 0.0,
+                "mean_saved_ms": round(self.saved_s / self.hits * 1000, 2) if self.hits else 0.0,
+                "total_saved_s": round(self.saved_s, 3),
+            }
+
+
+STATS = SpeculationStats()
+tracing.register_gauges("speculative", STATS.as_dict)
+
+
+# ====== 预测 ======
+def predict_summary(user_text: str) -> Dict[str, Any]:
+    """本地猜测抽取结果（与 user_summary 同构，另带 confidence）"""
+    guess = rule_extract(user_text)
+    if guess.get("customer_price") is None:
+        guess["customer_price"] = bridge.extract_price_from_text(user_text)
+    return guess
+
+
+def dry_run(fsm, summary: Dict[str, Any]) -> Dict[str, Any]:
+    """在 FSM 克隆上推进一步，返回预测的 core_view（原 FSM 不变）"""
+    clone = type(fsm).load_state(fsm.dump_state())
+    snap, contract = bridge.step_fsm(clone, summary)
+    return bridge.extract_core_view(summary, snap, contract)
+
+
+def nlg_key(core_view: Dict[str, Any]) -> str:
+    """话术只看这些字段：两份 core_view 的键相同，则提示完全相同"""
+    return f"{core_view.get('token_budget')}|{render_fields(core_view, NLG_FIELDS)}"
+
+
+# ====== 推测话术流（先缓冲、确认后放行）======
+class _Prefetch:
+    """同步版：线程里迭代话术流写入队列；abandon() 后在下一个增量处关闭流"""
+
+    def __init__(self, make_stream: Callable[[], Iterator[str]]):
+        self.t0 = time.perf_counter()
+        self.done_s: Optional[float] = None
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._abandoned = threading.Event()
+        _PREFETCH_POOL.submit(self._pump, make_stream)
+
+    def _pump(self, make_stream: Callable[[], Iterator[str]]) -> None:
+        tracing.detach()
+        stream = make_stream()
+        try:
+            for delta in stream:
+                if self._abandoned.is_set():
+                    break
+                self._queue.put(delta)
+        except Exception as e:
+            self._queue.put(_Failed(e))
+        finally:
+            stream.close()
+            self.done_s = time.perf_counter() - self.t0
+            self._queue.put(_DONE)
+
+    def abandon(self) -> None:
+        self._abandoned.set()
+
+    def drain(self) -> Iterator[str]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield item
+        finally:
+            self.abandon()
+
+
+class _APrefetch:
+    """asyncio 版：后台任务迭代话术流写入队列；cancel() 立即取消（连同底层 HTTP 流）"""
+
+    def __init__(self, stream: AsyncIterator[str]):
+        self.t0 = time.perf_counter()
+        self.done_s: Optional[float] = None
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[str]) -> None:
+        tracing.detach()        # 任务有自己的上下文副本，不影响调用方
+        try:
+            async for delta in stream:
+                self._queue.put_nowait(delta)
+        except Exception as e:
+            self._queue.put_nowait(_Failed(e))
+        finally:
+            await stream.aclose()
+            self.done_s = time.perf_counter() - self.t0
+            self._queue.put_nowait(_DONE)
+
+    async def cancel(self) -> None:
+        if not self._task.done():
+            self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def drain(self) -> AsyncIterator[str]:
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield item
+        finally:
+            await self.cancel()
+
+
+def _saved_s(prefetch, committed_at: float) -> float:
+    """命中时节省的时间：推测流在抽取返回前已经跑掉的部分"""
+    elapsed = committed_at - prefetch.t0
+    return min(elapsed, prefetch.done_s) if prefetch.done_s is not None else elapsed
+
+
+def _should_speculate(guess: Dict[str, Any]) -> bool:
+    # 快路径会直接采用规则结果：抽取不调 LLM，推测没有收益
+    return guess["confidence"] < bridge.FASTPATH_THRESHOLD
+
+
+def _settle(sp: tracing.Span, predicted: Dict[str, Any], actual: Dict[str, Any], prefetch) -> bool:
+    hit = nlg_key(predicted) == nlg_key(actual)
+    saved = _saved_s(prefetch, time.perf_counter()) if hit else 0.0
+    STATS.record("hits" if hit else "misses", saved)
+    sp.set(hit=hit, saved_ms=round(saved * 1000, 2), predicted_price=predicted.get("customer_price"))
+    return hit
+
+
+# ====== 入口 ======
+def run_turn(
+    fsm,
+    user_text: str,
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    trace: Optional[tracing.TurnTrace] = None,
+) -> Tuple[Dict[str, Any], Iterator[str]]:
+    """
+    run_fsm_turn + nlg_stream_from_core_view 的推测版本：返回 (run_fsm_turn 的结果, 话术增量迭代器)。
+    FSM 始终按正式抽取结果推进；命中时迭代器先吐出已缓冲的部分。
+    """
+    guess = predict_summary(user_text)
+    if not _should_speculate(guess):
+        STATS.record("skipped")
+        out = bridge.run_fsm_turn(fsm, user_text)
+        return out, llama.nlg_stream_from_core_view(user_text, out["core_view"], value_reasons, cta, trace=trace)
+
+    predicted = dry_run(fsm, guess)
+    prefetch = _Prefetch(lambda: llama.nlg_stream_from_core_view(
+        user_text, predicted, value_reasons, cta, stage=SPECULATIVE_STAGE))
+    try:
+        out = bridge.run_fsm_turn(fsm, user_text)
+    except BaseException:
+        prefetch.abandon()
+        raise
+    with tracing.span("speculate", trace=trace) as sp:
+        if _settle(sp, predicted, out["core_view"], prefetch):
+            return out, prefetch.drain()
+        prefetch.abandon()
+    return out, llama.nlg_stream_from_core_view(user_text, out["core_view"], value_reasons, cta, trace=trace)
+
+
+async def arun_turn(
+    fsm,
+    user_text: str,
+    value_reasons: Optional[List[str]] = None,
+    cta: Optional[str] = "",
+    trace: Optional[tracing.TurnTrace] = None,
+) -> Tuple[Dict[str, Any], AsyncIterator[str]]:
+    """run_turn 的 asyncio 版本：未命中时推测流连同 HTTP 请求立即取消"""
+    guess = predict_summary(user_text)
+    if not _should_speculate(guess):
+        STATS.record("skipped")
+        out = await bridge.arun_fsm_turn(fsm, user_text)
+        return out, llama.anlg_stream_from_core_view(user_text, out["core_view"], value_reasons, cta, trace=trace)
+
+    predicted = dry_run(fsm, guess)
+    prefetch = _APrefetch(llama.anlg_stream_from_core_view(
+        user_text, predicted, value_reasons, cta, stage=SPECULATIVE_STAGE))
+    try:
+        out = await bridge.arun_fsm_turn(fsm, user_text)
+    except BaseException:
+        await prefetch.cancel()
+        raise
+    with tracing.span("speculate", trace=trace) as sp:
+        hit = _settle(sp, predicted, out["core_view"], prefetch)
+    if hit:
+        return out, prefetch.drain()
+    await prefetch.cancel()
+    return out, llama.anlg_stream_from_core_view(user_text, out["core_view"], value_reasons, cta, trace=trace)
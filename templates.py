@@ -0,0 +1,141 @@
+# templates.py
+# 确定性话术模板：结果已由 FSM 完全确定的轮次（成交 ACCEPT；到底价 HOLD 且 can_negotiate=false）
+# 不调用 LLM，按 (phase, intent, allowed_actions) 选模板、用 core_view / value_reasons 填空，微秒级返回。
+#   - 每个键有多种说法，按用户原话稳定选择（同一句话同一回复，便于复现）
+#   - 查找顺序：精确键 → (phase, intent, *)；找不到（如 ACCEPT 阶段用户在提问）返回 None，由调用方回退到 LLM
+#   - 模板里唯一的数字是 {offer}（= offer_to_show），调用方仍会再过一遍价格护栏
+#   - LLM 不可用（熔断/超时）时 force=True：任何阶段都用模板兜底，依次再退到 (phase, *, *)、(*, *, *) 通用说法
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import threading
+import zlib
+
+ANY = "*"
+
+# 默认启用模板的阶段判定（与 SYSTEM_PROMPT 第 3、4 条一致：结果固定，只剩措辞）
+def is_deterministic(core_view: Dict[str, Any]) -> bool:
+    phase = core_view.get("phase")
+    if phase == "ACCEPT":
+        return True
+    return phase == "HOLD" and not core_view.get("can_negotiate", False)
+
+
+def actions_key(allowed_actions: Optional[Sequence[str]]) -> str:
+    return ",".join(sorted(allowed_actions or [])) or ANY
+
+
+TemplateKey = Tuple[str, str, str]       # (phase, intent, actions_key)
+
+TEMPLATES: Dict[TemplateKey, List[str]] = {
+    # —— 成交 —— #
+    ("ACCEPT", "accept", ANY): [
+        "好的，我们给出的成交价为{offer}元，{reason}，{cta}",
+        "没问题，我们给出的成交价为{offer}元，{cta}",
+        "感谢支持，我们给出的成交价为{offer}元，{reason}，{cta}",
+    ],
+    ("ACCEPT", "counter_offer", ANY): [
+        "可以的，我们给出的成交价为{offer}元，{reason}，{cta}",
+        "就按这个来，我们给出的成交价为{offer}元，{cta}",
+        "成交！我们给出的成交价为{offer}元，{reason}，{cta}",
+    ],
+    # 以下 (phase, *, *) / (*, *, *) 通用说法只在 force=True 时用到
+    ("ACCEPT", ANY, ANY): [
+        "好的，我们给出的成交价为{offer}元，{cta}",
+        "我们给出的成交价为{offer}元，{reason}，{cta}",
+    ],
+    # —— 到底价，不再让 —— #
+    ("HOLD", "counter_offer", ANY): [
+        "这已经是最低了，我们给出的成交价为{offer}元，{reason}，{cta}",
+        "实在抱歉没法再低了，我们给出的成交价为{offer}元，{cta}",
+        "价格已经到底，我们给出的成交价为{offer}元，{reason}，{cta}",
+    ],
+    ("HOLD", "ask", ANY): [
+        "目前我们给出的成交价为{offer}元，已是最低，{reason}，{cta}",
+        "我们给出的成交价为{offer}元，这是能给到的最低价，{cta}",
+    ],
+    ("HOLD", ANY, ANY): [
+        "我们给出的成交价为{offer}元，已是最低价，{reason}，{cta}",
+        "抱歉价格没法再动了，我们给出的成交价为{offer}元，{cta}",
+    ],
+    # —— 降级兜底（仅 force=True 时用到）—— #
+    ("WAIT_USER", "counter_offer", ANY): [
+        "您的报价我们认真考虑过了，我们给出的成交价为{offer}元，{reason}，{cta}",
+        "这个价格有点难，我们给出的成交价为{offer}元，{cta}",
+    ],
+    (ANY, ANY, ANY): [
+        "我们给出的成交价为{offer}元，{reason}，{cta}",
+        "目前我们给出的成交价为{offer}元，{cta}",
+    ],
+}
+
+DEFAULT_CTA = {
+    "ACCEPT": "确认后我马上为您锁单发货。",
+    "HOLD": "需要的话现在就可以为您下单。",
+    ANY: "您看合适的话我马上为您下单。",
+}
+# 连 offer 都没有时的兜底（不含任何价格）
+BUSY_REPLY = "抱歉，系统有点忙，请您稍后再发一次，我马上为您处理。"
+DEFAULT_REASON = "正品保障与售后"
+
+
+class TemplateStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0           # 模板直接回复
+        self.misses = 0         # 确定性阶段但没有匹配模板（回退 LLM）
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+STATS = TemplateStats()
+
+
+def template_stats() -> Dict[str, Any]:
+    return STATS.as_dict()
+
+
+def lookup(phase: str, intent: str, allowed_actions: Optional[Sequence[str]],
+           force: bool = False) -> Optional[List[str]]:
+    """按 intent 精确查找；force=True 时再退到阶段通用与全局通用说法（降级兜底总有话可说）"""
+    akey = actions_key(allowed_actions)
+    keys = [(phase, intent, akey), (phase, intent, ANY)]
+    if force:
+        keys += [(phase, ANY, ANY), (ANY, ANY, ANY)]
+    for key in keys:
+        variants = TEMPLATES.get(key)
+        if variants:
+            return variants
+    return None
+
+
+def render_template(last_user_text: str, core_view: Dict[str, Any],
+                    value_reasons: Optional[List[str]] = None, cta: Optional[str] = "",
+                    force: bool = False) -> Optional[str]:
+    """为确定性阶段（force=True 时任何阶段）生成话术；不适用或没有模板时返回 None（调用方回退到 LLM）"""
+    if not force and not is_deterministic(core_view):
+        return None
+    phase = core_view.get("phase", "")
+    variants = lookup(phase, (core_view.get("intent") or "other").lower(), core_view.get("allowed_actions"), force)
+    if not variants:
+        STATS.record(False)
+        return None
+    offer = core_view.get("offer_to_show")
+    if offer is None:
+        STATS.record(False)
+        return None
+
+    # 按原话稳定选择一种说法
+    tpl = variants[zlib.crc32(f"{last_user_text}|{offer}".encode("utf-8")) % len(variants)]
+    reason = (value_reasons or [DEFAULT_REASON])[0]
+    text = tpl.format(offer=int(offer), reason=reason, cta=(cta or DEFAULT_CTA.get(phase, DEFAULT_CTA[ANY])).strip())
+    STATS.record(True)
+    return text.rstrip("，,")
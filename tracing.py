@@ -0,0 +1,322 @@
+# tracing.py
+# 单轮流水线的分阶段耗时追踪：抽取 LLM → FSM → core_view → NLG LLM → 价格护栏
+#   - 每个阶段一个 span：墙钟耗时 + 属性（提示/回复长度、Ollama eval 计数与加载耗时、快路径/缓存命中…）
+#   - 每轮结束写入滚动 JSONL 文件（TRACE_FILE）
+#   - 按阶段维护直方图，导出 Prometheus 文本格式（含 p50/p95/p99）
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")     # 设为空串关闭落盘
+TRACE_FILE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_FILE_BACKUPS = 5
+RESERVOIR_SIZE = 2048               # 每个阶段保留最近多少个样本用于分位数
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+METRIC_PREFIX = "csbot"
+
+# Ollama 响应体中的统计字段（时长单位为纳秒）
+OLLAMA_COUNTS = ("prompt_eval_count", "eval_count")
+OLLAMA_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+
+
+# ====== 直方图 ======
+class Histogram:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.samples: Deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += seconds
+            self.samples.append(seconds)
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    self.buckets[i] += 1
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)) -> Dict[float, float]:
+        with self._lock:
+            data = sorted(self.samples)
+        if not data:
+            return {q: 0.0 for q in qs}
+        return {q: data[min(int(q * len(data)), len(data) - 1)] for q in qs}
+
+
+_hist_lock = threading.Lock()
+HISTOGRAMS: Dict[str, Histogram] = {}
+
+
+def observe(stage: str, seconds: float) -> None:
+    h = HISTOGRAMS.get(stage)
+    if h is None:
+        with _hist_lock:
+            h = HISTOGRAMS.setdefault(stage, Histogram())
+    h.observe(seconds)
+
+
+# ====== Span / TurnTrace ======
+class Span:
+    __slots__ = ("name", "start", "duration_ms", "attrs")
+
+    def __init__(self, name: str, **attrs: Any):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.attrs: Dict[str, Any] = dict(attrs)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def add_ollama(self, data: Dict[str, Any]) -> None:
+        """记录 Ollama 响应体里的 eval 计数与各阶段耗时（ns → ms）"""
+        for key in OLLAMA_COUNTS:
+            if key in data:
+                self.attrs[key] = data[key]
+        for key in OLLAMA_DURATIONS:
+            if key in data:
+                self.attrs["ollama_" + key.replace("_duration", "_ms")] = round(data[key] / 1e6, 2)
+
+    def finish(self) -> None:
+        if self.duration_ms is None:
+            self.duration_ms = round((time.perf_counter() - self.start) * 1000, 3)
+            observe(self.name, self.duration_ms / 1000)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"stage": self.name, "ms": self.duration_ms, **self.attrs}
+
+
+class TurnTrace:
+    """一轮对话的全部 span。流式场景下跨 yield 显式传递（不依赖 contextvars）。"""
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.total_ms: Optional[float] = None
+        self._token: Optional[Token] = None          # start_turn 设置当前轮时的 token，end_turn 用来复位
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        sp = Span(name, **attrs)
+        self.spans.append(sp)
+        token = _current_span.set(sp)
+        try:
+            yield sp
+        finally:
+            sp.finish()
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # 生成器跨线程/跨上下文恢复时 token 不可用，直接清空
+                _current_span.set(None)
+
+    def finish(self) -> Dict[str, Any]:
+        if self.total_ms is None:
+            self.total_ms = round((time.perf_counter() - self.start) * 1000, 3)
+            observe("turn", self.total_ms / 1000)
+            _write_trace(self.as_dict())
+        return self.as_dict()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "turn_id": self.turn_id,
+            "session_id": self.session_id,
+            "ts": round(self.ts, 3),
+            "total_ms": self.total_ms,
+            "spans": [sp.as_dict() for sp in self.spans],
+        }
+
+
+_current_turn: ContextVar[Optional[TurnTrace]] = ContextVar("csbot_turn", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("csbot_span", default=None)
+
+
+def start_turn(session_id: Optional[str] = None) -> TurnTrace:
+    """开始一轮并设为当前轮；调用方须在 finally 中 end_turn(trace)"""
+    trace = TurnTrace(session_id)
+    trace._token = _current_turn.set(trace)
+    return trace
+
+
+def end_turn(trace: TurnTrace) -> Dict[str, Any]:
+    """
+    结束一轮：写出追踪（与 trace.finish() 一样幂等）并复位当前轮。
+    复用的工作线程（Gradio 线程池、ThreadingHTTPServer）里，下一个请求的 span 不会挂到已结束的这一轮上。
+    """
+    try:
+        return trace.finish()
+    finally:
+        token, trace._token = trace._token, None
+        if token is not None:
+            try:
+                _current_turn.reset(token)
+            except ValueError:
+                # 异步生成器跨上下文恢复时 token 不可用：仍指向这一轮才清空
+                if _current_turn.get() is trace:
+                    _current_turn.set(None)
+
+
+def current_turn() -> Optional[TurnTrace]:
+    return _current_turn.get()
+
+
+def detach() -> None:
+    """当前上下文（线程 / asyncio 任务）不再归属任何一轮：之后的 span 只计入直方图（推测执行等后台工作用）"""
+    _current_turn.set(None)
+    _current_span.set(None)
+
+
+@contextmanager
+def span(name: str, trace: Optional[TurnTrace] = None, **attrs: Any) -> Iterator[Span]:
+    """在 trace（缺省为当前轮）中记录一个阶段；没有进行中的轮次时只计入直方图。"""
+    trace = trace or _current_turn.get()
+    if trace is not None:
+        with trace.span(name, **attrs) as sp:
+            yield sp
+        return
+    sp = Span(name, **attrs)
+    token = _current_span.set(sp)
+    try:
+        yield sp
+    finally:
+        sp.finish()
+        _current_span.reset(token)
+
+
+def annotate(**attrs: Any) -> None:
+    sp = _current_span.get()
+    if sp is not None:
+        sp.set(**attrs)
+
+
+def record_ollama(data: Dict[str, Any], messages: Optional[List[Dict[str, str]]] = None,
+                  response: Optional[str] = None, target: Optional[Span] = None) -> None:
+    """把一次 Ollama 调用的提示/回复长度与响应统计记到当前（或指定）span"""
+    sp = target or _current_span.get()
+    if sp is None:
+        return
+    if messages is not None:
+        sp.set(prompt_chars=sum(len(m.get("content", "")) for m in messages))
+    if response is not None:
+        sp.set(response_chars=len(response))
+    sp.add_ollama(data)
+
+
+# ====== JSONL 落盘（滚动）======
+_trace_logger: Optional[logging.Logger] = None
+_trace_logger_lock = threading.Lock()
+
+
+def _write_trace(record: Dict[str, Any]) -> None:
+    global _trace_logger
+    if not TRACE_FILE:
+        return
+    if _trace_logger is None:
+        with _trace_logger_lock:
+            if _trace_logger is None:
+                logger = logging.getLogger("csbot.trace")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES,
+                                              backupCount=TRACE_FILE_BACKUPS, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                _trace_logger = logger
+    _trace_logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+
+# ====== 汇总与 Prometheus 导出 ======
+_gauge_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_gauges(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """注册额外指标（如快路径/缓存统计），provider 返回 {指标名: 数值}"""
+    _gauge_providers[name] = provider
+
+
+def stage_summary() -> List[List[Any]]:
+    """[[阶段, 次数, p50 ms, p95 ms, p99 ms], ...]，供调试台表格展示"""
+    rows = []
+    for stage, h in sorted(HISTOGRAMS.items()):
+        q = h.quantiles()
+        rows.append([stage, h.count] + [round(q[p] * 1000, 2) for p in (0.5, 0.95, 0.99)])
+    return rows
+
+
+def gauges() -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for name, provider in _gauge_providers.items():
+        try:
+            out[name] = provider()
+        except Exception as e:
+            out[name] = {"error": str(e)}
+    return out
+
+
+def metrics_text() -> str:
+    name = f"{METRIC_PREFIX}_stage_latency_seconds"
+    lines = [f"# HELP {name} Per-stage latency of the negotiation turn pipeline.",
+             f"# TYPE {name} histogram"]
+    for stage, h in sorted(HISTOGRAMS.items()):
+        with h._lock:
+            buckets, total, count = list(h.buckets), h.sum, h.count
+        for le, n in zip(BUCKETS, buckets):
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {n}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+    qname = f"{METRIC_PREFIX}_stage_latency_quantile_seconds"
+    lines += [f"# HELP {qname} Recent p50/p95/p99 per stage (last {RESERVOIR_SIZE} samples).",
+              f"# TYPE {qname} gauge"]
+    for stage, h in sorted(HISTOGRAMS.items()):
+        for q, v in h.quantiles().items():
+            lines.append(f'{qname}{{stage="{stage}",quantile="{q}"}} {v:.6f}')
+
+    for group, values in sorted(gauges().items()):
+        for key, v in sorted(values.items()):
+            if isinstance(v, bool):
+                v = int(v)
+            if isinstance(v, (int, float)):
+                metric = f"{METRIC_PREFIX}_{group}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {v}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """后台线程提供 GET /metrics（Prometheus 文本格式）"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server